@@ -0,0 +1,55 @@
+"""
+Logging off the hot paths.
+
+Records are put on a queue by the calling thread, a background listener thread does the
+formatting and the writing (console, rotating file on the SD card).
+"""
+import atexit
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+class QueueListenerHandler(QueueHandler):
+    """Use in settings.LOGGING with handlers given as 'cfg://handlers.<name>'"""
+
+    def __init__(self, handlers, respect_handler_level=True):
+        super().__init__(queue.Queue(-1))
+        handlers = [handlers[i] for i in range(len(handlers))]  # indexing resolves the cfg:// references
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=respect_handler_level)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Writes what is left in the queue, can be called more than once"""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def prepare(self, record):
+        """Only merge the message, formatting with asctime & co is left to the listener thread"""
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def formatException(self, exc_info):
+        import traceback
+        return ''.join(traceback.format_exception(*exc_info)).rstrip('\n')
+
+
+class Throttle:
+    """For logging in loops, ready() is True at most once per period [s]"""
+
+    def __init__(self, period=1.):
+        self.period = period
+        self._last = None
+
+    def ready(self):
+        now = time.monotonic()
+        if self._last is None or now - self._last >= self.period:
+            self._last = now
+            return True
+        return False
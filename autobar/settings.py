@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'widget_tweaks',
     'bootstrap_modal_forms',
     'recipes',  # our models
+    'hardware',  # management commands
     #'django_extensions',  # for graph_models
 ]
 
@@ -80,7 +81,7 @@ WSGI_APPLICATION = 'autobar.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'NAME': os.environ.get('AUTOBAR_DATABASE', os.path.join(BASE_DIR, 'db.sqlite3')),  # one per process of a local fleet
     }
 }
 
@@ -111,6 +112,11 @@ LOGGING = {
             'formatter': 'verbose',
             'level': 'DEBUG',
         },
+        'queue': {  # configured after 'console' and 'file' since handlers are sorted by name
+            '()': 'autobar.log.QueueListenerHandler',
+            'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+            'level': 'DEBUG',
+        },
     },
     'loggers': {
         'django': {
@@ -119,7 +125,7 @@ LOGGING = {
             'level': 'ERROR',
         },
         'autobar': {
-            'handlers': ['console', 'file'],
+            'handlers': ['queue'],  # console and file, written by a background thread
             'level': 'DEBUG',
         },
     }
@@ -167,6 +173,35 @@ UPLOAD_FOR_MIX = 'mixes'
 # Settings for UX behaviour
 # moved to recipes.models.Configuration
 
+# HARDWARE DAEMON
+# None runs the hardware inside the web process (runserver --noreload only)
+# otherwise run `python3 manage.py runhardware` and the web workers talk to it on this socket
+HARDWARE_SOCKET = None  # such as '/tmp/autobar-hardware.sock'
+
+# FLEET
+# several bars sharing the catalog and the guests orders, see recipes/fleet.py
+# run `python3 manage.py runcoordinator` on one machine and `python3 manage.py runnode` next to each bar
+FLEET_COORDINATOR = None  # such as 'http://192.168.1.10:8100', None for a standalone bar
+FLEET_NODE_NAME = None  # name of this bar in the fleet, the host name by default
+FLEET_NODE_URL = None  # where the coordinator reaches the web server of this bar, such as 'http://192.168.1.11:8000'
+FLEET_TOKEN = None  # shared secret of the fleet requests and catalog exports, they are all refused while None
+FLEET_ROUTE_ORDERS = False  # the kiosk sends its orders to the coordinator, which picks the bar with the shortest wait
+FLEET_HEARTBEAT = 2  # [s] between two reports of a node
+FLEET_NODE_TIMEOUT = 10  # [s] a node silent for longer gets no orders
+FLEET_DEFAULT_SERVE_TIME = 60  # [s] per order, until a bar has served some
+
+# SCRAPER
+# `python3 manage.py scrap` downloads thecocktaildb.com, a rerun resumes and reads the responses from the cache
+SCRAP_CACHE_DIR = os.path.join(BASE_DIR, 'scrap-cache')  # HTTP responses, None to disable
+SCRAP_CHECKPOINT = os.path.join(BASE_DIR, 'scrap-checkpoint.json')  # letters and drinks done
+
+# CATALOG SYNC
+# `python3 manage.py synccatalog pull http://other-bar:8000` copies the catalog changes of another bar, see recipes/sync.py
+CATALOG_SYNC_STATE = os.path.join(BASE_DIR, 'catalog-sync.json')  # watermark of each source
+
+# GPIO module of the weight cell, 'hardware.fakegpio.emulated_gpio' runs the HX711 code off the Pi
+GPIO_BACKEND = 'RPi.GPIO'
+
 # PINS in BCM numbering
 GPIO_PUMPS = [27, 22, 23, 24, 25, 5, 6, 12, 16, 26]
 GPIO_DT = 17
@@ -175,9 +210,30 @@ GPIO_RED_BUTTON = 7
 GPIO_GREEN_BUTTON = 8
 GPIO_GREEN_BUTTON_LED = 13
 
+# SERVING STATIONS
+# each glass position has its own scale, green button and LED, dispensers are assigned to a station in the admin
+# the pumps power budget (hardware_max_running_pumps) is shared, the red button stops every station
+# 'config' overrides Configuration fields for that station, such as its weight_cell_offset and weight_cell_ratio
+STATIONS = [
+    {'dt': GPIO_DT, 'sck': GPIO_SCK, 'green_button': GPIO_GREEN_BUTTON, 'green_button_led': GPIO_GREEN_BUTTON_LED, 'config': {}},
+]
+
 # WEIGHT MODULE
 # moved to recipes.models.Configuration
 MAX_MEASURABLE_WEIGHT = 1000  # [g]
+WEIGHT_STREAM_PATH = '/dev/shm/autobar-weight'  # samples shared with other processes, None to disable
+WEIGHT_STREAM_SLOTS = 4096  # number of samples kept in the ring buffer
+TRACE_DIR = os.path.join(BASE_DIR, 'traces')  # weight trace of each order, None to disable
+TRACE_MAX_FILES = 200  # the oldest traces are removed
+TRACE_MAX_FILE_SIZE = 4 * 1024 * 1024  # [bytes] a trace stops growing at this size
+TIMESERIES_DIR = os.path.join(BASE_DIR, 'timeseries')  # weight, pumps and order history, None to disable
+TIMESERIES_RETENTION = {  # [s] how long each tier is kept, by resolution [s] (0 for the raw samples)
+    0: 6 * 3600,
+    1: 7 * 24 * 3600,
+    10: 60 * 24 * 3600,
+    60: 2 * 365 * 24 * 3600,
+}
+TIMESERIES_SAVE_PERIOD = 10  # [s] the chunks being filled are rewritten that often, what a crash loses at most
 
 # DELAYS and TIMEOUTS
 # moved to recipes.models.Configuration
@@ -0,0 +1,87 @@
+"""
+Weight cell calibration from several reference weights.
+
+The model of WeightModule is weight = ratio * d + quadratic * d**2 with d = raw - offset.
+Points are (raw, grams) pairs, fitted with least squares. Zero drift is tracked by the
+WeightModule itself while the scale is idle and empty, see WeightModule.track_zero.
+"""
+from statistics import median
+
+import numpy as np
+
+
+class CalibrationError(Exception):
+    pass
+
+
+def collect_point(weight_module, reads=50, max_failures=50):
+    """Median of reads valid raw values, the load must not move meanwhile"""
+    values = []
+    failures = 0
+    weight_module.power_up()
+    while len(values) < reads:
+        with weight_module.lock:
+            value = weight_module.cell._read()
+        if value is False:
+            failures += 1
+            if failures > max_failures:
+                raise CalibrationError('Too many failed reads from the weight cell')
+            continue
+        values.append(value)
+    return median(values)
+
+
+def fit(points, quadratic=False):
+    """
+    points is a list of (raw, grams), at least 2 (3 with quadratic) with different raw values.
+    Returns offset, ratio, quadratic and the residuals [g] of each point.
+    """
+    degree = 2 if quadratic else 1
+    raw = np.array([point[0] for point in points], dtype=float)
+    grams = np.array([point[1] for point in points], dtype=float)
+    if len(np.unique(raw)) <= degree:
+        raise CalibrationError('Need at least %i different reference points' % (degree + 1))
+    # centered and scaled, raw counts are large numbers
+    center, scale = raw.mean(), max(raw.std(), 1.)
+    x = (raw - center) / scale
+    coefficients, *_ = np.linalg.lstsq(np.vander(x, degree + 1), grams, rcond=None)
+    polynomial = np.poly1d(coefficients)
+    # expand around the raw value reading 0 g, the tare
+    roots = [root.real for root in polynomial.roots if abs(root.imag) < 1e-9]
+    if not roots:
+        raise CalibrationError('The fitted curve never reads 0 g')
+    zero = min(roots, key=abs)
+    derivative = polynomial.deriv()(zero)
+    if derivative == 0:
+        raise CalibrationError('The fitted curve is flat at 0 g')
+    second = coefficients[0] if quadratic else 0.
+    residuals = (polynomial(x) - grams).tolist()
+    return {
+        'offset': float(center + zero * scale),
+        'ratio': float(derivative / scale),
+        'quadratic': float(second / scale ** 2),
+        'residuals': residuals,
+        'rms': float(np.sqrt(np.mean(np.square(residuals)))),
+    }
+
+
+def calibrate(weight_module, references, place=None, reads=50, quadratic=False):
+    """
+    references are the weights [g] to put on the scale one after the other, starting with 0.
+    place(grams) is called before each point, it returns once the weight is on the scale.
+    """
+    points = []
+    for grams in references:
+        if place is not None:
+            place(grams)
+        points.append((collect_point(weight_module, reads), grams))
+    result = fit(points, quadratic)
+    result['points'] = points
+    return result
+
+
+def save(config, result):
+    config.weight_cell_offset = result['offset']
+    config.weight_cell_ratio = result['ratio']
+    config.weight_cell_quadratic = result['quadratic']
+    config.save()
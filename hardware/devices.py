@@ -0,0 +1,110 @@
+import threading
+
+from django.conf import settings
+from django.utils.log import logging
+
+from gpiozero import Button, LED, GPIODeviceClosed
+from gpiozero.pins.mock import MockFactory, MockPWMPin
+
+from hardware import trace
+from hardware.pumps import Pumps
+
+logger = logging.getLogger('autobar')
+
+
+class DevicePool:
+    """
+    Long-lived gpiozero devices owned by the artist.
+
+    Pins are set up once, threads borrow the green button and LED of their station instead of creating them.
+    Button timings and the pumps power budget are updated in place when the configuration changes,
+    devices are only rebuilt when the kind of hardware (dummy, PWM) changes.
+    """
+    def __init__(self):
+        self._kind = None
+        self._green_locks = [threading.Lock() for _ in settings.STATIONS]
+        self.pumps = None
+        self.red_button = None
+        self.green_buttons = []  # one per station
+        self.green_button_leds = []
+        self.traces = {}  # station number -> recorder of its current order, see hardware.trace
+
+    def configure(self, config, on_red_button=None):
+        kind = (config.hardware_use_dummy, config.hardware_use_pwm_pumps)
+        if kind != self._kind:
+            self.close()
+            self.open(config)
+            self._kind = kind
+        self.update_in_place(config)
+        if on_red_button is not None:
+            self.red_button.when_held = on_red_button
+
+    def open(self, config):
+        logger.debug('Setting up GPIO devices (dummy %s, PWM pumps %s)', config.hardware_use_dummy, config.hardware_use_pwm_pumps)
+        pin_factory = MockFactory() if config.hardware_use_dummy else None
+        pumps_pin_factory = MockFactory(pin_class=MockPWMPin) if config.hardware_use_dummy and config.hardware_use_pwm_pumps else pin_factory
+        self.pumps = Pumps(pumps_pin_factory, pwm=config.hardware_use_pwm_pumps, max_running=config.hardware_max_running_pumps)
+        self.red_button = Button(
+            pin=settings.GPIO_RED_BUTTON,
+            bounce_time=config.button_bounce_time_red,
+            hold_time=config.button_hold_time_red,
+            pin_factory=pin_factory)
+        for number, station in enumerate(settings.STATIONS):
+            green_button = Button(
+                pin=station['green_button'],
+                bounce_time=config.button_bounce_time_green,
+                hold_time=config.button_hold_time_green,
+                pin_factory=pin_factory)
+            green_button.when_pressed = lambda number=number: self._record_button(trace.GREEN, True, number)
+            green_button.when_released = lambda number=number: self._record_button(trace.GREEN, False, number)
+            self.green_buttons.append(green_button)
+            self.green_button_leds.append(LED(pin=station['green_button_led'], pin_factory=pin_factory))
+        self.red_button.when_pressed = lambda: self._record_button(trace.RED, True)
+        self.red_button.when_released = lambda: self._record_button(trace.RED, False)
+
+    @property
+    def green_button(self):
+        return self.green_buttons[0] if self.green_buttons else None
+
+    @property
+    def green_button_led(self):
+        return self.green_button_leds[0] if self.green_button_leds else None
+
+    def _record_button(self, button, pressed, station=None):
+        """The red button stops every station, it goes to all traces"""
+        recorders = list(self.traces.values()) if station is None else [self.traces.get(station)]
+        for recorder in recorders:
+            if recorder is not None:
+                recorder.button(button, pressed)
+
+    def update_in_place(self, config):
+        self.pumps.set_max_running(config.hardware_max_running_pumps)
+        self.red_button.pin.bounce = config.button_bounce_time_red
+        self.red_button.hold_time = config.button_hold_time_red
+        for green_button in self.green_buttons:
+            green_button.pin.bounce = config.button_bounce_time_green
+            green_button.hold_time = config.button_hold_time_green
+
+    def borrow_green(self, station=0, timeout=1):
+        """Returns the green button and LED of station, or raises RuntimeError if another thread keeps them"""
+        if not self._green_locks[station].acquire(timeout=timeout):
+            raise RuntimeError('Green button of station %i is still borrowed by another thread' % station)
+        return self.green_buttons[station], self.green_button_leds[station]
+
+    def give_back_green(self, station=0):
+        try:
+            self.green_button_leds[station].off()
+        except (GPIODeviceClosed, IndexError):
+            pass  # devices were rebuilt while borrowed
+        self._green_locks[station].release()
+
+    def close(self):
+        if self.pumps is not None:
+            self.pumps.close()
+        for device in [self.red_button] + self.green_buttons + self.green_button_leds:
+            if device is not None:
+                device.close()
+        self.pumps = self.red_button = None
+        self.green_buttons = []
+        self.green_button_leds = []
+        self._kind = None
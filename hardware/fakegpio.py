@@ -0,0 +1,196 @@
+"""
+Stand-ins for the RPi.GPIO module, to run hardware.weight off the Pi.
+
+EmulatedGPIO has the subset of the RPi.GPIO interface used by the HX711 class and forwards
+the clock and data pins to an HX711Emulator, which answers PD_SCK clocking like the chip:
+DOUT goes low when a conversion is ready, the 24 bits come out MSB first in 2's complement,
+the 25th to 27th pulses select the next channel and gain, and holding PD_SCK high for 60 us
+powers it down.
+
+TimingGPIO also records how long each clock pulse stayed high, which is what the HX711 compares
+to its power down delay. Set settings.GPIO_BACKEND to 'hardware.fakegpio.emulated_gpio' to use
+the emulator instead of RPi.GPIO.
+"""
+import random
+import sys
+import time
+import types
+
+BCM = 11
+BOARD = 10
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+
+POWER_DOWN_DELAY = 0.00006  # [s] PD_SCK high for longer powers the chip down
+PULSES = {25: ('A', 128), 26: ('B', 32), 27: ('A', 64)}  # total pulses of a read -> next channel and gain
+
+
+def twos_complement(value):
+    """Signed value clamped to the 24 bits range, as the chip sends it"""
+    value = max(-0x800000, min(0x7fffff, int(value)))
+    return value & 0xffffff
+
+
+class HX711Emulator:
+    """
+    samples is a number, or a callable(channel, gain) returning the next signed conversion.
+    rate is the output data rate [SPS] (10 or 80 on the chip), None for always ready.
+    settling [s] is the time after power up or a channel change before the first conversion.
+    """
+    WAITING, SHIFTING, SELECTING = 'waiting', 'shifting', 'selecting'
+
+    def __init__(self, dout_pin, pd_sck_pin, samples=0, rate=80, settling=0., clock=time.perf_counter):
+        self.dout_pin = dout_pin
+        self.pd_sck_pin = pd_sck_pin
+        self.samples = samples
+        self.rate = rate
+        self.settling = settling
+        self.clock = clock
+        self.channel, self.gain = 'A', 128
+        self.conversions = 0  # read by the host
+        self._phase = self.WAITING
+        self._clock_high_at = None
+        self._ready_at = clock()
+        self._data = 0  # 24 bits of the conversion being shifted out
+        self._pulses = 0
+
+    @property
+    def powered_down(self):
+        return self._clock_high_at is not None and self.clock() - self._clock_high_at >= POWER_DOWN_DELAY
+
+    def _next_ready(self, now, delay=0.):
+        period = 1. / self.rate if self.rate else 0.
+        self._ready_at = now + max(period, delay)
+        self._phase = self.WAITING
+
+    def _select(self, now):
+        """End of a read, the number of extra pulses sets the channel and gain of the next conversion"""
+        channel, gain = PULSES.get(self._pulses, (self.channel, self.gain))
+        changed = (channel, gain) != (self.channel, self.gain)
+        self.channel, self.gain = channel, gain
+        self._next_ready(now, self.settling if changed else 0.)
+
+    def clock_edge(self, high):
+        now = self.clock()
+        if high:
+            if self._clock_high_at is not None:
+                return
+            self._clock_high_at = now
+            if self._phase == self.WAITING and now >= self._ready_at:
+                sample = self.samples(self.channel, self.gain) if callable(self.samples) else self.samples
+                self._data = twos_complement(sample)
+                self._phase, self._pulses = self.SHIFTING, 0
+            if self._phase != self.WAITING:
+                self._pulses += 1
+                if self._pulses == 24:
+                    self._phase = self.SELECTING
+                    self.conversions += 1
+                elif self._pulses == max(PULSES):
+                    self._select(now)
+            return
+        if self._clock_high_at is None:
+            return
+        high_for = now - self._clock_high_at
+        self._clock_high_at = None
+        if high_for >= POWER_DOWN_DELAY:
+            # powered down while high, back up on this falling edge with the defaults
+            self.channel, self.gain = 'A', 128
+            self._next_ready(now, self.settling)
+
+    def dout(self):
+        if self.powered_down:
+            return HIGH
+        if self._phase == self.SELECTING and self._pulses > 24 and self._clock_high_at is None:
+            self._select(self.clock())  # the host stopped pulsing, it is checking for the next conversion
+        if self._phase == self.WAITING:
+            return LOW if self.clock() >= self._ready_at else HIGH
+        if self._phase == self.SELECTING:
+            return HIGH if self._pulses > 24 else self._data & 1
+        return (self._data >> (24 - self._pulses)) & 1
+
+
+class EmulatedGPIO:
+    BCM, BOARD, OUT, IN, LOW, HIGH = BCM, BOARD, OUT, IN, LOW, HIGH
+
+    def __init__(self, *devices):
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self._clock_pins = {}
+        self._data_pins = {}
+        for device in devices:
+            self.attach(device)
+
+    def attach(self, device):
+        self._clock_pins[device.pd_sck_pin] = device
+        self._data_pins[device.dout_pin] = device
+        return device
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, direction):
+        self.directions[pin] = direction
+
+    def output(self, pin, value):
+        self.levels[pin] = HIGH if value else LOW
+        device = self._clock_pins.get(pin)
+        if device is not None:
+            device.clock_edge(bool(value))
+
+    def input(self, pin):
+        device = self._data_pins.get(pin)
+        if device is not None:
+            return device.dout()
+        return self.levels.get(pin, LOW)
+
+    def cleanup(self, pins=None):
+        for pin in (self.directions if pins is None else pins):
+            self.directions.pop(pin, None)
+            self.levels.pop(pin, None)
+
+
+class TimingGPIO(EmulatedGPIO):
+    """Emulator always ready with a fixed sample, recording each clock high time"""
+
+    def __init__(self, sample=0x012345, dout_pin=5, pd_sck_pin=6, clock=time.perf_counter):
+        self.clock = clock
+        self.high_times = []  # [s] duration of each clock pulse
+        self._rising_at = None
+        self.emulator = HX711Emulator(dout_pin, pd_sck_pin, samples=sample, rate=None, clock=clock)
+        super().__init__(self.emulator)
+
+    def output(self, pin, value):
+        now = self.clock()
+        if pin == self.emulator.pd_sck_pin:
+            if value and self._rising_at is None:
+                self._rising_at = now
+            elif not value and self._rising_at is not None:
+                self.high_times.append(now - self._rising_at)
+                self._rising_at = None
+        super().output(pin, value)
+
+    def reset(self):
+        self.high_times = []
+
+
+def emulated_gpio():
+    """GPIO backend with an HX711 on the pins of each station, reading a constant load with some noise"""
+    from django.conf import settings
+    noise = random.Random(0)
+    return EmulatedGPIO(*(
+        HX711Emulator(station['dt'], station['sck'], samples=lambda channel, gain: 100000 + noise.gauss(0, 50))
+        for station in settings.STATIONS))
+
+
+def install(gpio):
+    """Make `import RPi.GPIO` return gpio, for modules imported after this call"""
+    package = types.ModuleType('RPi')
+    package.GPIO = gpio
+    sys.modules['RPi'] = package
+    sys.modules['RPi.GPIO'] = gpio
@@ -0,0 +1,25 @@
+"""
+GPIO backend of the HX711, chosen with settings.GPIO_BACKEND.
+
+The backend is a module with the RPi.GPIO interface ('RPi.GPIO' on the Pi),
+or a factory returning such an object ('hardware.fakegpio.emulated_gpio' off the Pi).
+Importing RPi.GPIO off the Pi raises RuntimeError or ModuleNotFoundError, like before.
+"""
+from importlib import import_module
+
+from django.conf import settings
+
+
+def load_backend(path):
+    try:
+        return import_module(path)
+    except ModuleNotFoundError as e:
+        if e.name != path:
+            raise
+    module_path, _, name = path.rpartition('.')
+    backend = getattr(import_module(module_path), name)
+    return backend() if callable(backend) else backend
+
+
+GPIO = load_backend(getattr(settings, 'GPIO_BACKEND', 'RPi.GPIO'))
+GPIO.setmode(GPIO.BCM)
@@ -0,0 +1,85 @@
+import json
+import sys
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.template import Context, Template
+
+from hardware import fakegpio, metrics
+
+PAGE = Template('{% for mix in mixes %}<div class="card">{{ mix.name|title }} {{ mix.likes }}</div>{% endfor %}')
+
+
+def web_like_load(stop):
+    """What a Django thread does between two requests: templates, JSON, string work"""
+    mixes = [{'name': 'mix number %i' % i, 'likes': i} for i in range(50)]
+    while not stop.is_set():
+        PAGE.render(Context({'mixes': mixes}))
+        json.loads(json.dumps(mixes))
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+class Command(BaseCommand):
+    help = 'Time the HX711 bit-banging through a fake RPi.GPIO: clock pulse durations, read success rate and samples/s'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reads', type=int, default=2000)
+        parser.add_argument('--duration', type=float, default=20, help='[s] stop earlier than --reads after this time')
+        parser.add_argument('--contention', type=int, default=0, help='Threads running a web-like CPU load meanwhile')
+        parser.add_argument('--switch-interval', type=float, default=None, help='[s] sys.setswitchinterval for the run')
+
+    def handle(self, *args, **options):
+        gpio = fakegpio.TimingGPIO()
+        try:
+            from hardware import weight
+        except (RuntimeError, ModuleNotFoundError):
+            fakegpio.install(gpio)  # RPi.GPIO backend off the Pi
+            from hardware import weight
+        weight.GPIO = gpio
+        cell = weight.HX711(dout_pin=5, pd_sck_pin=6)
+        gpio.reset()
+
+        switch_interval = sys.getswitchinterval()
+        if options['switch_interval'] is not None:
+            sys.setswitchinterval(options['switch_interval'])
+        stop = threading.Event()
+        load = [threading.Thread(target=web_like_load, args=(stop,), daemon=True) for _ in range(options['contention'])]
+        for thread in load:
+            thread.start()
+        counters = {
+            'not ready': metrics.hx711_not_ready,
+            'invalid': metrics.hx711_invalid_reads,
+            'too slow while reading': metrics.hx711_power_down_violations.labels('read'),
+            'too slow while setting gain': metrics.hx711_power_down_violations.labels('set_channel_gain'),
+        }
+        before = {name: counter.value for name, counter in counters.items()}
+        reads = successes = 0
+        start = time.perf_counter()
+        try:
+            while reads < options['reads'] and time.perf_counter() - start < options['duration']:
+                reads += 1
+                if cell._read() is not False:
+                    successes += 1
+        finally:
+            duration = time.perf_counter() - start
+            stop.set()
+            for thread in load:
+                thread.join()
+            sys.setswitchinterval(switch_interval)
+
+        high_times = sorted(gpio.high_times)
+        violations = sum(1 for t in high_times if t >= cell._power_down_delay)
+        self.stdout.write('%i reads, %i contention threads, switch interval %gs' % (
+            reads, options['contention'], sys.getswitchinterval() if options['switch_interval'] is None else options['switch_interval']))
+        self.stdout.write('clock high time [us]: p50 %.1f p90 %.1f p99 %.1f p99.9 %.1f max %.1f' % tuple(
+            1e6 * percentile(high_times, q) for q in (0.5, 0.9, 0.99, 0.999, 1.)))
+        self.stdout.write('pulses over the %ius power down delay: %i of %i' % (
+            1e6 * cell._power_down_delay, violations, len(high_times)))
+        self.stdout.write('failed reads: %s' % ', '.join(
+            '%s %i' % (name, counter.value - before[name]) for name, counter in counters.items()))
+        self.stdout.write('read success rate %.2f%%, %.0f samples/s (the HX711 itself converts at 10 or 80 SPS)' % (
+            100. * successes / reads, successes / duration))
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from hardware import fakegpio
+
+LOADS = {'A': 100000, 'B': -50000}  # [counts] distinct per channel, to catch samples of the wrong one
+NOISE = 200
+
+
+class Command(BaseCommand):
+    help = 'Effective samples/s per channel when one emulated HX711 weighs two scales, interleaved or with the channel setters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blocks', type=int, nargs='+', default=[2, 4, 8, 16], help='Conversions per channel before switching')
+        parser.add_argument('--discard', type=int, default=1, help='Conversions dropped after each switch')
+        parser.add_argument('--duration', type=float, default=5, help='[s] per run')
+        parser.add_argument('--rate', type=int, default=80, choices=(10, 80), help='[SPS] of the HX711')
+        parser.add_argument('--settling', type=float, default=0.05, help='[s] after a channel change, 50 ms at 80 SPS and 400 ms at 10 SPS')
+
+    def handle(self, *args, **options):
+        emulator = fakegpio.HX711Emulator(
+            5, 6, samples=lambda channel, gain: LOADS[channel] + time.perf_counter_ns() % NOISE,
+            rate=options['rate'], settling=options['settling'])
+        gpio = fakegpio.EmulatedGPIO(emulator)
+        try:
+            from hardware import weight
+        except (RuntimeError, ModuleNotFoundError):
+            fakegpio.install(gpio)  # RPi.GPIO backend off the Pi
+            from hardware import weight
+        weight.GPIO = gpio
+        cell = weight.HX711(dout_pin=5, pd_sck_pin=6)
+        self.stdout.write('HX711 at %i SPS, %gs settling, %gs per run' % (options['rate'], options['settling'], options['duration']))
+
+        streams = [weight.ChannelStream('A', 128, None), weight.ChannelStream('B', 32, None)]  # keep all to check them
+        start = time.perf_counter()
+        while time.perf_counter() - start < options['duration']:
+            for stream in streams:
+                cell.set_channel_gain(stream.channel, stream.gain)
+                for _ in range(options['blocks'][-1]):
+                    value = cell._read()
+                    if value is not False:
+                        stream.add(value)
+        self.report('setters, block %i' % options['blocks'][-1], streams, time.perf_counter() - start, 0)
+
+        for block in options['blocks']:
+            streams = [weight.ChannelStream('A', 128, None), weight.ChannelStream('B', 32, None)]  # keep all to check them
+            reader = weight.InterleavedReader(cell, streams, block=block, discard=options['discard'])
+            start = time.perf_counter()
+            while time.perf_counter() - start < options['duration']:
+                reader.read()
+            self.report('interleaved, block %i' % block, streams, time.perf_counter() - start, reader.dropped)
+
+    def report(self, name, streams, duration, dropped):
+        wrong = sum(1 for stream in streams for value in stream.queue
+                    if not 0 <= value - LOADS[stream.channel] < NOISE)
+        self.stdout.write('%-22s %s, %i dropped, %i in the wrong stream' % (
+            name, ', '.join('%s %.1f SPS' % (s.channel, s.samples / duration) for s in streams), dropped, wrong))
@@ -0,0 +1,158 @@
+import logging
+import logging.handlers
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from gpiozero.pins.mock import MockFactory
+
+from autobar.log import QueueListenerHandler, Throttle
+from hardware.pumps import Pumps
+from hardware.serving import ServeOrderThread
+from hardware.stations import Station
+from recipes.models import Configuration, Dispenser, Dose, Ingredient, Mix, Order
+
+FORMAT = '[%(asctime)s] %(levelname)s [%(name)s:%(lineno)s] %(message)s'
+
+
+class StepWeightModule:
+    """Weight growing by step at each read, with the time between two reads: one pour loop iteration"""
+    trace = None
+
+    def __init__(self, step):
+        self.step = step
+        self.weight = 0.
+        self.last_read = None
+        self.reads = 0
+        self.worst = 0.
+
+    def make_constant_weight_measure(self, clear=True, max_try=0):
+        now = time.perf_counter()
+        if not clear and self.last_read is not None:
+            self.reads += 1
+            self.worst = max(self.worst, now - self.last_read)
+        self.last_read = now
+        self.weight += self.step
+        return self.weight
+
+
+class ServeArtist:
+    def __init__(self, config):
+        self.config = config
+        self.pumps = Pumps(pin_factory=MockFactory())
+
+
+class Command(BaseCommand):
+    help = 'Cost per iteration of a logging call in the weight loop: eager and synchronous vs lazy, queued and throttled, then of the serve_dose loop with each handler setup'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000)
+        parser.add_argument('--period', type=float, default=0.2, help='[s] throttle period of the progress log')
+        parser.add_argument('--doses', type=int, default=20, help='Doses poured by ServeOrderThread.serve_dose per handler setup')
+        parser.add_argument('--step', type=float, default=0.01, help='[g] weight gained per pour loop iteration')
+
+    def make_logger(self, name, handler):
+        handler.setFormatter(logging.Formatter(FORMAT))
+        test_logger = logging.getLogger('benchlogging.%s' % name)
+        test_logger.propagate = False
+        test_logger.setLevel(logging.DEBUG)
+        test_logger.handlers = [handler]
+        return test_logger
+
+    def eager(self, path, options):
+        handler = logging.FileHandler(path)
+        test_logger = self.make_logger('eager', handler)
+        worst = 0.
+        start = time.perf_counter()
+        for i in range(options['iterations']):
+            t = time.perf_counter()
+            test_logger.debug('Served %sg of %sg' % (i * 0.01, 60))
+            worst = max(worst, time.perf_counter() - t)
+        duration = time.perf_counter() - start
+        handler.close()
+        return duration, worst
+
+    def queued(self, path, options, throttled=True):
+        file_handler = logging.FileHandler(path)
+        handler = QueueListenerHandler([file_handler])
+        test_logger = self.make_logger('queued', file_handler)
+        test_logger.handlers = [handler]
+        throttle = Throttle(options['period'])
+        worst = 0.
+        start = time.perf_counter()
+        for i in range(options['iterations']):
+            t = time.perf_counter()
+            if not throttled or throttle.ready():
+                test_logger.debug('Served %sg of %sg', i * 0.01, 60)
+            worst = max(worst, time.perf_counter() - t)
+        duration = time.perf_counter() - start
+        handler.stop()  # flushes the queue
+        file_handler.close()
+        return duration, worst
+
+    def serve_dose(self, directory, options, queued):
+        """
+        The pour loop of ServeOrderThread.serve_dose with the handlers of the 'autobar' logger, console
+        and rotating file written by the calling thread as before, or by the queue listener thread.
+        The weight reads are a stub, so the time left is the loop itself, its pump and log calls.
+        """
+        console_stream = open(os.path.join(directory, 'console-%s.log' % queued), 'w')
+        console = logging.StreamHandler(console_stream)
+        rotating = logging.handlers.TimedRotatingFileHandler(os.path.join(directory, 'file-%s.log' % queued), when='midnight')
+        for handler in (console, rotating):
+            handler.setFormatter(logging.Formatter(FORMAT))
+        handlers = [QueueListenerHandler([console, rotating])] if queued else [console, rotating]
+        autobar_logger = logging.getLogger('autobar')
+        saved = autobar_logger.handlers, autobar_logger.propagate
+        autobar_logger.handlers, autobar_logger.propagate = handlers, False
+        config = Configuration.get_solo()
+        config.ux_delay_between_two_doses = 0
+        config.ux_timeout_serving = 3600
+        artist = ServeArtist(config)
+        weight_module = StepWeightModule(options['step'])
+        try:
+            with transaction.atomic():
+                ingredient = Ingredient.objects.create(name='benchlogging ingredient', alcohol_percentage=0)
+                Dispenser.objects.filter(number=0).delete()
+                Dispenser.objects.create(number=0, ingredient=ingredient, is_empty=False, station=0)
+                mix = Mix.objects.create(name='benchlogging mix')
+                dose = Dose.objects.create(mix=mix, ingredient=ingredient, number=1, quantity=2)
+                thread = ServeOrderThread(Order.objects.create(mix=mix), artist, Station(0, weight_module))
+                thread.green_button = type('Button', (), {'is_active': False})()
+                start = time.perf_counter()
+                for _ in range(options['doses']):
+                    if not thread.serve_dose(dose):
+                        raise RuntimeError('serve_dose did not reach the dose')
+                duration = time.perf_counter() - start
+                transaction.set_rollback(True)
+        finally:
+            autobar_logger.handlers, autobar_logger.propagate = saved
+            if queued:
+                handlers[0].stop()
+            artist.pumps.close()
+            for handler in (console, rotating):
+                handler.close()
+            console_stream.close()
+        return duration, weight_module.worst, weight_module.reads
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            benches = (
+                ('eager + file', self.eager, {}),
+                ('lazy + queue', self.queued, {'throttled': False}),
+                ('lazy + queue + throttle', self.queued, {}),
+            )
+            for index, (name, bench, kwargs) in enumerate(benches):
+                path = os.path.join(directory, '%i.log' % index)
+                duration, worst = bench(path, options, **kwargs)
+                with open(path) as f:
+                    lines = sum(1 for _ in f)
+                self.stdout.write('%-24s %.2fus per iteration, worst %.0fus, %i lines written' % (
+                    name, 1e6 * duration / options['iterations'], 1e6 * worst, lines))
+            for name, queued in (('sync console + file', False), ('queue listener', True)):
+                duration, worst, reads = self.serve_dose(directory, options, queued)
+                self.stdout.write('serve_dose, %-20s %.2fus per loop iteration, worst %.0fus, %i iterations' % (
+                    name, 1e6 * duration / reads, 1e6 * worst, reads))
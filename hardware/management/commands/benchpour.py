@@ -0,0 +1,50 @@
+import random
+from statistics import mean
+
+from django.core.management.base import BaseCommand
+
+from gpiozero.pins.mock import MockFactory, MockPWMPin
+
+from hardware.pumps import Pumps, ramp_speed
+from hardware.simulation import simulate_dose
+
+
+class Command(BaseCommand):
+    help = 'Compare time-to-target and final error of on/off and PWM ramping pumps in the pour simulator'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', type=float, default=60, help='[g] dose to pour')
+        parser.add_argument('--runs', type=int, default=50, help='Number of simulated pours per mode')
+        parser.add_argument('--ramp-weight', type=float, default=20, help='[g] see Dispenser.pwm_ramp_weight')
+        parser.add_argument('--min-speed', type=float, default=0.3, help='see Dispenser.pwm_min_speed')
+        parser.add_argument('--period', type=float, default=0.1, help='[s] time between two weight measures')
+
+    def run_mode(self, pwm, options):
+        pumps = Pumps(pin_factory=MockFactory(pin_class=MockPWMPin), pwm=pwm)
+        rng = random.Random(0)
+        if pwm:
+            profile = lambda remaining: ramp_speed(remaining, options['ramp_weight'], options['min_speed'])
+        else:
+            profile = None
+        results = []
+        try:
+            for seed in range(options['runs']):
+                results.append(simulate_dose(
+                    pumps, 0, options['target'],
+                    speed_for_remaining=profile,
+                    period=options['period'],
+                    max_flow=rng.uniform(11, 15),
+                    tube_lag=rng.uniform(0.2, 0.4),
+                    seed=seed,
+                ))
+        finally:
+            pumps.close()
+        return results
+
+    def handle(self, *args, **options):
+        for name, pwm in (('on/off', False), ('PWM ramp', True)):
+            results = self.run_mode(pwm, options)
+            times = [r['time'] for r in results]
+            errors = [r['error'] for r in results]
+            self.stdout.write('%-9s time to target mean %.2fs max %.2fs | final error mean %+.2fg mean abs %.2fg max abs %.2fg' % (
+                name, mean(times), max(times), mean(errors), mean(map(abs, errors)), max(map(abs, errors))))
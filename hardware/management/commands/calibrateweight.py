@@ -0,0 +1,70 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from hardware.calibration import CalibrationError, calibrate, fit, save
+from hardware.stations import station_config
+from hardware.weightstream import station_path, writer_running
+from recipes.models import Configuration
+
+
+class Command(BaseCommand):
+    help = 'Fit the weight cell offset and ratio on several reference weights with least squares'
+
+    def add_arguments(self, parser):
+        parser.add_argument('references', nargs='*', type=float, help='[g] weights to put on the scale in turn, such as 0 100 250 500')
+        parser.add_argument('--points', nargs='+', metavar='RAW:GRAMS', help='Fit already measured points instead of reading the cell')
+        parser.add_argument('--reads', type=int, default=50, help='Valid reads per point, the median is kept')
+        parser.add_argument('--quadratic', action='store_true', help='Also fit a quadratic term')
+        parser.add_argument('--delay', type=float, default=None, help='[s] wait instead of asking to press enter before each point')
+        parser.add_argument('--station', type=int, default=0, help='Serving station of the scale, see settings.STATIONS')
+        parser.add_argument('--save', action='store_true', help='Write the result to the Configuration')
+
+    def place(self, grams, delay):
+        if delay is None:
+            input('Put %sg on the scale and press enter ' % grams)
+        else:
+            self.stdout.write('Put %sg on the scale, reading in %ss' % (grams, delay))
+            time.sleep(delay)
+
+    def handle(self, *args, **options):
+        config = Configuration.get_solo()
+        if not 0 <= options['station'] < len(settings.STATIONS):
+            raise CommandError('No station %i in settings.STATIONS' % options['station'])
+        overridden = set(settings.STATIONS[options['station']].get('config', {})).intersection(
+            ('weight_cell_offset', 'weight_cell_ratio', 'weight_cell_quadratic'))
+        if options['save'] and overridden:
+            raise CommandError('The calibration of station %i is in settings.STATIONS, update it there' % options['station'])
+        try:
+            if options['points']:
+                points = [tuple(float(v) for v in point.split(':')) for point in options['points']]
+                result = fit(points, options['quadratic'])
+                result['points'] = points
+            else:
+                if not options['references']:
+                    raise CommandError('Give the reference weights, or --points')
+                path = settings.WEIGHT_STREAM_PATH and station_path(settings.WEIGHT_STREAM_PATH, options['station'])
+                if path and writer_running(path):
+                    raise CommandError('The hardware is running and owns the HX711 (it writes %s), stop it first' % path)
+                from hardware.weight import WeightModule  # needs the GPIO, --points does not
+                weight_module = WeightModule()
+                weight_module.init_from_settings_and_config(
+                    settings, station_config(config, options['station']), options['station'])
+                try:
+                    result = calibrate(
+                        weight_module, options['references'],
+                        place=lambda grams: self.place(grams, options['delay']),
+                        reads=options['reads'], quadratic=options['quadratic'])
+                finally:
+                    weight_module.close()
+        except (CalibrationError, ValueError) as e:
+            raise CommandError(e)
+
+        for (raw, grams), residual in zip(result['points'], result['residuals']):
+            self.stdout.write('%10.0f -> %8.2fg  residual %+.3fg' % (raw, grams, residual))
+        self.stdout.write('offset %.2f ratio %.8g quadratic %.4g, rms residual %.3fg' % (
+            result['offset'], result['ratio'], result['quadratic'], result['rms']))
+        if options['save']:
+            save(config, result)
+            self.stdout.write('Saved to the Configuration')
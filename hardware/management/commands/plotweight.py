@@ -1,3 +1,4 @@
+import math
 import time
 from collections import deque
 
@@ -7,8 +8,11 @@ from matplotlib import style
 
 import urllib.request, json 
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
 
+from hardware.weightstream import WeightStreamReader, FLAG_RAW
+
 
 class Plotter:
     def __init__(self, url, size):
@@ -20,30 +24,88 @@ class Plotter:
         self.fig = plt.figure()
         self.ax1 = self.fig.add_subplot(1,1,1)
 
-    def animate(self, i):
+    def fetch(self):
         with urllib.request.urlopen(self.url) as url:
             data = json.loads(url.read().decode())
             if data['converted_raw_value'] is not None:
                 self.ts.append(time.time())
                 self.raw.append(data['converted_raw_value'])
                 self.weight.append(data['weight'])
-            self.ax1.clear()
-            plt.title('Weight plotting')
-            plt.xlabel('timestamp [s]')
-            plt.ylabel('weight [g]')
-            self.ax1.plot(self.ts, self.raw)
-            self.ax1.plot(self.ts, self.weight)
+
+    def animate(self, i):
+        self.fetch()
+        self.ax1.clear()
+        plt.title('Weight plotting')
+        plt.xlabel('timestamp [s]')
+        plt.ylabel('weight [g]')
+        self.ax1.plot(self.ts, self.raw)
+        self.ax1.plot(self.ts, self.weight)
+
+
+class StreamPlotter(Plotter):
+    """Reads every sample from the shared memory stream, works only on the machine running the hardware"""
+    def __init__(self, path, size):
+        super().__init__(None, size)
+        from recipes.models import Configuration
+        config = Configuration.get_solo()
+        self.offset, self.ratio, self.quadratic = config.weight_cell_offset, config.weight_cell_ratio, config.weight_cell_quadratic
+        self.reader = WeightStreamReader(path)
+        self.sequence = self.reader.sequence - size
+
+    def fetch(self):
+        samples, self.sequence = self.reader.since(self.sequence)
+        for sample in samples:
+            if sample.flags & FLAG_RAW and not math.isnan(sample.grams):
+                self.ts.append(sample.timestamp)
+                tared = sample.raw - self.offset
+                self.raw.append(self.ratio * tared + self.quadratic * tared * tared)
+                self.weight.append(sample.grams)
+
+
+class HistoryPlotter(Plotter):
+    """Min, max and mean of the recorded weight, from the time series store of the bar"""
+    def __init__(self, url, seconds, resolution):
+        super().__init__(url, 0)
+        self.seconds, self.resolution = seconds, resolution
+        self.buckets = []
+
+    def fetch(self):
+        query = '?series=weight&seconds=%s&resolution=%s' % (self.seconds, self.resolution)
+        with urllib.request.urlopen(self.url + query) as url:
+            self.buckets = json.loads(url.read().decode())['buckets']
+
+    def animate(self, i):
+        self.fetch()
+        self.ax1.clear()
+        plt.title('Weight history')
+        plt.xlabel('timestamp [s]')
+        plt.ylabel('weight [g]')
+        if self.buckets:
+            ts, low, high, mean = zip(*self.buckets)
+            self.ax1.fill_between(ts, low, high, alpha=0.3)
+            self.ax1.plot(ts, mean)
 
 
 class Command(BaseCommand):
     help = 'Plot the weight live'
 
     def add_arguments(self, parser):
-        parser.add_argument('url', default='http://raspberrypi:8000', help='Site url such as http://raspberrypi:8000 or http://localhost:8000')
+        parser.add_argument('url', nargs='?', default='http://raspberrypi:8000', help='Site url such as http://raspberrypi:8000 or http://localhost:8000')
         parser.add_argument('size', type=int, help='Number of values to remember')
+        parser.add_argument('--stream', action='store_true', help='Read the local shared memory stream %s instead of the url' % settings.WEIGHT_STREAM_PATH)
+        parser.add_argument('--history', type=float, default=None, help='Plot the recorded weight of the last HISTORY seconds')
+        parser.add_argument('--resolution', type=float, default=10, help='[s] bucket size for --history')
 
     def handle(self, *args, **options):
-        api_url = options['url'] + '/hardware/weightmeasure'
-        p = Plotter(api_url, options['size'])
+        if options['stream']:
+            p = StreamPlotter(settings.WEIGHT_STREAM_PATH, options['size'])
+        elif options['history']:
+            p = HistoryPlotter(options['url'] + '/hardware/history', options['history'], options['resolution'])
+            ani = animation.FuncAnimation(p.fig, p.animate, interval=5000)
+            plt.show()
+            return
+        else:
+            api_url = options['url'] + '/hardware/weightmeasure'
+            p = Plotter(api_url, options['size'])
         ani = animation.FuncAnimation(p.fig, p.animate, interval=10)  # interval in [ms]
         plt.show()
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from hardware import fakegpio, trace
+from recipes.models import Configuration
+
+
+def grams(value):
+    return '-' if value is None else '%.1fg' % value
+
+
+def seconds(value):
+    return '-' if value is None else '%.2fs' % value
+
+
+class Command(BaseCommand):
+    help = 'Replay recorded weight traces through the WeightModule and the pour decision, with the current or given filter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('traces', nargs='+', help='.trace files, see settings.TRACE_DIR')
+        parser.add_argument('--queue-length', type=int, default=None, help='Override weight_module_queue_length')
+
+    def handle(self, *args, **options):
+        try:
+            import hardware.weight  # noqa
+        except (RuntimeError, ModuleNotFoundError):
+            fakegpio.install(fakegpio.EmulatedGPIO())  # no GPIO is used during replay
+        config = Configuration.get_solo()
+        if options['queue_length'] is not None:
+            config.weight_module_queue_length = options['queue_length']
+        for path in options['traces']:
+            order_id, started_at, records = trace.read_trace(path)
+            self.stdout.write('%s: order %i, %i records' % (path, order_id, len(records)))
+            for result in trace.replay(records, config):
+                self.stdout.write(
+                    '  dispenser %i target %s | recorded stop %s at %s | replayed stop %s at %s | settled %s' % (
+                        result['dispenser'], grams(result['target']),
+                        seconds(result['recorded_stop']), grams(result['recorded_weight']),
+                        seconds(result['replayed_stop']), grams(result['replayed_weight']),
+                        grams(result['settled_weight'])))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from hardware.rpc import serve
+
+
+class Command(BaseCommand):
+    help = 'Run the hardware daemon, owner of the GPIO, for web workers configured with HARDWARE_SOCKET'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.HARDWARE_SOCKET, help='Path of the Unix socket')
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            self.stderr.write('Set HARDWARE_SOCKET in the settings or use --socket')
+            return
+        try:
+            serve(options['socket'])
+        except KeyboardInterrupt:
+            pass
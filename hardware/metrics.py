@@ -0,0 +1,209 @@
+"""
+Telemetry of the bar, rendered in the Prometheus text format by the /metrics view.
+
+Counters are incremented from the sampling and pouring loops, so they never take a lock once
+warm: every thread adds to its own cell and the cells are only summed when scraped.
+"""
+import threading
+import weakref
+from bisect import bisect_left
+
+
+class Counter:
+    """Monotonic counter, one cell per incrementing thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()  # only for the first increment of a thread, and collect
+        self._cells = []  # (thread weakref, [value])
+        self._retired = 0.  # total of the threads that are gone
+
+    def _new_cell(self):
+        cell = [0.]
+        with self._lock:
+            self._cells.append((weakref.ref(threading.current_thread()), cell))
+        self._local.cell = cell
+        return cell
+
+    def inc(self, amount=1):
+        try:
+            cell = self._local.cell
+        except AttributeError:
+            cell = self._new_cell()
+        cell[0] += amount  # only this thread writes this cell
+
+    @property
+    def value(self):
+        with self._lock:
+            alive = []
+            for thread, cell in self._cells:
+                if thread() is None or not thread().is_alive():
+                    self._retired += cell[0]  # the thread cannot write anymore
+                else:
+                    alive.append((thread, cell))
+            self._cells = alive
+            return self._retired + sum(cell[0] for _, cell in alive)
+
+
+class Gauge:
+    """Current value, set by its owner or computed when scraped"""
+
+    def __init__(self, function=None):
+        self._value = 0.
+        self._function = function
+
+    def set(self, value):
+        self._value = value
+
+    def set_function(self, function):
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+
+class Histogram:
+    """Cumulative histogram with fixed upper bounds, like Prometheus ones"""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self._sum = 0.
+        self._count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative, buckets = 0, []
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            buckets.append(('+Inf' if bound == float('inf') else bound, cumulative))
+        return {
+            'buckets': buckets,
+            'sum': total,
+            'count': count,
+        }
+
+
+class Family:
+    """A metric and its children, one per set of label values"""
+
+    def __init__(self, name, documentation, kind, factory, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self._children[()] = factory()
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('%s expects labels %s' % (self.name, self.labelnames))
+            with self._lock:
+                child = self._children.setdefault(values, self._factory())
+        return child
+
+    def __getattr__(self, name):
+        # a family without labels is used like its only child
+        if name.startswith('_') or self.labelnames:
+            raise AttributeError(name)
+        return getattr(self._children[()], name)
+
+    def _format_labels(self, values, extra=()):
+        pairs = list(zip(self.labelnames, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (name, _escape(value)) for name, value in pairs)
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s %s' % (self.name, self.kind),
+        ]
+        for values, child in sorted(list(self._children.items())):
+            if self.kind == 'histogram':
+                snapshot = child.snapshot()
+                for bound, count in snapshot['buckets']:
+                    lines.append('%s_bucket%s %s' % (self.name, self._format_labels(values, [('le', bound)]), count))
+                lines.append('%s_sum%s %r' % (self.name, self._format_labels(values), float(snapshot['sum'])))
+                lines.append('%s_count%s %s' % (self.name, self._format_labels(values), snapshot['count']))
+            else:
+                lines.append('%s%s %r' % (self.name, self._format_labels(values), float(child.value)))
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Registry:
+    def __init__(self):
+        self._families = {}
+
+    def _register(self, family):
+        if family.name in self._families:
+            raise ValueError('Metric %s is already registered' % family.name)
+        self._families[family.name] = family
+        return family
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Family(name, documentation, 'counter', Counter, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self._register(Family(name, documentation, 'gauge', lambda: Gauge(function), labelnames))
+
+    def histogram(self, name, documentation, buckets, labelnames=()):
+        return self._register(Family(name, documentation, 'histogram', lambda: Histogram(buckets), labelnames))
+
+    def render(self):
+        lines = []
+        for name in sorted(self._families):
+            lines.extend(self._families[name].render())
+        return '\n'.join(lines) + '\n'
+
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.)
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5.)
+SERVE_BUCKETS = (10, 20, 30, 45, 60, 90, 120, 180, 300)
+DOSE_ERROR_BUCKETS = (-10, -5, -2, -1, -0.5, 0, 0.5, 1, 2, 5, 10)
+
+# hardware metrics live with the artist, in the hardware daemon when there is one
+hardware = Registry()
+hx711_samples = hardware.counter('autobar_hx711_samples_total', 'Valid reads of the HX711, rate() gives samples/s')
+hx711_invalid_reads = hardware.counter('autobar_hx711_invalid_reads_total', 'HX711 reads rejected as saturated')
+hx711_not_ready = hardware.counter('autobar_hx711_not_ready_total', 'HX711 reads given up because DOUT stayed high')
+hx711_power_down_violations = hardware.counter(
+    'autobar_hx711_power_down_violations_total',
+    'Clock pulses longer than the HX711 power down delay',
+    ('step',))  # read or set_channel_gain
+serve_duration = hardware.histogram(
+    'autobar_serve_duration_seconds', 'Time from the first dose to the finished order', SERVE_BUCKETS, ('mix',))
+dose_error = hardware.histogram(
+    'autobar_dose_error_grams', 'Served minus asked weight of a dose', DOSE_ERROR_BUCKETS, ('dispenser',))
+pump_on_time = hardware.counter('autobar_pump_on_seconds_total', 'Time spent ON by the pumps', ('pump',))
+emergency_stop_latency = hardware.histogram(
+    'autobar_emergency_stop_seconds', 'Time from the emergency stop request to the pins low', LATENCY_BUCKETS)
+orders_in_progress = hardware.gauge('autobar_orders_in_progress', 'Accepted orders not finished yet')
+tasks_queued = hardware.gauge('autobar_artist_tasks_queued', 'Hardware tasks waiting for the artist worker')
+
+# web metrics live in each web process
+web = Registry()
+request_duration = web.histogram(
+    'autobar_request_duration_seconds', 'Time to answer the order endpoints', REQUEST_BUCKETS, ('view', 'method'))
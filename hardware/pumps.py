@@ -1,69 +1,250 @@
-from gpiozero import DigitalOutputDevice
-from threading import Lock
+import time
+from gpiozero import DigitalOutputDevice, PWMOutputDevice
+from threading import Condition, Event, Lock
 
 from django.conf import settings
 from django.utils.log import logging
 
+from hardware import metrics
+
 logger = logging.getLogger('autobar')
 
 
+class PumpState:
+    OFF = 'off'
+    ON = 'on'
+
+    TRANSITIONS = {
+        OFF: (ON,),
+        ON: (OFF,),
+    }
+
+
+def ramp_speed(remaining, ramp_weight, min_speed):
+    """
+    PWM speed profile: full speed until remaining [g] is below ramp_weight [g],
+    then linear down to min_speed when remaining reaches 0
+    """
+    if remaining is None or ramp_weight <= 0 or remaining >= ramp_weight:
+        return 1.
+    if remaining <= 0:
+        return min_speed
+    return min_speed + (1. - min_speed) * remaining / ramp_weight
+
+
 class Pumps:
-    def __init__(self, pin_factory=None, safety_lock=True):
+    """
+    State machine around the pump outputs.
+
+    Every transition happens under one condition variable, so start, stop and stop_all
+    always leave the devices and the recorded states consistent.
+    With safety_lock, at most max_running pumps can be ON at a time (the power budget).
+    With pwm, pumps are PWMOutputDevice and their speed can be changed while ON
+    (the pin factory must support PWM, use MockFactory(pin_class=MockPWMPin) for mock pins).
+
+    hard_stop is the emergency path: it does not wait for the condition, drives every pin low
+    and latches a stopped state. No pump can start until acknowledge_stop is called, which waits
+    for the hard_stop calls in flight so none of their pin writes lands after it.
+    """
+    def __init__(self, pin_factory=None, safety_lock=True, pwm=False, max_running=1):
         self.safety_lock = safety_lock
-        if safety_lock:
-            self._one_pump_at_a_time = Lock()
-            self._started_pump = None
-        self.pumps = [DigitalOutputDevice(pin=pin, pin_factory=pin_factory) \
+        self.pwm = pwm
+        self.max_running = max_running
+        self._condition = Condition()
+        self._stopped = Event()
+        self._hard_stops = Condition(Lock())  # counts the hard_stop calls in flight
+        self._hard_stops_in_flight = 0
+        self.traces = {}  # pump id -> recorder of the order using it, see hardware.trace
+        device_class = PWMOutputDevice if pwm else DigitalOutputDevice
+        self.pumps = [device_class(pin=pin, pin_factory=pin_factory) \
             for pin in settings.GPIO_PUMPS]
-        logger.debug('Acquired GPIO control for the pumps, safety is %s' % ('on' if safety_lock else 'off'))
+        now = time.time()
+        self._states = [
+            {
+                'state': PumpState.OFF,
+                'since': now,
+                'started_at': None,
+                'starts': 0,
+                'on_time': 0.,
+            } for _ in self.pumps
+        ]
+        logger.debug('Acquired GPIO control for the %spumps, safety is %s', 'PWM ' if pwm else '', 'on' if safety_lock else 'off')
+
+    @property
+    def stopped(self):
+        return self._stopped.is_set()
+
+    @property
+    def running(self):
+        return [pump_id for pump_id, state in enumerate(self._states) if state['state'] == PumpState.ON]
+
+    def _can_start(self, pump_id):
+        running = self.running
+        return pump_id in running or len(running) < self.max_running
+
+    def set_max_running(self, max_running):
+        """Change the power budget, the starts waiting for it check it again"""
+        with self._condition:
+            self.max_running = max_running
+            self._condition.notify_all()
+
+    def _transition(self, pump_id, new_state):
+        """Must be called with the condition held"""
+        state = self._states[pump_id]
+        if state['state'] == new_state:
+            return False
+        if new_state not in PumpState.TRANSITIONS[state['state']]:
+            raise ValueError('Pump %i cannot go from %s to %s' % (pump_id, state['state'], new_state))
+        now = time.time()
+        if new_state == PumpState.ON:
+            state['started_at'] = now
+            state['starts'] += 1
+        elif state['started_at'] is not None:
+            state['on_time'] += now - state['started_at']
+            metrics.pump_on_time.labels(pump_id).inc(now - state['started_at'])
+            state['started_at'] = None
+        state['state'] = new_state
+        state['since'] = now
+        recorder = self.traces.get(pump_id)
+        if recorder is not None:
+            recorder.pump(pump_id, new_state == PumpState.ON)
+        self._condition.notify_all()
+        return True
+
+    def hard_stop(self):
+        """
+        Emergency stop that never waits for the pumps condition, safe to call while another thread
+        is inside start or stop. It only takes the small _hard_stops lock to count itself in flight
+        for acknowledge_stop. Latch first, so that a concurrent start sees it after writing its pin
+        and undoes it.
+        """
+        with self._hard_stops:
+            self._hard_stops_in_flight += 1
+        try:
+            self._stopped.set()
+            for pump in list(self.pumps):
+                pump.pin.state = False
+        finally:
+            with self._hard_stops:
+                self._hard_stops_in_flight -= 1
+                self._hard_stops.notify_all()
+        return True
+
+    def acknowledge_stop(self):
+        """Reconcile states after hard_stop and allow pumps to start again"""
+        with self._condition, self._hard_stops:
+            # a hard_stop that latches from now on waits to count itself, so it stays latched
+            self._hard_stops.wait_for(lambda: not self._hard_stops_in_flight)
+            for pump in self.pumps:
+                pump.off()
+            for pump_id in range(len(self._states)):
+                self._transition(pump_id, PumpState.OFF)
+            was_stopped = self.stopped
+            self._stopped.clear()
+        if was_stopped:
+            logger.info('Emergency stop acknowledged')
+        return was_stopped
 
     def stop_all(self):
-        if self.safety_lock:
-            if self._started_pump is not None:
-                logger.debug('You stopped all pumps, including the only running one pump %i' % self._started_pump)
-                self._started_pump = None
-                self._one_pump_at_a_time.release()
-            else:
-                logger.debug('You stopped all pumps, even if none was running')
+        with self._condition:
+            running = self.running
+            for pump in self.pumps:
+                pump.off()
+            for pump_id in range(len(self._states)):
+                self._transition(pump_id, PumpState.OFF)
+        if running:
+            logger.debug('You stopped all pumps, including the running pumps %s', running)
         else:
-            logger.debug('All pumps off')
-        for pump in self.pumps:
-            pump.off()
+            logger.debug('You stopped all pumps, even if none was running')
         return True
 
     def stop(self, pump_id):
-        self.pumps[pump_id].off()
-        if self.safety_lock:
-            if self._started_pump is not None and self._started_pump == pump_id:
-                logger.debug('You stopped the running pump %i' % pump_id)
-                self._started_pump = None
-                self._one_pump_at_a_time.release()
-                return True
-            else:
-                logger.error('Pump %i is off, but I think %s is still running. You will not be able to start another one' % (pump_id, self._started_pump))
-                return False
+        """
+        Always True: the pump is off afterwards, whether it was running or not. No lock is held
+        per started pump anymore, so stopping another pump cannot leave the next start blocked.
+        """
+        with self._condition:
+            self.pumps[pump_id].off()
+            was_running = self._transition(pump_id, PumpState.OFF)
+        if was_running:
+            logger.debug('You stopped the running pump %i', pump_id)
         else:
-            logger.debug('Pump %i off' % pump_id)
-            return True
-
-    def start(self, pump_id):
-        if self.safety_lock:
-            acquired = self._one_pump_at_a_time.acquire()
-            if acquired:
-                self._started_pump = pump_id
-                self.pumps[pump_id].on()
-                logger.debug('Pump %i is now the only one started (%s)' % (pump_id, self.pumps[pump_id].is_active))
-                return True
+            logger.debug('Pump %i off, it was not running', pump_id)
+        return True
+
+    def start(self, pump_id, timeout=0, speed=1.):
+        """
+        Start a pump. With safety_lock, wait at most timeout [s] for a running pump to stop.
+        Never blocks forever, returns False if the pump was not started.
+        speed in ]0, 1] is only used by PWM pumps.
+        """
+        with self._condition:
+            if self.stopped:
+                logger.error('Will not start pump %i because of the emergency stop', pump_id)
+                return False
+            if self.safety_lock and not self._condition.wait_for(lambda: self._can_start(pump_id), timeout=timeout):
+                logger.error('Will not start pump %i because pumps %s are already running', pump_id, self.running)
+                return False
+            if self.pwm:
+                self.pumps[pump_id].value = speed
             else:
-                logger.error('Will not start pump %i because pump %s is already running' % (pump_id, self._started_pump))
+                self.pumps[pump_id].on()
+            self._transition(pump_id, PumpState.ON)
+            if self.stopped:
+                # hard_stop happened while we were writing the pin
+                self.pumps[pump_id].off()
+                self._transition(pump_id, PumpState.OFF)
                 return False
-        else:
-            self.pumps[pump_id].on()
-            logger.debug('Pump %i on (%s)' % (pump_id, self.pumps[pump_id].on()))
-            return True
+        logger.debug('Pump %i on (%s)', pump_id, self.pumps[pump_id].value)
+        return True
+
+    def set_speed(self, pump_id, speed):
+        """Change the speed of a running PWM pump, returns False if the pump is not running"""
+        if not self.pwm:
+            return self._states[pump_id]['state'] == PumpState.ON
+        with self._condition:
+            if self._states[pump_id]['state'] != PumpState.ON:
+                return False
+            if not self.stopped:
+                self.pumps[pump_id].value = speed
+            if self.stopped:
+                # hard_stop happened before or while we were writing the pin
+                self.pumps[pump_id].off()
+                self._transition(pump_id, PumpState.OFF)
+                return False
+        return True
+
+    def snapshot(self):
+        """Copy of the state of each pump, for observability"""
+        with self._condition:
+            now = time.time()
+            pumps = []
+            for pump_id, state in enumerate(self._states):
+                on_time = state['on_time']
+                if state['started_at'] is not None:
+                    on_time += now - state['started_at']
+                pumps.append({
+                    'id': pump_id,
+                    'pin': settings.GPIO_PUMPS[pump_id],
+                    'state': state['state'],
+                    'since': state['since'],
+                    'starts': state['starts'],
+                    'on_time': on_time,
+                    'active': self.pumps[pump_id].is_active if pump_id < len(self.pumps) else False,
+                    'speed': self.pumps[pump_id].value if pump_id < len(self.pumps) else 0,
+                })
+            return {
+                'safety_lock': self.safety_lock,
+                'stopped': self.stopped,
+                'max_running': self.max_running,
+                'pwm': self.pwm,
+                'running': self.running,
+                'pumps': pumps,
+            }
 
     def close(self):
         logger.debug('Close pumps GPIO interface')
-        closed = [pump.close() for pump in self.pumps]
-        self.pumps = []  # puts pumps out of scope
+        with self._condition:
+            closed = [pump.close() for pump in self.pumps]
+            self.pumps = []  # puts pumps out of scope
         return closed
@@ -0,0 +1,186 @@
+"""
+Hardware daemon protocol.
+
+When settings.HARDWARE_SOCKET is set, the CocktailArtist lives in its own process (see the
+runhardware command) and owns the GPIO. The web processes talk to it over a Unix socket,
+one JSON object per line in both directions:
+
+    {"method": "status", "params": {}}
+    {"result": {...}} or {"error": "..."}
+"""
+import json
+import os
+import socket
+import socketserver
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.log import logging
+
+logger = logging.getLogger('autobar')
+
+
+class HardwareUnavailable(Exception):
+    pass
+
+
+class ArtistService:
+    """RPC methods, executed in the daemon with the real artist"""
+
+    def __init__(self, artist):
+        self.artist = artist
+
+    def accept_order(self, order_id):
+        from recipes.models import Order
+        order = Order.objects.get(pk=order_id)
+        return self.artist.accept_new_order(order)
+
+    def emergency_stop(self, received_at=None):
+        return self.artist.emergency_stop(received_at=received_at)
+
+    def status(self):
+        return self.artist.status()
+
+    def weight(self):
+        return self.artist.weight_snapshot()
+
+    def metrics(self):
+        return self.artist.render_metrics()
+
+    def history(self, series, seconds, resolution):
+        return self.artist.history(series, seconds, resolution)
+
+    def reload_config(self, values, clean_pumps=False):
+        from recipes.models import Configuration
+        config = Configuration(**values)
+        self.artist.reload_with_new_config(config, clean_pumps=clean_pumps)
+        return True
+
+    def dispatch(self, method, params):
+        if method.startswith('_') or method == 'dispatch' or not hasattr(self, method):
+            raise ValueError('Unknown method %s' % method)
+        return getattr(self, method)(**params)
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            received_at = time.monotonic()
+            try:
+                request = json.loads(line.decode())
+                params = request.get('params', {})
+                if request.get('method') == 'emergency_stop' and params.get('received_at') is None:
+                    params['received_at'] = received_at
+                response = {'result': self.server.service.dispatch(request['method'], params)}
+            except Exception as e:
+                logger.exception('Hardware RPC failed')
+                response = {'error': '%s: %s' % (e.__class__.__name__, e)}
+            finally:
+                close_old_connections()
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class HardwareServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, service):
+        self.service = service
+        super().__init__(path, RequestHandler)
+
+
+class HardwareClient:
+    def __init__(self, path, timeout=5):
+        self.path = path
+        self.timeout = timeout
+
+    def call(self, method, **params):
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.path)
+                sock.sendall((json.dumps({'method': method, 'params': params}) + '\n').encode())
+                with sock.makefile('rb') as stream:
+                    line = stream.readline()
+        except OSError as e:
+            raise HardwareUnavailable('Hardware daemon at %s: %s' % (self.path, e))
+        if not line:
+            raise HardwareUnavailable('Hardware daemon at %s closed the connection' % self.path)
+        response = json.loads(line.decode())
+        if 'error' in response:
+            raise HardwareUnavailable(response['error'])
+        return response['result']
+
+
+class ArtistProxy:
+    """Same interface as the CocktailArtist for the web tier, backed by the hardware daemon"""
+
+    def __init__(self, path):
+        self.client = HardwareClient(path)
+
+    def accept_new_order(self, order):
+        if order.pk is None:
+            order.save()  # the daemon loads it from the database
+        try:
+            accepted = self.client.call('accept_order', order_id=order.pk)
+        except HardwareUnavailable as e:
+            logger.error('Order refused, %s', e)
+            return False
+        order.accepted = accepted
+        return accepted
+
+    def emergency_stop(self, received_at=None):
+        return self.client.call('emergency_stop', received_at=received_at)
+
+    def status(self):
+        return self.client.call('status')
+
+    def weight_snapshot(self):
+        return self.client.call('weight')
+
+    def render_metrics(self):
+        return self.client.call('metrics')
+
+    def history(self, series, seconds, resolution):
+        return self.client.call('history', series=series, seconds=seconds, resolution=resolution)
+
+    def reload_with_new_config(self, config=None, clean_pumps=False):
+        from recipes.models import Configuration
+        config = config if config is not None else Configuration.get_solo()
+        values = {
+            field.attname: getattr(config, field.attname)
+            for field in config._meta.concrete_fields if field.attname != 'updated_at'
+        }
+        try:
+            self.client.call('reload_config', values=values, clean_pumps=clean_pumps)
+        except HardwareUnavailable as e:
+            logger.error('Hardware daemon did not reload its config, %s', e)
+
+
+_in_daemon = False  # True in the hardware daemon process
+
+
+def get_artist():
+    """The artist of this process, or a proxy to the hardware daemon"""
+    if getattr(settings, 'HARDWARE_SOCKET', None) and not _in_daemon:
+        return ArtistProxy(settings.HARDWARE_SOCKET)
+    from hardware.serving import CocktailArtist  # import here, web processes do not need the GPIO
+    return CocktailArtist.getInstance()
+
+
+def serve(path):
+    """Run the hardware daemon, blocks until interrupted"""
+    global _in_daemon
+    _in_daemon = True
+    from hardware.serving import CocktailArtist
+    artist = CocktailArtist.getInstance()
+    if os.path.exists(path):
+        os.unlink(path)  # stale socket from a previous run
+    server = HardwareServer(path, ArtistService(artist))
+    logger.info('Hardware daemon listening on %s', path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.unlink(path)
+        artist.close()
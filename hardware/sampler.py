@@ -0,0 +1,76 @@
+import threading
+import time
+
+from django.utils.log import logging
+
+from hardware.stations import station_config
+
+logger = logging.getLogger('autobar')
+
+
+class SamplerState:
+    ACTIVE = 'active'  # an order or a cleaning reads the weight at full rate itself
+    IDLE = 'idle'  # one read every weight_sampler_idle_period
+    POWERED_DOWN = 'powered down'  # after weight_sampler_power_down_delay without measures
+
+
+class Sampler(threading.Thread):
+    """
+    Keeps the weight cell of a station sampled between orders and powers it down after a long inactivity.
+
+    The serving threads read as fast as the HX711 converts, the sampler steps back while they
+    do. wake() powers the cell up from this thread as soon as an order is accepted, so the chip
+    has settled by the time the first dose is measured. A power up from another thread, such as
+    a weight view measuring, wakes the sampler too, so the power down delay starts over.
+    """
+    def __init__(self, artist, station):
+        super().__init__(daemon=True)
+        self.artist = artist
+        self.station = station
+        self.state = SamplerState.IDLE
+        self._wake = threading.Event()
+        self._exit = threading.Event()
+        station.weight_module.on_power_up = self.wake
+
+    def wake(self):
+        self.station.weight_module.last_measure = time.monotonic()
+        self._wake.set()
+
+    def stop(self):
+        self._exit.set()
+        self._wake.set()
+
+    def _set_state(self, state):
+        if state != self.state:
+            logger.debug('Weight sampler of %s is %s', self.station, state)
+            self.state = state
+
+    def step(self):
+        """One iteration, returns the time to wait before the next one [s]"""
+        weight_module = self.station.weight_module
+        config = station_config(self.artist.config, self.station.number)
+        idle_for = time.monotonic() - weight_module.last_measure
+        if self.station.busy or idle_for < config.weight_sampler_idle_period:
+            self._set_state(SamplerState.ACTIVE)
+            weight_module.power_up()
+            return config.weight_sampler_idle_period
+        if config.weight_sampler_power_down_delay and idle_for > config.weight_sampler_power_down_delay:
+            weight_module.power_down()  # nothing if still powered down
+            self._set_state(SamplerState.POWERED_DOWN)
+            return None  # until woken up, by wake() or a power up
+        self._set_state(SamplerState.IDLE)
+        weight_module.power_up()
+        weight_module.get_value()
+        weight_module.track_zero(config.weight_zero_tracking_range)  # nothing is served, the scale should be empty
+        return config.weight_sampler_idle_period
+
+    def run(self):
+        self.station.weight_module.last_measure = time.monotonic()  # idle from now on
+        while not self._exit.is_set():
+            try:
+                timeout = self.step()
+            except Exception:
+                logger.exception('Weight sampler failed')
+                timeout = 1.
+            self._wake.wait(timeout)
+            self._wake.clear()
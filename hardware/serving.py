@@ -1,3 +1,4 @@
+import queue
 import subprocess
 import time
 import threading
@@ -5,73 +6,120 @@ import threading
 from django.utils.log import logging
 from django.conf import settings
 
-from gpiozero import Button, LED
-from gpiozero.pins.mock import MockFactory
-
+from autobar.log import Throttle
 from hardware.singletonmixin import Singleton
 try:
     from hardware.weight import WeightModule
 except (RuntimeError, ModuleNotFoundError):
     class WeightModule:
         dummy = True
-        def init_from_settings_and_config(self, settings, config):
+        def init_from_settings_and_config(self, settings, config, station=0, stream=False):
             print('No WeightModule')
+        def update_from_config(self, config):
+            pass
+        def set_channel_gain(self, channel, gain):
+            pass
+        trace = None
+        telemetry = None
         def make_constant_weight_measure(self, *args, **kwargs):
             return 100
         def close(self):
             pass
-from hardware.pumps import Pumps
+from hardware.devices import DevicePool
+from hardware.sampler import Sampler
+from hardware.stations import Station, choose_station, station_config
+from hardware import metrics, timeseries, trace
 
 from recipes.models import Configuration, Dispenser
 
 logger = logging.getLogger('autobar')
 
+# Configuration fields, grouped by what must be done when they change
+CONFIG_FIELDS_IGNORED = ('id', 'updated_at', 'clean_pumps_now')
+CONFIG_FIELDS_HARDWARE = ('hardware_use_dummy', 'hardware_use_pwm_pumps')  # rebuild devices
+CONFIG_FIELDS_WEIGHT_CELL = ('weight_cell_channel', 'weight_cell_gain')  # HX711 adjustment
+CONFIG_FIELDS_WEIGHT_MODULE = ('weight_cell_offset', 'weight_cell_ratio', 'weight_cell_quadratic', 'weight_module_queue_length')  # in place
+CONFIG_FIELDS_DEVICES = (  # in place
+    'hardware_max_running_pumps',
+    'button_bounce_time_red',
+    'button_bounce_time_green',
+    'button_hold_time_red',
+    'button_hold_time_green',
+)
+# any other field only changes the behaviour of the next orders
+
+
+def dose_reached(weight, start_weight, target):
+    """Stop decision of the pour loop, weights in grams"""
+    return weight - start_weight > target
+
+
+def config_values(config):
+    return {
+        field.attname: getattr(config, field.attname)
+        for field in config._meta.concrete_fields if field.attname not in CONFIG_FIELDS_IGNORED
+    }
+
 
 class ThreadWithGPIO(threading.Thread):
-    def __init__(self, artist):
+    def __init__(self, artist, station):
         super().__init__()
         self.deamon = True
         self.exit_event = threading.Event()
-        self.config = artist.config
+        self.config = station_config(artist.config, station.number)
         self.artist = artist
+        self.station = station
+        self.weight_module = station.weight_module
         self.green_button = None
         self.green_button_led = None
+        self.started_pumps = set()  # stopped on exit, the other stations keep theirs
 
     def init_gpio(self):
-        pin_factory = MockFactory() if self.config.hardware_use_dummy else None
-        self.green_button = Button(
-            pin=settings.GPIO_GREEN_BUTTON,
-            bounce_time=self.config.button_bounce_time_green,
-            hold_time=self.config.button_hold_time_green,
-            pin_factory=pin_factory)
-        self.green_button_led = LED(pin=settings.GPIO_GREEN_BUTTON_LED, pin_factory=pin_factory)
+        # borrowed from the artist devices, they are not ours to close
+        self.green_button, self.green_button_led = self.artist.devices.borrow_green(self.station.number)
 
     def close_gpio(self):
         if self.green_button is not None:
-            self.green_button.close()
-        if self.green_button_led is not None:
-            self.green_button_led.close()
+            self.artist.devices.give_back_green(self.station.number)
+            self.green_button = None
+            self.green_button_led = None
+
+    def should_exit(self):
+        """Exit was called, or the pumps were hard stopped behind our back"""
+        return self.exit_event.is_set() or self.artist.pumps.stopped
+
+    def start_pump(self, pump_id, timeout=0):
+        """Waits at most timeout [s] for the power budget shared with the other stations"""
+        self.started_pumps.add(pump_id)
+        return self.artist.pumps.start(pump_id, timeout=timeout)
+
+    def release_pumps(self):
+        running = self.artist.pumps.running
+        for pump_id in self.started_pumps.intersection(running):
+            self.artist.pumps.stop(pump_id)
+        # the last serving thread to exit acknowledges the emergency stop
+        self.artist.acknowledge_stop_if_idle()
 
 
 class ServeOrderThread(ThreadWithGPIO):
-    def __init__(self, order, artist):
-        super().__init__(artist)
+    def __init__(self, order, artist, station):
+        super().__init__(artist, station)
         self.order = order
 
     def abandon_order(self):
-        logger.info('Abandon %s' % self.order)
+        logger.info('Abandon %s', self.order)
         self.order.status = 4
         self.order.save()
 
     def wait_to_start(self):
-        logger.debug('Waiting to start %s' % self.order)
+        logger.debug('Waiting to start %s', self.order)
         self.green_button_led.on()
         self.order.status = 1
         self.order.save()
 
         # this cannot be None, because no max_try is provided
-        start_weight = self.artist.weight_module.make_constant_weight_measure()
-        logger.debug('Current weight %sg, must reach %sg more for glass detection' % (start_weight, self.config.ux_glass_detection_value))
+        start_weight = self.weight_module.make_constant_weight_measure()
+        logger.debug('Current weight %sg, must reach %sg more for glass detection', start_weight, self.config.ux_glass_detection_value)
 
         start = time.time()
         while True:
@@ -83,7 +131,7 @@ class ServeOrderThread(ThreadWithGPIO):
             if self.config.ux_use_green_button_to_start_serving:
                 # button triggers the start
                 if self.green_button.is_active:
-                    logger.debug('Green button pressed, start serving %s' % self.order)
+                    logger.debug('Green button pressed, start serving %s', self.order)
                     return True
                 time.sleep(0.01)  # some delay ? TODO
             else:
@@ -91,16 +139,16 @@ class ServeOrderThread(ThreadWithGPIO):
 
                 # this call contains a (while weight is None) but for max_try only
                 # if weight is None we will come back here later thanks to the while True loop
-                weight = self.artist.weight_module.make_constant_weight_measure(clear=False, max_try=10)
+                weight = self.weight_module.make_constant_weight_measure(clear=False, max_try=10)
 
                 if weight is not None and weight - start_weight > self.config.ux_glass_detection_value:
                     # glass detected
-                    logger.debug('Detected a weight above the ux_glass_detection_value (%sg)' % self.config.ux_glass_detection_value)
+                    logger.debug('Detected a weight above the ux_glass_detection_value (%sg)', self.config.ux_glass_detection_value)
                     return True
 
             if time.time() - start > self.config.ux_timeout_glass_detection:  # TODO rename field
                 # timeout
-                logger.debug('Timeout (%ss) while waiting to start %s' % (self.config.ux_timeout_glass_detection, self.order))
+                logger.debug('Timeout (%ss) while waiting to start %s', self.config.ux_timeout_glass_detection, self.order)
                 if self.config.ux_serve_even_if_no_glass_detected:
                     logger.info('No trigger to start serving, but I will do it anyway because ux_serve_even_if_no_glass_detected is True')
                     return True
@@ -109,72 +157,85 @@ class ServeOrderThread(ThreadWithGPIO):
 
     def serve_dose(self, dose):
         if dose.ingredient.added_separately:
-            logger.debug('You can add %s separately' % dose.ingredient)
+            logger.debug('You can add %s separately', dose.ingredient)
             self.order.doses_served += 1
             self.order.save()
             return True
-        dispenser = Dispenser.get_available_dispenser(dose)
+        dispenser = Dispenser.get_available_dispenser(dose, station=self.station.number)
         if dispenser is None:
             # no dispenser, that should not happen since we checked is_available
             # but let's imagine two doses share the same ingredient which became empty in the meantime
-            logger.error('No available dispenser providing %s. Stopping cocktail' % dose.ingredient)
+            logger.error('No available dispenser providing %s at %s. Stopping cocktail', dose.ingredient, self.station)
             return False
 
+        if self.weight_module.trace is not None:
+            self.weight_module.trace.dose(dispenser.number, dose.weight)
         # this cannot be None, because no max_try is provided
-        start_weight = self.artist.weight_module.make_constant_weight_measure()
-        logger.debug('Current weight %sg, will stop when I reach %sg more' % (start_weight, dose.weight))
+        start_weight = self.weight_module.make_constant_weight_measure()
+        logger.debug('Current weight %sg, will stop when I reach %sg more', start_weight, dose.weight)
 
-        logger.debug('Starting pump %s' % dispenser.number)
-        if not self.artist.pumps.start(dispenser.number):
+        logger.debug('Starting pump %s', dispenser.number)
+        if not self.start_pump(dispenser.number, timeout=self.config.ux_timeout_serving):
             # it did not start, Pumps logs by itself the problem
             return False
 
-        logger.debug('Start serving %s using %s' % (dose, dispenser))
+        logger.debug('Start serving %s using %s', dose, dispenser)
         start = time.time()
+        progress_log = Throttle(1.)
         while True:  # main loop
-            if self.exit_event.is_set():
+            if self.should_exit():
                 # exit called
-                logger.debug('Exit thread while serving %s for %s' % (dose, self.order))
-                logger.debug('Stopping pump %s' % dispenser.number)
+                logger.debug('Exit thread while serving %s for %s', dose, self.order)
+                logger.debug('Stopping pump %s', dispenser.number)
                 self.artist.pumps.stop(dispenser.number)
                 return False
 
             # this call contains a (while weight is None) but for max_try only
             # if weight is None we will come back here later thanks to the while True loop
-            weight = self.artist.weight_module.make_constant_weight_measure(clear=False, max_try=10)
+            weight = self.weight_module.make_constant_weight_measure(clear=False, max_try=10)
+
+            if weight is not None and progress_log.ready():
+                logger.debug('Served %sg of %sg', weight - start_weight, dose.weight)
 
-            if weight is not None and weight - start_weight > dose.weight:
+            if weight is not None and self.artist.pumps.pwm:
+                # slow down when approaching the target weight
+                self.artist.pumps.set_speed(
+                    dispenser.number,
+                    dispenser.speed_for_remaining(dose.weight - (weight - start_weight)))
+
+            if weight is not None and dose_reached(weight, start_weight, dose.weight):
                 # weight reached
-                logger.debug('I finished %s for %s' % (dose, self.order))
-                logger.debug('Stopping pump %s' % dispenser.number)
+                logger.debug('I finished %s for %s', dose, self.order)
+                logger.debug('Stopping pump %s', dispenser.number)
                 self.artist.pumps.stop(dispenser.number)
                 time.sleep(self.config.ux_delay_between_two_doses)
-                end_weight = self.artist.weight_module.make_constant_weight_measure()
-                logger.debug('I distributed %i grams when you asked for %i grams' % (end_weight - start_weight, dose.weight))
+                end_weight = self.weight_module.make_constant_weight_measure()
+                logger.debug('I distributed %i grams when you asked for %i grams', end_weight - start_weight, dose.weight)
+                metrics.dose_error.labels(dispenser.number).observe(end_weight - start_weight - dose.weight)
                 self.order.doses_served += 1
                 self.order.save()
                 return True
 
             if time.time() - start > self.config.ux_timeout_serving:
                 # timeout
-                logger.debug('Timeout (%ss) while serving %s for %s using pump %i' % (self.config.ux_timeout_serving, dose, self.order, dispenser.number))
-                logger.debug('Stopping pump %s' % dispenser.number)
+                logger.debug('Timeout (%ss) while serving %s for %s using pump %i', self.config.ux_timeout_serving, dose, self.order, dispenser.number)
+                logger.debug('Stopping pump %s', dispenser.number)
                 self.artist.pumps.stop(dispenser.number)
                 if self.config.ux_mark_not_serving_dispensers_as_empty and not dispenser.is_empty:
-                    logger.info('Mark %s as empty' % dispenser)
+                    logger.info('Mark %s as empty', dispenser)
                     dispenser.is_empty = True
                     dispenser.save()
                 return False
 
             if self.green_button.is_active:
                 # button interruption
-                logger.debug('Button interrupt while serving %s for %s' % (dose, self.order))
-                logger.debug('Stopping pump %s' % dispenser.number)
+                logger.debug('Button interrupt while serving %s for %s', dose, self.order)
+                logger.debug('Stopping pump %s', dispenser.number)
                 self.artist.pumps.stop(dispenser.number)
                 return False
 
     def serve_order(self):
-        logger.debug('I am starting %s' % self.order)
+        logger.debug('I am starting %s', self.order)
         self.green_button_led.blink(
             on_time=self.config.button_blink_time_led_green,
             off_time=self.config.button_blink_time_led_green)
@@ -182,20 +243,23 @@ class ServeOrderThread(ThreadWithGPIO):
         doses = self.order.mix.ordered_doses()  # we already verified order.mix is True in accept_new_order
         self.order.status = 2
         self.order.save()
+        start = time.time()
         for dose in doses:
             if not self.serve_dose(dose):
                 self.green_button_led.off()
                 return False
         self.green_button_led.off()
+        metrics.serve_duration.labels(self.order.mix.name).observe(time.time() - start)
         return True
 
     def finish_order(self):
-        logger.info('Finished %s' % self.order)
+        logger.info('Finished %s', self.order)
         self.order.status = 3
         self.order.save()
 
     def run(self):
         try:
+            self.artist.start_trace(self)
             self.init_gpio()
             if self.wait_to_start():
                 if self.serve_order():
@@ -205,92 +269,275 @@ class ServeOrderThread(ThreadWithGPIO):
             else:
                 self.abandon_order()
         finally:
-            self.artist.pumps.stop_all()
+            self.release_pumps()
             self.close_gpio()
-            self.artist.busy = False  # tell artist we are done
+            self.artist.stop_trace(self)
+            self.station.busy = False  # tell artist we are done
 
 
 class CleanPumpsThread(ThreadWithGPIO):
-    def clean_pump(self, pump_id):
-        logger.debug('Start clean pump %s' % pump_id)
-        start = time.time()
-        self.artist.pumps.start(pump_id)
-        while True:  # main loop
-            if self.exit_event.is_set():
-                # exit called
-                logger.debug('Exit thread while cleaning pump %s' % pump_id)
-                self.artist.pumps.stop(pump_id)
-                return
-            if time.time() - start > 60:
-                # timeout
-                logger.debug('Done cleaning pump %s' % pump_id)
-                self.artist.pumps.stop(pump_id)
-                return
+    """
+    Runs the pumps of a station, up to hardware_max_running_pumps at the same time with the other
+    stations. The weight gained on the scale is shared between the running pumps, a pump is clean
+    once it moved clean_pumps_weight.
+    Cleaning pauses when the collection container is full, until it is emptied.
+    """
+    def __init__(self, artist, station, start_at_pump=0):
+        super().__init__(artist, station)
+        self._progress_lock = threading.Lock()
+        self._progress = {
+            'state': 'waiting',
+            'collected': 0.,
+            'pumps': {
+                pump_id: {'state': 'pending', 'moved': 0.}
+                for pump_id in station.pump_ids() if pump_id >= start_at_pump
+            },
+        }
+
+    def progress(self):
+        """Copy of the cleaning progress, for the status API"""
+        with self._progress_lock:
+            return {
+                'state': self._progress['state'],
+                'collected': self._progress['collected'],
+                'pumps': {pump_id: dict(pump) for pump_id, pump in self._progress['pumps'].items()},
+            }
+
+    def set_state(self, state, pump_id=None):
+        with self._progress_lock:
+            if pump_id is None:
+                self._progress['state'] = state
+            else:
+                self._progress['pumps'][pump_id]['state'] = state
+
+    def pumps_in_state(self, state):
+        with self._progress_lock:
+            return [pump_id for pump_id, pump in self._progress['pumps'].items() if pump['state'] == state]
+
+    def stop_pump(self, pump_id, state):
+        logger.debug('Stop cleaning pump %s, %s', pump_id, state)
+        self.artist.pumps.stop(pump_id)
+        self.set_state(state, pump_id)
+
+    def container_is_back(self, empty_weight):
+        """The scale weighs the empty container again, not the bare scale while it is lifted"""
+        weight = self.weight_module.make_constant_weight_measure(clear=False, max_try=10)
+        return weight is not None and abs(weight - empty_weight) < self.config.ux_glass_detection_value
+
+    def wait_for_empty_container(self, empty_weight):
+        """Returns the weight of the empty container, or None if exit was called"""
+        logger.info('Collection container is full, empty it to continue cleaning')
+        self.set_state('container full')
+        for pump_id in self.pumps_in_state('running'):
+            self.stop_pump(pump_id, 'pending')
+        while not self.exit_event.is_set():
+            if self.container_is_back(empty_weight):
+                time.sleep(self.config.ux_delay_before_start_serving)  # let it settle
+                if self.container_is_back(empty_weight):
+                    self.set_state('cleaning')
+                    return self.weight_module.make_constant_weight_measure()
+                continue
+            if self.green_button.is_active:
+                logger.debug('Green button pressed, the container is emptied')
+                self.set_state('cleaning')
+                return self.weight_module.make_constant_weight_measure()
+            time.sleep(self.config.weight_module_delay_measure)
+        return None
+
+    def clean_pumps(self):
+        target = self.config.clean_pumps_weight
+        concurrency = max(1, self.config.hardware_max_running_pumps)
+        empty_weight = self.weight_module.make_constant_weight_measure()
+        last_weight = empty_weight
+        started_at = {}
+        self.set_state('cleaning')
+        while self.pumps_in_state('pending') or self.pumps_in_state('running'):
+            if self.should_exit():
+                logger.debug('Exit thread while cleaning pumps %s', self.pumps_in_state('running'))
+                self.set_state('interrupted')
+                return False
+
+            # fill the power budget, what the other stations leave of it
+            running = self.pumps_in_state('running')
+            available = self.artist.pumps.max_running - len(self.artist.pumps.running)
+            for pump_id in self.pumps_in_state('pending')[:max(0, min(concurrency - len(running), available))]:
+                if self.start_pump(pump_id):
+                    logger.debug('Start clean pump %s', pump_id)
+                    started_at[pump_id] = time.time()
+                    self.set_state('running', pump_id)
+
+            time.sleep(self.config.weight_module_delay_measure)
+            weight = self.weight_module.make_constant_weight_measure(clear=False, max_try=10)
+            running = self.pumps_in_state('running')
+            if weight is not None:
+                gained = weight - last_weight
+                last_weight = weight
+                if gained > 0 and running:
+                    with self._progress_lock:
+                        self._progress['collected'] += gained
+                        for pump_id in running:
+                            self._progress['pumps'][pump_id]['moved'] += gained / len(running)
+
+            now = time.time()
+            for pump_id in running:
+                with self._progress_lock:
+                    moved = self._progress['pumps'][pump_id]['moved']
+                if moved >= target:
+                    self.stop_pump(pump_id, 'done')
+                elif now - started_at[pump_id] > self.config.clean_pumps_timeout:
+                    self.stop_pump(pump_id, 'timeout')
+
             if self.green_button.is_active:
                 # button interruption
-                logger.debug('Button interrupt while cleaning pump %s' % pump_id)
-                self.artist.pumps.stop(pump_id)
-                return
+                logger.debug('Button interrupt while cleaning pumps %s', running)
+                for pump_id in running:
+                    self.stop_pump(pump_id, 'skipped')
+
+            if weight is not None and weight - empty_weight >= self.config.clean_pumps_container_capacity:
+                empty_weight = self.wait_for_empty_container(empty_weight)
+                if empty_weight is None:
+                    self.set_state('interrupted')
+                    return False
+                last_weight = empty_weight
+                now = time.time()
+                for pump_id in started_at:
+                    started_at[pump_id] = now
+        self.set_state('finished')
+        return True
 
     def run(self):
         try:
             self.init_gpio()
-            logger.info('Cleaning pumps has started')
+            logger.info('Cleaning pumps of %s has started', self.station)
             self.green_button_led.blink(
                 on_time=self.config.button_blink_time_led_green,
                 off_time=self.config.button_blink_time_led_green)
-            for pump_id in range(len(self.artist.pumps.pumps)):
-                time.sleep(5)
-                self.clean_pump(pump_id)
+            time.sleep(self.config.ux_delay_before_start_serving)
+            if self.clean_pumps():
+                logger.info('Cleaning pumps of %s has finished %s', self.station, self.progress())
         finally:
-            self.artist.pumps.stop_all()
+            self.release_pumps()
             self.close_gpio()
-            self.artist.busy = False  # tell artist we are done
+            self.station.busy = False  # tell artist we are done
 
 
 class CocktailArtist(Singleton):  # inherits Singleton, there can only be one artist at a time
     def __init__(self):
         print('Artist id', id(self))  # unique
         self._config = None  # holder
-        self.thread = None
-        self.busy = False  # ready to take orders
-        self.weight_module = WeightModule()
-        self.pumps = None
-        self.red_button = None
-        self.reload_with_new_config()
+        self._config_values = {}  # what was applied to the hardware
+        self._tasks = queue.Queue()  # hardware work done off the request threads
+        self._worker = None
+        self._dispatch_lock = threading.Lock()  # an order is routed to a station at a time
+        self.stations = [Station(number, WeightModule()) for number in range(len(settings.STATIONS))]
+        self.devices = DevicePool()
+        self.emergency_stop_latency = metrics.emergency_stop_latency  # [s] from request to pins low
+        metrics.orders_in_progress.set_function(lambda: sum(station.busy for station in self.stations))
+        metrics.tasks_queued.set_function(self._tasks.qsize)
+        self.timeseries = timeseries.open_store()
+        if self.timeseries is not None:
+            for station in self.stations:
+                station.weight_module.telemetry = timeseries.Telemetry(self.timeseries, self, station)
+        self.apply_config(self.config)
+        for station in self.stations:
+            if not station.weight_module.dummy:
+                station.sampler = Sampler(self, station)
+                station.sampler.start()
 
     def close(self):
         logger.debug('Closing hardware interface')
+        for station in self.stations:
+            if station.sampler is not None:
+                station.sampler.stop()
+                station.sampler.join()
         self.stop_thread()
-        self.weight_module.close()
-        if self.pumps is not None:
-            self.pumps.close()
-        if self.red_button is not None:
-            self.red_button.close()
+        for station in self.stations:
+            station.weight_module.close()
+        if self.timeseries is not None:
+            self.timeseries.close()
+        self.devices.close()
+        self._config_values = {}
+
+    @property
+    def busy(self):
+        """Every station is busy, no order can be accepted"""
+        return all(station.busy for station in self.stations)
+
+    @property
+    def weight_module(self):
+        """Of the first station"""
+        return self.stations[0].weight_module
+
+    @property
+    def sampler(self):
+        return self.stations[0].sampler
+
+    @property
+    def pumps(self):
+        return self.devices.pumps
+
+    @property
+    def red_button(self):
+        return self.devices.red_button
 
     @property
     def config(self):
         if self._config is None:
             logger.debug('Cocktail artist loads config')
-            self._config = Configuration.get_solo()  # even if this is in cache, will keep pointer to it
+            # not get_solo, creating the row would save it and reload the artist we are building
+            self._config = Configuration.objects.first() or Configuration()
         return self._config
 
-    def reload_with_new_config(self, config=None):
-        self.close()
-        self._config = config  # if None, self.config will load a new one
-        config = self.config
+    def submit(self, function, *args):
+        """Run function on the hardware worker thread, after the previous submissions"""
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._work, daemon=True)
+            self._worker.start()
+        self._tasks.put((function, args))
 
-        self.weight_module.init_from_settings_and_config(settings, config)
-
-        # gpiozero objects
-        pin_factory = MockFactory() if config.hardware_use_dummy else None
-        self.pumps = Pumps(pin_factory)
-        self.red_button = Button(
-            pin=settings.GPIO_RED_BUTTON,
-            bounce_time=config.button_bounce_time_red,
-            hold_time=config.button_hold_time_red,
-            pin_factory=pin_factory)
-        self.red_button.when_held = self.on_red_button
+    def _work(self):
+        while True:
+            function, args = self._tasks.get()
+            try:
+                function(*args)
+            except Exception:
+                logger.exception('Hardware task %s failed', function.__name__)
+
+    def reload_with_new_config(self, config=None, clean_pumps=False):
+        """Apply what changed in config, in the background so that the request is not blocked"""
+        config = config if config is not None else Configuration.get_solo()
+        self.submit(self.apply_config, config, config_values(config))
+        if clean_pumps:
+            self.submit(self.clean_pumps)  # after the new config is applied
+
+    def apply_config(self, config, values=None):
+        values = values if values is not None else config_values(config)
+        initial = not self._config_values
+        changed = set(name for name, value in values.items() if self._config_values.get(name) != value)
+        self._config = config
+        self._config_values = values
+        if initial:
+            logger.debug('Initialize hardware from config')
+            for station in self.stations:
+                station.weight_module.init_from_settings_and_config(
+                    settings, station_config(config, station.number), station.number, stream=True)
+            self.devices.configure(config, on_red_button=self.on_red_button)
+            return
+        if not changed:
+            return
+        logger.debug('Configuration changed %s', sorted(changed))
+
+        if changed.intersection(CONFIG_FIELDS_HARDWARE + CONFIG_FIELDS_WEIGHT_CELL):
+            # a running order cannot continue with these changes
+            self.stop_thread(wait=True)
+        for station in self.stations:
+            station_values = station_config(config, station.number)
+            if changed.intersection(CONFIG_FIELDS_WEIGHT_CELL):
+                station.weight_module.set_channel_gain(station_values.weight_cell_channel, station_values.weight_cell_gain)
+            if changed.intersection(CONFIG_FIELDS_WEIGHT_MODULE):
+                station.weight_module.update_from_config(station_values)
+        if changed.intersection(CONFIG_FIELDS_HARDWARE + CONFIG_FIELDS_DEVICES):
+            self.devices.configure(config, on_red_button=self.on_red_button)
 
     def on_red_button(self):
         logger.debug('Red button pressed')
@@ -305,45 +552,161 @@ class CocktailArtist(Singleton):  # inherits Singleton, there can only be one ar
         subprocess.call(['killall', 'chromium-browser'], shell=False)
 
     def clean_pumps(self, start_at_pump=0):
-        nb_pumps = len(settings.GPIO_PUMPS)
-        if self.busy:
-            logger.info('Clean pumps command ignored because the Artist is busy')
-            return
-        self.busy = True
-        self.thread = CleanPumpsThread(self)
-        self.thread.start()  # good bye
-
-    def emergency_stop(self):
+        """Every station cleans its pumps, under the shared power budget"""
+        with self._dispatch_lock:
+            if any(station.busy for station in self.stations):
+                logger.info('Clean pumps command ignored because the Artist is busy')
+                return
+            self.acknowledge_stop_if_idle()
+            for station in self.stations:
+                station.busy = True
+        for station in self.stations:
+            if station.sampler is not None:
+                station.sampler.wake()
+            station.thread = CleanPumpsThread(self, station, start_at_pump=start_at_pump)
+            station.thread.start()  # good bye
+
+    def emergency_stop(self, received_at=None):
+        """
+        Drive all pumps low right away without waiting for the serving thread,
+        which acknowledges the stop when it exits.
+        received_at is the time.monotonic() at which the stop was requested,
+        the clock is shared by all processes
+        """
+        if received_at is None:
+            received_at = time.monotonic()
+        self.pumps.hard_stop()
+        self.emergency_stop_latency.observe(time.monotonic() - received_at)
+        current_order = self.current_order
+        stopped = {
+            'busy': self.busy,
+            'current_order': current_order.id if current_order is not None else None,
+            'orders': [order.id for order in self.current_orders()],
+        }
         logger.info('Emergency stop!')
         self.stop_thread()
-        self.pumps.stop_all()
+        self.acknowledge_stop_if_idle()
+        return stopped
+
+    def start_trace(self, thread):
+        """Record the weight samples, pumps and buttons of the order of a serving thread, see hardware.trace"""
+        station = thread.station
+        recorder = trace.open_recorder(thread.order.id)
+        station.weight_module.trace = recorder
+        for pump_id in station.pump_ids():
+            self.pumps.traces[pump_id] = recorder
+        self.devices.traces[station.number] = recorder
+
+    def stop_trace(self, thread):
+        station = thread.station
+        recorder = station.weight_module.trace
+        station.weight_module.trace = None
+        for pump_id, pump_recorder in list(self.pumps.traces.items()):
+            if pump_recorder is recorder:
+                del self.pumps.traces[pump_id]
+        self.devices.traces.pop(station.number, None)
+        if recorder is not None:
+            recorder.close()
+
+    def acknowledge_stop_if_idle(self):
+        current = threading.current_thread()
+        threads = [station.thread for station in self.stations if station.thread is not current]
+        if self.pumps.stopped and all(thread is None or not thread.is_alive() for thread in threads):
+            # no thread left to acknowledge the emergency stop
+            self.pumps.acknowledge_stop()
+
+    def status(self):
+        station = self.stations[0]
+        current_order = self.current_order
+        return {
+            'busy': self.busy,
+            'current_order': current_order.id if current_order is not None else None,
+            'pumps': self.pumps.snapshot() if self.pumps is not None else None,
+            'cleaning': station.status()['cleaning'],
+            'emergency_stop_latency': self.emergency_stop_latency.snapshot(),
+            'sampler': self.sampler.state if self.sampler is not None else None,
+            'weight_zero_drift': self.weight_zero_drift(station),
+            'stations': [
+                dict(station.status(), weight_zero_drift=self.weight_zero_drift(station))
+                for station in self.stations
+            ],
+        }
+
+    def weight_zero_drift(self, station):
+        if station.weight_module.dummy:
+            return None
+        return station.weight_module.offset - station_config(self.config, station.number).weight_cell_offset
+
+    def history(self, series, seconds, resolution):
+        """(timestamp, min, max, mean) of the weight, pumps or order series"""
+        if self.timeseries is None:
+            return []
+        return self.timeseries.query(series, seconds, resolution)
+
+    def render_metrics(self):
+        return metrics.hardware.render()
+
+    def weight_snapshot(self):
+        wm = self.weight_module
+        if wm.dummy:
+            weight = raw = converted = '-1'
+            samples = []
+        else:
+            weight = wm.make_constant_weight_measure()
+            raw = wm.get_value()
+            converted = wm.convert_value_to_weight(raw) if raw else None
+            samples = list(wm.queue)
+        return {
+            'weight': weight,
+            'raw_value': raw,
+            'converted_raw_value': converted,
+            'queue': samples,
+        }
+
+    def current_orders(self):
+        return [station.current_order for station in self.stations if station.current_order is not None]
 
     @property
     def current_order(self):
-        if not self.busy or self.thread is None or isinstance(self.thread, CleanPumpsThread):
-            return None
-        return self.thread.order
-
-    def stop_thread(self):
-        if self.thread is not None:
-            logger.debug('Stop thread %s' % self.thread)
-            self.thread.exit_event.set()
+        """The order of the first busy station"""
+        orders = self.current_orders()
+        return orders[0] if orders else None
+
+    def stop_thread(self, wait=False):
+        for station in self.stations:
+            thread = station.thread
+            if thread is not None:
+                logger.debug('Stop thread %s', thread)
+                thread.exit_event.set()
+        if wait:
+            for station in self.stations:
+                thread = station.thread
+                if thread is not None and thread is not threading.current_thread():
+                    thread.join(timeout=self.config.ux_timeout_serving)
 
     def accept_new_order(self, order):
-        if self.busy:
-            logger.error('We are already busy')
-            return False
+        """Routes the order to a free station with every ingredient of the mix"""
         if order.mix is None:
             logger.error('Your order has no associated mix')
             return False
         if not order.mix.is_available():
             logger.error('This mix is not available')
             return False
-
-        logger.debug('%s is accepted' % order)
-        self.busy = True
-        self.thread = ServeOrderThread(order, self)
-        self.thread.start()  # good bye
-        # thread will set busy = False
+        with self._dispatch_lock:
+            station, reason = choose_station(self.stations, order.mix)
+            if station is None:
+                logger.error('Cannot accept %s, %s', order, reason)
+                return False
+            self.acknowledge_stop_if_idle()
+            station.busy = True
+
+        logger.debug('%s is accepted at %s', order, station)
+        order.accepted = True  # before the thread saves the order
+        order.station = station.number
+        if station.sampler is not None:
+            station.sampler.wake()  # the cell settles while the order starts
+        station.thread = ServeOrderThread(order, self, station)
+        station.thread.start()  # good bye
+        # thread will set station.busy = False
 
         return True  # accepted and thread started
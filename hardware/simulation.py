@@ -0,0 +1,65 @@
+import random
+from collections import deque
+
+
+class PourSimulator:
+    """
+    Simulated pour of one pump onto the scale, driven in virtual time.
+
+    The flow follows the pump output with a first order lag (the tube), so liquid keeps
+    coming for a while after the pump stops. The scale reports the poured weight
+    with a delay and some noise, like the median filter of the WeightModule.
+    """
+    def __init__(self, pump, max_flow=13., stall=0.1, tube_lag=0.3, sensor_lag=0.1, noise=0.3, seed=0):
+        self.pump = pump  # gpiozero output device, value is read at each step
+        self.max_flow = max_flow  # [g/s] at full speed, 800 mL/min is about 13 g/s
+        self.stall = stall  # PWM value under which the pump does not move liquid
+        self.tube_lag = tube_lag  # [s]
+        self.sensor_lag = sensor_lag  # [s]
+        self.noise = noise  # [g]
+        self.random = random.Random(seed)
+        self.time = 0.
+        self.flow = 0.
+        self.poured = 0.
+        self.history = deque([(0., 0.)])
+
+    def target_flow(self):
+        value = float(self.pump.value)
+        if value <= self.stall:
+            return 0.
+        return self.max_flow * (value - self.stall) / (1. - self.stall)
+
+    def step(self, dt):
+        self.flow += (self.target_flow() - self.flow) * min(1., dt / self.tube_lag)
+        self.poured += self.flow * dt
+        self.time += dt
+        self.history.append((self.time, self.poured))
+        while len(self.history) > 1 and self.history[1][0] <= self.time - self.sensor_lag:
+            self.history.popleft()
+
+    def reading(self):
+        return self.history[0][1] + self.random.gauss(0, self.noise)
+
+
+def simulate_dose(pumps, pump_id, target, speed_for_remaining=None, period=0.1, timeout=30., settle=3., **simulator_kwargs):
+    """
+    Pour target [g] with the same stop decision as ServeOrderThread.serve_dose.
+    Returns the time to reach the target [s] and the final error [g] once the tube is drained.
+    """
+    simulator = PourSimulator(pumps.pumps[pump_id], **simulator_kwargs)
+    pumps.start(pump_id)
+    while simulator.time < timeout:
+        simulator.step(period)
+        weight = simulator.reading()
+        if speed_for_remaining is not None:
+            pumps.set_speed(pump_id, speed_for_remaining(target - weight))
+        if weight > target:
+            break
+    pumps.stop(pump_id)
+    duration = simulator.time
+    while simulator.time < duration + settle:
+        simulator.step(period)
+    return {
+        'time': duration,
+        'error': simulator.poured - target,
+    }
@@ -0,0 +1,76 @@
+"""
+Serving stations: one glass position each, with its own scale, green button and LED and the
+dispensers pouring above it. The artist serves one order per station at the same time, the pumps
+and their power budget are shared. See settings.STATIONS.
+"""
+import copy
+
+from django.conf import settings
+
+from recipes.models import Dispenser
+
+
+def station_config(config, number):
+    """Configuration with the overrides of settings.STATIONS[number], config itself if there are none"""
+    overrides = settings.STATIONS[number].get('config')
+    if not overrides:
+        return config
+    config = copy.copy(config)  # never saved, the overrides stay in the settings
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    return config
+
+
+class Station:
+    def __init__(self, number, weight_module):
+        self.number = number
+        self.weight_module = weight_module
+        self.sampler = None
+        self.thread = None
+        self.busy = False  # ready to take orders
+
+    def __str__(self):
+        return 'Station %i' % self.number
+
+    def pump_ids(self):
+        """Pumps of the dispensers of this station, pumps without a dispenser go to station 0"""
+        assigned = dict(Dispenser.objects.values_list('number', 'station'))
+        return [
+            pump_id for pump_id in range(len(settings.GPIO_PUMPS))
+            if assigned.get(pump_id, 0) == self.number
+        ]
+
+    def can_make(self, mix):
+        return mix.is_available(station=self.number)
+
+    @property
+    def current_order(self):
+        thread = self.thread
+        if not self.busy or thread is None or not hasattr(thread, 'order'):
+            return None
+        return thread.order
+
+    def status(self):
+        thread = self.thread
+        current_order = self.current_order
+        return {
+            'number': self.number,
+            'busy': self.busy,
+            'current_order': current_order.id if current_order is not None else None,
+            'cleaning': thread.progress() if self.busy and hasattr(thread, 'progress') else None,
+            'sampler': self.sampler.state if self.sampler is not None else None,
+        }
+
+
+def choose_station(stations, mix):
+    """
+    The first free station with dispensers for every ingredient of mix.
+    Returns (station, reason), station is None when no free station can make it.
+    """
+    free = [station for station in stations if not station.busy]
+    if not free:
+        return None, 'every station is busy'
+    for station in free:
+        if station.can_make(mix):
+            return station, None
+    return None, 'no free station can make %s' % mix
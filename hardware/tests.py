@@ -0,0 +1,244 @@
+import os
+import random
+import tempfile
+import threading
+import time
+from collections import deque
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase, override_settings
+
+from gpiozero.pins.mock import MockFactory, MockPWMPin
+
+from hardware import timeseries, weightstream
+from hardware.pumps import Pumps, PumpState
+from hardware.sampler import Sampler, SamplerState
+
+
+class PumpsStressTestCase(SimpleTestCase):
+    """Start, stop, stop_all, hard_stop and acknowledge_stop from several threads on mock pins"""
+    threads = 8
+    duration = 2  # [s]
+
+    def stress(self, max_running):
+        pumps = Pumps(pin_factory=MockFactory(), max_running=max_running)
+        self.addCleanup(pumps.close)
+        stop_event = threading.Event()
+        errors = []
+
+        def check():
+            snapshot = pumps.snapshot()
+            if len(snapshot['running']) > pumps.max_running:
+                errors.append('Too many pumps running at once: %s' % snapshot['running'])
+            for pump in snapshot['pumps']:
+                if pump['active'] and pump['state'] != PumpState.ON:
+                    errors.append('Pump %i is %s but its output is active' % (pump['id'], pump['state']))
+                if not snapshot['stopped'] and pump['active'] != (pump['state'] == PumpState.ON):
+                    errors.append('Pump %i is %s but its output is %s' % (pump['id'], pump['state'], pump['active']))
+
+        def worker(seed):
+            rng = random.Random(seed)
+            while not stop_event.is_set():
+                pump_id = rng.randrange(len(pumps.pumps))
+                action = rng.random()
+                if action < 0.5:
+                    pumps.start(pump_id, timeout=rng.choice((0, 0.001, 0.01)))
+                elif action < 0.9:
+                    if not pumps.stop(pump_id):
+                        errors.append('stop(%i) returned False' % pump_id)
+                elif action < 0.95:
+                    pumps.stop_all()
+                elif action < 0.98:
+                    pumps.hard_stop()  # emergency stop
+                else:
+                    pumps.acknowledge_stop()
+                check()
+
+        threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        time.sleep(self.duration)
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=10)
+            self.assertFalse(thread.is_alive(), 'A thread is blocked in the pumps')
+        self.assertEqual(errors[:5], [])
+
+        pumps.hard_stop()
+        self.assertFalse(any(pump.is_active for pump in pumps.pumps), 'A pump is active after hard_stop')
+        self.assertFalse(pumps.start(0), 'Started a pump before acknowledging the emergency stop')
+        pumps.acknowledge_stop()
+        pumps.stop_all()
+        for pump in pumps.snapshot()['pumps']:
+            self.assertEqual((pump['state'], pump['active']), (PumpState.OFF, False))
+        self.assertTrue(pumps.start(0), 'Cannot start a pump after stop_all')
+        pumps.stop_all()
+
+    def test_one_pump_at_a_time(self):
+        self.stress(max_running=1)
+
+    def test_power_budget(self):
+        self.stress(max_running=3)
+
+
+class PumpsTestCase(SimpleTestCase):
+    def setUp(self):
+        self.pumps = Pumps(pin_factory=MockFactory())
+        self.addCleanup(self.pumps.close)
+
+    def test_stop_of_a_pump_not_running(self):
+        # no lock is held per pump anymore, stopping an idle pump cannot leave the others blocked
+        self.assertTrue(self.pumps.stop(1))
+        self.assertTrue(self.pumps.start(0))
+        self.assertTrue(self.pumps.stop(1))
+        self.assertEqual(self.pumps.running, [0])
+
+    def test_start_is_bounded(self):
+        self.assertTrue(self.pumps.start(0))
+        start = time.monotonic()
+        self.assertFalse(self.pumps.start(1, timeout=0.05))
+        self.assertLess(time.monotonic() - start, 1)
+        self.pumps.stop(0)
+        self.assertTrue(self.pumps.start(1))
+
+    def test_set_speed_after_hard_stop(self):
+        pumps = Pumps(pin_factory=MockFactory(pin_class=MockPWMPin), pwm=True)
+        self.addCleanup(pumps.close)
+        self.assertTrue(pumps.start(0))
+        pumps._stopped.set()  # as hard_stop latching while set_speed writes the pin
+        self.assertFalse(pumps.set_speed(0, 0.5))
+        self.assertEqual(pumps.running, [])
+        self.assertFalse(pumps.pumps[0].is_active)
+
+    def test_raising_the_budget_wakes_waiting_starts(self):
+        self.assertTrue(self.pumps.start(0))
+        started = []
+        thread = threading.Thread(target=lambda: started.append(self.pumps.start(1, timeout=5)))
+        thread.start()
+        time.sleep(0.1)
+        self.pumps.set_max_running(2)
+        thread.join(timeout=1)
+        self.assertEqual(started, [True])
+        self.assertEqual(self.pumps.running, [0, 1])
+
+
+@override_settings(HARDWARE_SOCKET='/nonexistent/autobar-hardware.sock', ALLOWED_HOSTS=['*'])
+class HardwareUnavailableTestCase(SimpleTestCase):
+    def test_views_answer_503(self):
+        for method, url in (
+                ('post', '/hardware/emergencystop'),
+                ('get', '/hardware/status'),
+                ('get', '/hardware/history?series=weight'),
+                ('get', '/hardware/weightmeasure')):
+            with self.subTest(url=url):
+                response = getattr(self.client, method)(url)
+                self.assertEqual(response.status_code, 503)
+                self.assertIn('error', response.json())
+        self.assertIs(self.client.post('/hardware/emergencystop').json()['stopped'], False)
+
+
+class WeightStreamTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'weight')
+
+    def test_single_writer(self):
+        self.assertFalse(weightstream.writer_running(self.path))
+        writer = weightstream.WeightStreamWriter(self.path, slots=16)
+        self.addCleanup(writer.close)
+        writer.write(raw=1234, grams=5.)
+        self.assertTrue(weightstream.writer_running(self.path))
+        self.assertIsNone(weightstream.open_writer(self.path, 16))
+        reader = weightstream.WeightStreamReader(self.path)
+        self.addCleanup(reader.close)
+        self.assertEqual([sample.raw for sample in reader.latest(1)], [1234])  # not truncated
+
+    def test_writer_closed(self):
+        weightstream.WeightStreamWriter(self.path, slots=16).close()
+        self.assertFalse(weightstream.writer_running(self.path))
+        weightstream.WeightStreamWriter(self.path, slots=16).close()
+
+
+class MockCell:
+    def __init__(self):
+        self.powered = True
+
+    def power_down(self):
+        self.powered = False
+
+    def power_up(self):
+        self.powered = True
+        return True
+
+    def _read(self):
+        return 0
+
+
+class SamplerTestCase(SimpleTestCase):
+    def setUp(self):
+        with override_settings(GPIO_BACKEND='hardware.fakegpio.emulated_gpio'):  # off the Pi
+            from hardware.weight import WeightModule
+        self.weight_module = WeightModule()
+        self.weight_module.cell = MockCell()
+        self.weight_module.queue = deque(maxlen=4)
+        config = SimpleNamespace(
+            weight_sampler_idle_period=0.01, weight_sampler_power_down_delay=0.05, weight_zero_tracking_range=0)
+        self.station = SimpleNamespace(number=0, busy=False, weight_module=self.weight_module)
+        self.sampler = Sampler(SimpleNamespace(config=config), self.station)
+
+    def power_down(self):
+        self.weight_module.last_measure = time.monotonic() - 1
+        self.assertIsNone(self.sampler.step())
+        self.assertEqual(self.sampler.state, SamplerState.POWERED_DOWN)
+        self.assertFalse(self.weight_module.cell.powered)
+
+    def test_external_power_up(self):
+        self.power_down()
+        self.weight_module.power_up()  # as make_constant_weight_measure from a weight view
+        self.assertTrue(self.sampler._wake.is_set())
+        self.assertIsNotNone(self.sampler.step())
+        self.assertEqual(self.sampler.state, SamplerState.ACTIVE)
+        time.sleep(0.02)
+        self.assertIsNotNone(self.sampler.step())
+        self.assertEqual(self.sampler.state, SamplerState.IDLE)
+        self.assertTrue(self.weight_module.cell.powered)
+        self.power_down()  # the delay started over
+
+    def test_wake(self):
+        self.power_down()
+        self.sampler.wake()
+        self.assertIsNotNone(self.sampler.step())
+        self.assertEqual(self.sampler.state, SamplerState.ACTIVE)
+        self.assertTrue(self.weight_module.cell.powered)
+
+
+class TimeSeriesTestCase(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.retention = {resolution: 24 * 3600 for resolution in timeseries.TIERS}
+
+    def test_reopen_after_crash(self):
+        store = timeseries.TimeSeriesStore(self.directory, self.retention, save_period=0.05)
+        self.addCleanup(store.close)
+        now = time.time()
+        for index in range(30):
+            store.append({'weight': float(index)}, timestamp=now - 30 + index)
+        time.sleep(0.3)  # saved by the writer thread, the store is never closed as on a crash
+        reopened = timeseries.TimeSeriesStore(self.directory, self.retention)
+        rows = reopened.query('weight', 60, end=now)
+        self.assertEqual([row[1] for row in rows], [float(index) for index in range(30)])
+        self.assertTrue(reopened.query('weight', 60, resolution=10, end=now))  # the coarser tiers too
+
+    def test_appends_after_reopen_keep_the_saved_rows(self):
+        now = time.time()
+        store = timeseries.TimeSeriesStore(self.directory, self.retention)
+        store.append({'weight': 1.}, timestamp=now - 2)
+        store.close()
+        store = timeseries.TimeSeriesStore(self.directory, self.retention)
+        store.append({'weight': 2.}, timestamp=now - 1)
+        store.close()
+        rows = timeseries.TimeSeriesStore(self.directory, self.retention).query('weight', 60, end=now)
+        self.assertEqual([row[1] for row in rows], [1., 2.])
@@ -0,0 +1,309 @@
+"""
+Long-term telemetry: filtered weight, running pumps and current order, kept on disk.
+
+Each series is append-only and has tiers: the raw samples and min/max/mean buckets of
+1s, 10s and 60s. A tier is written in chunks, one file per chunk period, holding columns of
+fixed point integers, delta-encoded then compressed with zlib. The chunk being filled is
+rewritten by a writer thread every few seconds, so a crash or a power cut loses only that
+much. Chunks older than the retention of their tier are removed, so the disk usage stays bounded.
+
+Queries such as "last 60 minutes at 10s" read the coarsest tier that is fine enough and
+re-bucket it, decoded chunk files are cached by modification time.
+"""
+import os
+import threading
+import time
+import zlib
+from array import array
+from functools import lru_cache
+from itertools import accumulate
+from struct import Struct
+
+from django.utils.log import logging
+
+logger = logging.getLogger('autobar')
+
+MAGIC = b'ABTS'
+CHUNK_HEADER = Struct('<4sBxxxI')  # magic, columns, rows
+TIME_SCALE = 1000  # timestamps are stored in ms
+VALUE_SCALE = 100  # values are stored with 2 decimals
+
+TIERS = (0, 1, 10, 60)  # [s] resolution, 0 for the raw samples
+CHUNK_SECONDS = {0: 600, 1: 3600, 10: 6 * 3600, 60: 24 * 3600}
+RAW_COLUMNS = 2  # timestamp, value
+BUCKET_COLUMNS = 5  # timestamp, min, max, mean, count
+
+
+def encode(columns):
+    payload = array('q')
+    for index, column in enumerate(columns):
+        scale = TIME_SCALE if index == 0 else VALUE_SCALE
+        previous = 0
+        for value in column:
+            fixed = round(value * scale)
+            payload.append(fixed - previous)
+            previous = fixed
+    rows = len(columns[0])
+    return CHUNK_HEADER.pack(MAGIC, len(columns), rows) + zlib.compress(payload.tobytes(), 6)
+
+
+def decode(data):
+    magic, count, rows = CHUNK_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a time series chunk')
+    payload = array('q')
+    payload.frombytes(zlib.decompress(data[CHUNK_HEADER.size:]))
+    columns = []
+    for index in range(count):
+        scale = TIME_SCALE if index == 0 else VALUE_SCALE
+        columns.append([value / scale for value in accumulate(payload[index * rows:(index + 1) * rows])])
+    return columns
+
+
+@lru_cache(maxsize=128)
+def read_chunk(path, mtime):
+    """Decoded columns of a chunk file, mtime is part of the cache key"""
+    with open(path, 'rb') as f:
+        return decode(f.read())
+
+
+class Tier:
+    """
+    The open chunk is kept in memory whole and rewritten to its file by save(), so a restart
+    loses at most a save period. When a chunk period starts, the rows already written for it
+    before a restart are loaded back, and the previous chunk waits for save() to be written.
+    """
+    def __init__(self, directory, resolution, columns, retention):
+        self.directory = directory
+        self.resolution = resolution
+        self.chunk_seconds = CHUNK_SECONDS[resolution]
+        self.retention = retention  # [s]
+        self.chunk_start = None
+        self.columns = [array('d') for _ in range(columns)]
+        self.dirty = False  # rows added since the open chunk was saved
+        self._lock = threading.Lock()  # the files and the chunks in memory
+        self._closed = {}  # chunk start -> columns of the chunks not written yet
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, chunk_start):
+        return os.path.join(self.directory, '%i.chunk' % chunk_start)
+
+    def _load(self, chunk_start):
+        """Columns written for this chunk period before a restart, empty ones if none"""
+        path = self.path(chunk_start)
+        if not os.path.exists(path):
+            return [array('d') for _ in self.columns]
+        try:
+            return [array('d', column) for column in read_chunk(path, os.stat(path).st_mtime_ns)]
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning('Time series chunk %s is unreadable, overwritten: %s', path, e)
+            return [array('d') for _ in self.columns]
+
+    def add(self, row):
+        chunk_start = row[0] - row[0] % self.chunk_seconds
+        with self._lock:
+            if chunk_start != self.chunk_start:
+                if self.chunk_start is not None and self.dirty:
+                    self._closed[self.chunk_start] = self.columns
+                self.chunk_start = chunk_start
+                self.columns = self._closed.pop(chunk_start, None) or self._load(chunk_start)
+            for column, value in zip(self.columns, row):
+                column.append(value)
+            self.dirty = True
+
+    def save(self):
+        """Write the closed chunks and the open one, called by the writer thread of the store"""
+        with self._lock:
+            chunks = dict(self._closed)
+            if self.dirty:
+                chunks[self.chunk_start] = [array('d', column) for column in self.columns]
+                self.dirty = False
+        for chunk_start, columns in chunks.items():
+            path = self.path(chunk_start)
+            temporary = path + '.tmp'
+            with open(temporary, 'wb') as f:
+                f.write(encode(columns))
+            with self._lock:
+                os.replace(temporary, path)
+                if self._closed.get(chunk_start) is columns:
+                    del self._closed[chunk_start]
+        if chunks:
+            with self._lock:
+                self.prune(time.time() - self.retention)
+
+    def prune(self, before):
+        for name in os.listdir(self.directory):
+            if name.endswith('.chunk') and int(name[:-len('.chunk')]) + self.chunk_seconds < before:
+                os.unlink(os.path.join(self.directory, name))
+
+    def rows(self, start, end):
+        """Rows with a timestamp in [start, end), oldest first"""
+        rows = []
+        with self._lock:
+            in_memory = dict(self._closed)
+            if self.chunk_start is not None:
+                in_memory[self.chunk_start] = self.columns
+            starts = set(in_memory).union(
+                int(name[:-len('.chunk')]) for name in os.listdir(self.directory) if name.endswith('.chunk'))
+            for chunk_start in sorted(starts):
+                if chunk_start + self.chunk_seconds <= start or chunk_start >= end:
+                    continue
+                columns = in_memory.get(chunk_start)
+                if columns is None:
+                    path = self.path(chunk_start)
+                    columns = read_chunk(path, os.stat(path).st_mtime_ns)
+                rows.extend(row for row in zip(*columns) if start <= row[0] < end)
+        return rows
+
+
+class Series:
+    def __init__(self, directory, retention):
+        self.raw = Tier(os.path.join(directory, 'raw'), 0, RAW_COLUMNS, retention[0])
+        self.tiers = [
+            Tier(os.path.join(directory, '%is' % resolution), resolution, BUCKET_COLUMNS, retention[resolution])
+            for resolution in TIERS[1:]
+        ]
+        self._buckets = [None for _ in self.tiers]  # [start, min, max, sum, count] being filled
+
+    def append(self, timestamp, value):
+        self.raw.add((timestamp, value))
+        for index, tier in enumerate(self.tiers):
+            bucket = self._buckets[index]
+            if bucket is not None and timestamp >= bucket[0] + tier.resolution:
+                tier.add((bucket[0], bucket[1], bucket[2], bucket[3] / bucket[4], bucket[4]))
+                bucket = None
+            if bucket is None:
+                self._buckets[index] = [timestamp - timestamp % tier.resolution, value, value, value, 1]
+            else:
+                bucket[1] = min(bucket[1], value)
+                bucket[2] = max(bucket[2], value)
+                bucket[3] += value
+                bucket[4] += 1
+
+    def save(self):
+        for tier in [self.raw] + self.tiers:
+            tier.save()
+
+    def query(self, start, end, resolution):
+        """(timestamp, min, max, mean) buckets of resolution [s] in [start, end)"""
+        tier = self.raw
+        for candidate in self.tiers:
+            if candidate.resolution <= resolution:
+                tier = candidate
+        if tier is self.raw:
+            rows = ((t, value, value, value, 1) for t, value in tier.rows(start, end))
+        else:
+            rows = tier.rows(start, end)
+        if resolution <= 0:
+            return [row[:4] for row in rows]
+        buckets = []
+        current = None
+        for t, low, high, mean, count in rows:
+            bucket_start = t - t % resolution
+            if current is None or current[0] != bucket_start:
+                if current is not None:
+                    buckets.append((current[0], current[1], current[2], current[3] / current[4]))
+                current = [bucket_start, low, high, mean * count, count]
+            else:
+                current[1] = min(current[1], low)
+                current[2] = max(current[2], high)
+                current[3] += mean * count
+                current[4] += count
+        if current is not None:
+            buckets.append((current[0], current[1], current[2], current[3] / current[4]))
+        return buckets
+
+
+class TimeSeriesStore:
+    """Series by name. With save_period, a writer thread of its own saves them to disk that often"""
+    def __init__(self, directory, retention, save_period=None):
+        self.directory = directory
+        self.retention = retention  # [s] per tier resolution
+        self._lock = threading.Lock()
+        self._series = {}
+        self._exit = threading.Event()
+        self._writer = None
+        if save_period:
+            self._writer = threading.Thread(target=self._write_every, args=(save_period,), daemon=True)
+            self._writer.start()
+
+    def _get(self, name):
+        series = self._series.get(name)
+        if series is None:
+            series = self._series[name] = Series(os.path.join(self.directory, name), self.retention)
+        return series
+
+    def append(self, values, timestamp=None):
+        """values is a dict of series name to value, recorded at the same time"""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            for name, value in values.items():
+                self._get(name).append(timestamp, value)
+
+    def query(self, name, seconds, resolution=0., end=None):
+        """The last seconds of a series, bucketed at resolution [s], 0 for the raw samples"""
+        end = time.time() if end is None else end
+        with self._lock:
+            series = self._get(name)
+        return series.query(end - seconds, end, resolution)  # tiers lock their files, appends are not blocked
+
+    def save(self):
+        with self._lock:
+            series = list(self._series.values())
+        for one in series:  # appends go on meanwhile
+            one.save()
+
+    def _write_every(self, period):
+        while not self._exit.wait(period):
+            try:
+                self.save()
+            except OSError as e:
+                logger.error('Time series not saved: %s', e)
+
+    def close(self):
+        """Stop the writer thread and save what is in memory"""
+        self._exit.set()
+        if self._writer is not None:
+            self._writer.join()
+        self.save()
+
+
+def series_name(name, station=0):
+    """weight and order of station 1 are weight_1 and order_1, the pumps are shared"""
+    return name if not station else '%s_%i' % (name, station)
+
+
+class Telemetry:
+    """
+    Records the weight, the running pumps (bit mask) and the current order id at each weight
+    sample of a station. The first station records the pumps.
+    """
+    def __init__(self, store, artist, station):
+        self.store = store
+        self.artist = artist
+        self.station = station
+
+    def weight(self, grams):
+        order = self.station.current_order
+        values = {
+            series_name('weight', self.station.number): grams,
+            series_name('order', self.station.number): order.id if order is not None else 0,
+        }
+        if not self.station.number:
+            pumps = self.artist.pumps
+            values['pumps'] = sum(1 << pump_id for pump_id in pumps.running) if pumps is not None else 0
+        self.store.append(values)
+
+
+def open_store():
+    """Store of settings.TIMESERIES_DIR saved every TIMESERIES_SAVE_PERIOD, None if disabled or not writable"""
+    from django.conf import settings
+    directory = getattr(settings, 'TIMESERIES_DIR', None)
+    if not directory:
+        return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        return TimeSeriesStore(directory, settings.TIMESERIES_RETENTION, settings.TIMESERIES_SAVE_PERIOD)
+    except OSError as e:
+        logger.warning('No time series at %s: %s', directory, e)
+        return None
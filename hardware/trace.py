@@ -0,0 +1,192 @@
+"""
+Weight traces: what the load cell saw during an order, to replay it later.
+
+One file per order in settings.TRACE_DIR, a header followed by fixed size records
+(monotonic timestamp, kind, subject, value). Raw HX711 counts are recorded as they are read,
+along with pump and button events and the start of each dose. The oldest files are removed
+to keep at most settings.TRACE_MAX_FILES, a file stops growing at settings.TRACE_MAX_FILE_SIZE.
+
+Replay feeds the recorded counts back through a WeightModule and the pour decision of
+ServeOrderThread, as fast as the CPU allows.
+"""
+import os
+import time
+from collections import deque, namedtuple
+from struct import Struct
+
+from django.utils.log import logging
+
+logger = logging.getLogger('autobar')
+
+MAGIC = b'ABTRACE1'
+HEADER = Struct('<8sqd')  # magic, order id, wall clock time of the first record
+RECORD = Struct('<dBBxxi')  # monotonic timestamp, kind, subject, value
+
+SAMPLE = 1  # value is the raw count, subject 1 if the read failed
+PUMP = 2  # subject is the pump number, value 1 for on and 0 for off
+BUTTON = 3  # subject is GREEN or RED, value 1 for pressed
+DOSE = 4  # subject is the dispenser number, value the target in mg
+
+GREEN = 0
+RED = 1
+
+TraceRecord = namedtuple('TraceRecord', ('timestamp', 'kind', 'subject', 'value'))
+
+
+class TraceRecorder:
+    def __init__(self, path, order_id, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        self.size = HEADER.size
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, order_id, time.time()))
+
+    def _write(self, kind, subject, value):
+        # one write per record, atomic for the buffered file shared by the serving and GPIO threads
+        if self.max_size is not None and self.size + RECORD.size > self.max_size:
+            return
+        self.size += RECORD.size
+        self._file.write(RECORD.pack(time.monotonic(), kind, subject, value))
+
+    def sample(self, raw):
+        if raw is None:
+            self._write(SAMPLE, 1, 0)
+        else:
+            self._write(SAMPLE, 0, raw)
+
+    def pump(self, pump_id, on):
+        self._write(PUMP, pump_id, 1 if on else 0)
+
+    def button(self, button, pressed):
+        self._write(BUTTON, button, 1 if pressed else 0)
+
+    def dose(self, dispenser_number, target):
+        self._write(DOSE, dispenser_number, int(round(target * 1000)))
+
+    def close(self):
+        self._file.close()
+
+
+def read_trace(path):
+    """Returns the order id, the wall clock start time and the list of records"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, order_id, started_at = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('%s is not a weight trace' % path)
+    end = len(data) - (len(data) - HEADER.size) % RECORD.size  # the last record may be cut
+    records = [TraceRecord(*fields) for fields in RECORD.iter_unpack(data[HEADER.size:end])]
+    return order_id, started_at, records
+
+
+def prune(directory, max_files):
+    """Remove the oldest traces to keep max_files - 1, room for the next one"""
+    traces = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith('.trace')),
+        key=lambda entry: entry.stat().st_mtime)
+    for entry in traces[:max(0, len(traces) - max_files + 1)]:
+        os.unlink(entry.path)
+
+
+def open_recorder(order_id):
+    """Recorder for this order, None if traces are disabled or cannot be written"""
+    from django.conf import settings
+    directory = getattr(settings, 'TRACE_DIR', None)
+    if not directory:
+        return None
+    try:
+        os.makedirs(directory, exist_ok=True)
+        prune(directory, settings.TRACE_MAX_FILES)
+        path = os.path.join(directory, 'order-%06i-%i.trace' % (order_id, time.time()))
+        return TraceRecorder(path, order_id, settings.TRACE_MAX_FILE_SIZE)
+    except OSError as e:
+        logger.warning('No weight trace for order %s: %s', order_id, e)
+        return None
+
+
+class EndOfTrace(Exception):
+    pass
+
+
+class ReplayCell:
+    """Stands for the HX711 of a WeightModule, reads return the recorded counts in order"""
+
+    def __init__(self, records):
+        self.samples = [record for record in records if record.kind == SAMPLE]
+        self.position = 0
+
+    @property
+    def timestamp(self):
+        """Time of the last sample read"""
+        return self.samples[max(0, self.position - 1)].timestamp
+
+    def _read(self):
+        if self.position >= len(self.samples):
+            raise EndOfTrace()
+        record = self.samples[self.position]
+        self.position += 1
+        return False if record.subject else record.value
+
+    def power_up(self):
+        return True
+
+    def power_down(self):
+        pass
+
+    def cleanup(self):
+        pass
+
+
+def replay(records, config, reached=None):
+    """
+    Replays each dose of a trace with the weight filter of config and the stop decision
+    reached(weight, start_weight, target), by default the one of ServeOrderThread.
+    Returns per dose the recorded and replayed stops (seconds after the dose start, and the
+    filtered weight poured at that time) and the weight poured once settled, all in grams.
+    Counts recorded after the real pump stop do not include the liquid a later stop would have poured.
+    hardware.weight must be importable, see settings.GPIO_BACKEND.
+    """
+    from hardware.serving import dose_reached
+    from hardware.weight import WeightModule
+    reached = reached or dose_reached
+    results = []
+    doses = [record for record in records if record.kind == DOSE]
+    for index, dose in enumerate(doses):
+        end = doses[index + 1].timestamp if index + 1 < len(doses) else float('inf')
+        target = dose.value / 1000
+        pump_off = next(
+            (r.timestamp for r in records
+             if r.kind == PUMP and r.subject == dose.subject and not r.value and dose.timestamp < r.timestamp < end), None)
+
+        weight_module = WeightModule()
+        weight_module.cell = ReplayCell([r for r in records if dose.timestamp <= r.timestamp < end])
+        weight_module.queue = deque(maxlen=config.weight_module_queue_length)
+        weight_module.update_from_config(config)
+        result = {
+            'dispenser': dose.subject,
+            'target': target,
+            'recorded_stop': None if pump_off is None else pump_off - dose.timestamp,
+            'recorded_weight': None,
+            'replayed_stop': None,
+            'replayed_weight': None,
+            'settled_weight': None,
+        }
+        start_weight = weight = None
+        try:
+            start_weight = weight_module.make_constant_weight_measure()
+            while True:  # until the end of the dose, the settled weight is the last filtered one
+                measure = weight_module.make_constant_weight_measure(clear=False, max_try=10)
+                if measure is None:
+                    continue
+                weight = measure
+                timestamp = weight_module.cell.timestamp
+                if result['recorded_weight'] is None and pump_off is not None and timestamp >= pump_off:
+                    result['recorded_weight'] = weight - start_weight
+                if result['replayed_stop'] is None and reached(weight, start_weight, target):
+                    result['replayed_stop'] = timestamp - dose.timestamp
+                    result['replayed_weight'] = weight - start_weight
+        except EndOfTrace:
+            if start_weight is not None and weight is not None:
+                result['settled_weight'] = weight - start_weight
+        results.append(result)
+    return results
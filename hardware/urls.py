@@ -1,8 +1,11 @@
 from django.urls import path
 
-from .views import EmergencyStopView, WeightMeasureView
+from .views import EmergencyStopView, HistoryView, MetricsView, StatusView, WeightMeasureView
 
 urlpatterns = [
     path('hardware/emergencystop', EmergencyStopView.as_view(), name='emergency_stop'),
+    path('hardware/status', StatusView.as_view(), name='status'),
+    path('metrics', MetricsView.as_view(), name='metrics'),
+    path('hardware/history', HistoryView.as_view(), name='history'),
     path('hardware/weightmeasure', WeightMeasureView.as_view(), name='weight_measure'),
 ]
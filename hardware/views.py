@@ -1,39 +1,91 @@
+import time
+
+from django.conf import settings
 from django.views import View
-from django.http import JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.utils.log import logging
 
-from recipes.models import Configuration
-from hardware.serving import CocktailArtist
+from hardware import metrics
+from hardware.rpc import HardwareUnavailable, get_artist
+from hardware.timeseries import series_name
 
 logger = logging.getLogger('autobar')
 
 
+def unavailable(error, message, **payload):
+    """503 JSON answer of a view that could not reach the hardware daemon"""
+    logger.error('%s, %s', message, error)
+    return JsonResponse(dict(payload, error='%s: %s' % (message, error)), status=503)
+
+
 class EmergencyStopView(View):
     def post(self, request, *args, **kwargs):
-        artist = CocktailArtist.getInstance()
-        response = {
-            'busy': artist.busy,
-            'current_order': artist.current_order.id if artist.current_order is not None else None,
-        }
-        artist.emergency_stop()
+        received_at = time.monotonic()
+        try:
+            response = get_artist().emergency_stop(received_at=received_at)  # pins are low when this returns
+        except HardwareUnavailable as e:
+            return unavailable(e, 'The pumps were not stopped', stopped=False)
         return JsonResponse(response)
 
+
+class TimedViewMixin:
+    """Records the time to answer in the autobar_request_duration_seconds histogram"""
+
+    def dispatch(self, request, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            metrics.request_duration.labels(self.__class__.__name__, request.method).observe(time.perf_counter() - start)
+
+
+class MetricsView(View):
+    """Prometheus text format, web process metrics followed by the hardware ones"""
+
+    def get(self, request, *args, **kwargs):
+        text = metrics.web.render()
+        try:
+            text += get_artist().render_metrics()
+        except HardwareUnavailable as e:
+            logger.error('No hardware metrics, %s', e)
+        return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class StatusView(View):
+    def get(self, request, *args, **kwargs):
+        try:
+            return JsonResponse(get_artist().status())
+        except HardwareUnavailable as e:
+            return unavailable(e, 'No hardware status')
+
+
+class HistoryView(View):
+    """?series=weight|pumps|order&seconds=3600&resolution=10&station=0 gives [timestamp, min, max, mean] buckets"""
+
+    def get(self, request, *args, **kwargs):
+        series = request.GET.get('series', 'weight')
+        if series not in ('weight', 'pumps', 'order'):
+            return HttpResponseBadRequest('Unknown series %s' % series)
+        try:
+            seconds = float(request.GET.get('seconds', 3600))
+            resolution = float(request.GET.get('resolution', 10))
+            station = int(request.GET.get('station', 0))
+        except ValueError:
+            return HttpResponseBadRequest('seconds, resolution and station must be numbers')
+        if not 0 <= station < len(settings.STATIONS):
+            return HttpResponseBadRequest('Unknown station %s' % station)
+        if series != 'pumps':
+            series = series_name(series, station)
+        try:
+            buckets = get_artist().history(series, seconds, resolution)
+        except HardwareUnavailable as e:
+            return unavailable(e, 'No history', series=series)
+        return JsonResponse({'series': series, 'buckets': buckets})
+
+
 class WeightMeasureView(View):
     def get(self, request, *args, **kwargs):
-        artist = CocktailArtist.getInstance()
-        wm = artist.weight_module
-        if wm.dummy:
-            weight = raw = converted = '-1'
-            queue = []
-        else:
-            weight = wm.make_constant_weight_measure()
-            raw = wm.get_value()
-            converted = wm.convert_value_to_weight(raw) if raw else None
-            queue = list(wm.queue)
-        response = {
-            'weight': weight,
-            'raw_value': raw,
-            'converted_raw_value': converted,
-            'queue': queue,
-        }
-        return JsonResponse(response)
+        try:
+            return JsonResponse(get_artist().weight_snapshot())
+        except HardwareUnavailable as e:
+            return unavailable(e, 'No weight measure')
@@ -6,12 +6,13 @@ from statistics import median, StatisticsError
 import threading
 import weakref
 
-import RPi.GPIO as GPIO
-GPIO.setmode(GPIO.BCM)
-
 from django.conf import settings
 from django.utils.log import logging
+from autobar.log import Throttle
+from hardware.gpio import GPIO  # RPi.GPIO on the Pi, see settings.GPIO_BACKEND
 from recipes.models import Configuration
+from hardware.weightstream import open_writer, station_path
+from hardware import metrics
 
 logger = logging.getLogger('autobar')
 
@@ -82,6 +83,26 @@ class HX711(object):
         self._read()
         time.sleep(0.5)
 
+    def set_channel_gain(self, channel, gain):
+        """Change both at once, with a single adjustment delay"""
+        if channel not in self._data:
+            raise ValueError('Channel has to be in %s' % str(self._data.keys()))
+        if gain not in self._data[channel]:
+            raise ValueError('Gain has to be in %s' % str(self._data[channel].keys()))
+        self._channel, self._gain = channel, gain
+        self._read()
+        time.sleep(0.5)
+
+    def read_and_select(self, channel, gain):
+        """
+        Reads the conversion in progress, its extra pulses select channel and gain for the next one.
+        No adjustment delay, the caller knows which conversions to drop.
+        """
+        if gain not in self._data.get(channel, ()):
+            raise ValueError('No gain %s on channel %s' % (gain, channel))
+        self._channel, self._gain = channel, gain
+        return self._read()
+
     def zero(self):
         """
         sets the current data as an offset for the current channel and gain.
@@ -112,6 +133,7 @@ class HX711(object):
             end_counter = time.perf_counter()
             # check if hx 711 did not turn off...
             if end_counter - start_counter >= self._power_down_delay:
+                metrics.hx711_power_down_violations.labels('set_channel_gain').inc()
                 if self._debug_mode:
                     print('Not enough fast while setting gain and channel')
                     print(
@@ -135,6 +157,7 @@ class HX711(object):
             time.sleep(0.01)  # sleep for 10 ms because data is not ready
             ready_counter += 1
             if ready_counter == 50:  # if counter reached max value then return False
+                metrics.hx711_not_ready.inc()
                 if self._debug_mode:
                     print('self._read() not ready after 40 trials\n')
                 return False
@@ -149,6 +172,7 @@ class HX711(object):
             end_counter = time.perf_counter()
             if end_counter - start_counter >= self._power_down_delay:  # check if the hx 711 did not turn off...
                 # if pd_sck pin is HIGH for 60 us and more than the HX 711 enters power down mode.
+                metrics.hx711_power_down_violations.labels('read').inc()
                 if self._debug_mode:
                     print('Not enough fast while reading data')
                     print(
@@ -168,6 +192,7 @@ class HX711(object):
         if data_in in [0x7fffff, 0x800000]:
             # 0x7fffff is the highest possible value from hx711
             # 0x800000 is the lowest possible value from hx711
+            metrics.hx711_invalid_reads.inc()
             if self._debug_mode:
                 print('Invalid data detected: {}\n'.format(data_in))
             return False
@@ -182,6 +207,7 @@ class HX711(object):
 
         if self._debug_mode:
             print('Converted 2\'s complement value: {}\n'.format(signed_data))
+        metrics.hx711_samples.inc()
         return signed_data
 
     def power_down(self):
@@ -207,23 +233,74 @@ class HX711(object):
 
 class WeightModule(object):
     dummy = False
+    settling_reads = 4  # conversions dropped after a power up, 400 ms at 10 SPS
 
     def __init__(self):
         self.cell = None
         self.offset = 0
         self.ratio = 1
-
-    def init_from_settings_and_config(self, settings, config):
-        """Pass settings and config since this file works without Django"""
+        self.quadratic = 0
+        self.stream = None  # shared memory copy of the samples, see hardware.weightstream
+        self.trace = None  # recorder of the current order, see hardware.trace
+        self.telemetry = None  # long-term history, see hardware.timeseries
+        self.abnormal_log = Throttle(1.)  # a loose cable gives abnormal weights at every read
+        self.lock = threading.RLock()  # the serving thread and the sampler share the cell
+        self.powered_down = False
+        self.on_power_up = None  # called when the chip is powered up again, see hardware.sampler
+        self.last_measure = time.monotonic()  # of make_constant_weight_measure, the sampler idles after it
+
+    def init_from_settings_and_config(self, settings, config, station=0, stream=False):
+        """
+        Pass settings and config since this file works without Django. The pins are those of settings.STATIONS[station].
+        With stream, the samples are written to the weight stream of the station, only the artist does.
+        """
+        pins = settings.STATIONS[station]
         self.cell = HX711(
-            settings.GPIO_DT,
-            settings.GPIO_SCK,
+            pins['dt'],
+            pins['sck'],
             gain=config.weight_cell_gain,
             channel=config.weight_cell_channel
         )
         self.queue = deque(maxlen=config.weight_module_queue_length)
         self.offset = config.weight_cell_offset
         self.ratio = config.weight_cell_ratio
+        self.quadratic = config.weight_cell_quadratic
+        if stream and self.stream is None and settings.WEIGHT_STREAM_PATH:
+            self.stream = open_writer(station_path(settings.WEIGHT_STREAM_PATH, station), settings.WEIGHT_STREAM_SLOTS)
+
+    def update_from_config(self, config):
+        """Apply calibration and filter length in place, without touching the HX711"""
+        if self.queue.maxlen != config.weight_module_queue_length:
+            self.queue = deque(self.queue, maxlen=config.weight_module_queue_length)
+        self.offset = config.weight_cell_offset
+        self.ratio = config.weight_cell_ratio
+        self.quadratic = config.weight_cell_quadratic
+
+    def set_channel_gain(self, channel, gain):
+        with self.lock:
+            self.cell.set_channel_gain(channel, gain)
+            self.queue.clear()  # samples from the previous channel or gain are garbage
+
+    def power_down(self):
+        with self.lock:
+            if not self.powered_down:
+                self.cell.power_down()
+                self.powered_down = True
+
+    def power_up(self):
+        """Only if powered down, then drops the conversions made while the chip settles"""
+        with self.lock:
+            if not self.powered_down:
+                return True
+            self.powered_down = False
+            self.queue.clear()
+            if self.on_power_up is not None:
+                self.on_power_up()
+            if not self.cell.power_up():
+                return False
+            for _ in range(self.settling_reads):
+                self.cell._read()
+            return True
 
     def interactive_settings(self):
         gpio_dt = int(input("Enter GPIO DT : "))
@@ -262,32 +339,64 @@ class WeightModule(object):
     def get_value(self):
         if self.cell is None:
             return None
-        value = self.cell._read()
-        if value is False:
-            return None
-        self.queue.append(value)
-        if self.queue:
-            return median(self.queue)
-        else:
-            return None
+        with self.lock:
+            value = self.cell._read()
+            if self.trace is not None:
+                self.trace.sample(None if value is False else value)
+            if value is False:
+                if self.stream is not None:
+                    self.stream.write()
+                return None
+            self.queue.append(value)
+            filtered = median(self.queue)
+            if self.stream is not None or self.telemetry is not None:
+                grams = self.to_grams(filtered)
+                if self.stream is not None:
+                    self.stream.write(raw=value, grams=grams)
+                if self.telemetry is not None:
+                    self.telemetry.weight(grams)
+            return filtered
+
+    def to_grams(self, value):
+        """a*(x-b) + c*(x-b)**2, c is 0 unless calibrated with a quadratic term"""
+        tared = value - self.offset
+        return self.ratio * tared + self.quadratic * tared * tared
+
+    def track_zero(self, tracking_range, max_spread=1., alpha=0.1):
+        """
+        Call while the scale should be empty: if the filtered weight is steady and within
+        tracking_range [g] of zero, move the offset toward it to follow the zero drift.
+        """
+        with self.lock:
+            if not tracking_range or len(self.queue) < self.queue.maxlen:
+                return False
+            if abs(self.to_grams(max(self.queue)) - self.to_grams(min(self.queue))) > max_spread:
+                return False  # moving
+            zero = median(self.queue)
+            if abs(self.to_grams(zero)) > tracking_range:
+                return False  # something is on the scale
+            self.offset += alpha * (zero - self.offset)
+            return True
 
     def convert_value_to_weight(self, value):
         """Linear a*(x-b). Note parenthesis"""
         if value is None:
             return None
         else:
-            weight = self.ratio * (value - self.offset)
+            weight = self.to_grams(value)
             if -settings.MAX_MEASURABLE_WEIGHT < weight < settings.MAX_MEASURABLE_WEIGHT:
-                #logger.debug('Accepted weight %s' % weight)
+                #logger.debug('Accepted weight %s', weight)
                 return weight
             else:
-                logger.debug('Abnormal weight %s grams' % weight)
+                if self.abnormal_log.ready():
+                    logger.debug('Abnormal weight %s grams', weight)
                 return None
 
     def make_constant_weight_measure(self, clear=True, max_try=0):
+        self.last_measure = time.monotonic()
         if clear:
             self.queue.clear()
-            self.cell.power_up()
+            self.power_up()  # no power cycle, the chip stays on between two measures
             for _ in range(max(2, self.queue.maxlen - 1)):
                 value = self.get_value()
         weight = None
@@ -303,3 +412,90 @@ class WeightModule(object):
     def close(self):
         if self.cell is not None:
             self.cell.cleanup()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+
+
+class ChannelStream(object):
+    """Filtered weight of one channel of an InterleavedReader, with its own calibration"""
+
+    def __init__(self, channel, gain, queue_length=5, offset=0, ratio=1, quadratic=0):
+        self.channel = channel
+        self.gain = gain
+        self.queue = deque(maxlen=queue_length)
+        self.offset = offset
+        self.ratio = ratio
+        self.quadratic = quadratic
+        self.samples = 0  # conversions kept
+
+    def add(self, value):
+        self.queue.append(value)
+        self.samples += 1
+
+    @property
+    def filtered(self):
+        return median(self.queue) if self.queue else None
+
+    def to_grams(self, value):
+        tared = value - self.offset
+        return self.ratio * tared + self.quadratic * tared * tared
+
+    @property
+    def weight(self):
+        filtered = self.filtered
+        return None if filtered is None else self.to_grams(filtered)
+
+
+class InterleavedReader(object):
+    """
+    Reads the channels of one HX711 in turns, block conversions each, to weigh two scales
+    (channel A and channel B) with a single chip.
+
+    The pulses after each read select the channel of the next conversion, so switching costs
+    no sleep. The first discard conversions after a switch are dropped, the chip is settling.
+    After a failed read the channel of the next conversion is unknown, it is dropped as well.
+    Share the WeightModule lock when the cell is also read elsewhere.
+    """
+    def __init__(self, cell, streams, block=4, discard=1, lock=None):
+        if block <= discard:
+            raise ValueError('block must be larger than discard, %i <= %i' % (block, discard))
+        self.cell = cell
+        self.streams = streams
+        self.block = block
+        self.discard = discard
+        self.lock = lock or threading.RLock()
+        self.dropped = 0
+        self._index = 0  # stream of the conversion being read
+        self._reads = 0  # in the current block
+        self._drop = 1 + discard  # the chip may be on any channel
+
+    def read(self):
+        """One conversion, returns the stream it went to, None if it was dropped or failed"""
+        with self.lock:
+            stream = self.streams[self._index]
+            self._reads += 1
+            if self._reads >= self.block:
+                self._index = (self._index + 1) % len(self.streams)
+                self._reads = 0
+            following = self.streams[self._index]
+            drop = self._drop > 0
+            self._drop = max(0, self._drop - 1)
+            value = self.cell.read_and_select(following.channel, following.gain)
+            if value is False:
+                self._drop = 1 + self.discard
+                return None
+            if following is not stream:
+                self._drop = max(self._drop, self.discard)
+            if drop:
+                self.dropped += 1
+                return None
+            stream.add(value)
+            return stream
+
+    def follow(self):
+        """Yields (stream, grams) for each conversion kept"""
+        while True:
+            stream = self.read()
+            if stream is not None:
+                yield stream, stream.weight
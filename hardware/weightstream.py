@@ -0,0 +1,156 @@
+"""
+Weight samples in a memory-mapped ring buffer, readable by any local process.
+
+The file starts with a header (magic, number of slots, sequence of the next sample) followed by
+fixed size slots. There is a single writer and it never locks: it invalidates the slot, writes the
+sample, then stamps the slot with its sequence and publishes the new header sequence.
+The writer holds an exclusive flock on the file while it is open, so a second writer, such as a
+WeightModule of another process, fails instead of truncating the samples under the readers.
+Readers check the slot sequence before and after reading to detect a sample being overwritten.
+"""
+import fcntl
+import math
+import mmap
+import os
+import time
+from collections import namedtuple
+from struct import Struct
+
+from django.utils.log import logging
+
+logger = logging.getLogger('autobar')
+
+MAGIC = b'ABWEIGHT'
+HEADER = Struct('<8sIxxxxQ')  # magic, slots, next sequence
+SEQUENCE = Struct('<Q')  # first field of a slot, written separately
+PAYLOAD = Struct('<dqdI4x')  # timestamp, raw count, filtered grams, flags
+SLOT_SIZE = SEQUENCE.size + PAYLOAD.size
+INVALID_SEQUENCE = 0xffffffffffffffff
+
+FLAG_RAW = 1  # the HX711 read was valid
+FLAG_WEIGHT = 2  # the filtered weight is valid
+
+WeightSample = namedtuple('WeightSample', ('sequence', 'timestamp', 'raw', 'grams', 'flags'))
+
+
+def _slot_offset(index):
+    return HEADER.size + index * SLOT_SIZE
+
+
+class WeightStreamWriter:
+    def __init__(self, path, slots=4096):
+        self.path = path
+        self.slots = slots
+        size = _slot_offset(slots)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)  # released when the fd is closed
+            except BlockingIOError:
+                raise OSError('another process writes %s' % path)
+            os.ftruncate(self._fd, 0)  # only now, the previous samples belong to no running writer
+            os.ftruncate(self._fd, size)
+            self._map = mmap.mmap(self._fd, size)
+        except BaseException:
+            os.close(self._fd)
+            raise
+        self.sequence = 0
+        HEADER.pack_into(self._map, 0, MAGIC, slots, 0)
+
+    def write(self, raw=None, grams=None, timestamp=None):
+        flags = (FLAG_RAW if raw is not None else 0) | (FLAG_WEIGHT if grams is not None else 0)
+        offset = _slot_offset(self.sequence % self.slots)
+        SEQUENCE.pack_into(self._map, offset, INVALID_SEQUENCE)
+        PAYLOAD.pack_into(
+            self._map, offset + SEQUENCE.size,
+            time.time() if timestamp is None else timestamp,
+            int(raw) if raw is not None else 0,
+            grams if grams is not None else math.nan,
+            flags)
+        SEQUENCE.pack_into(self._map, offset, self.sequence)
+        self.sequence += 1
+        HEADER.pack_into(self._map, 0, MAGIC, self.slots, self.sequence)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class WeightStreamReader:
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.slots, _ = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a weight stream' % path)
+
+    @property
+    def sequence(self):
+        """Sequence of the next sample to be written"""
+        return HEADER.unpack_from(self._map, 0)[2]
+
+    def read(self, sequence):
+        """The sample with this sequence, or None if it was overwritten or not written yet"""
+        offset = _slot_offset(sequence % self.slots)
+        if SEQUENCE.unpack_from(self._map, offset)[0] != sequence:
+            return None
+        payload = PAYLOAD.unpack_from(self._map, offset + SEQUENCE.size)
+        if SEQUENCE.unpack_from(self._map, offset)[0] != sequence:
+            return None  # overwritten while we were reading
+        return WeightSample(sequence, *payload)
+
+    def since(self, sequence):
+        """Samples from sequence on, and the sequence to ask for next time"""
+        end = self.sequence
+        if sequence > end:
+            sequence = 0  # the writer restarted
+        start = max(sequence, end - self.slots, 0)
+        samples = [sample for sample in map(self.read, range(start, end)) if sample is not None]
+        return samples, end
+
+    def latest(self, n):
+        return self.since(self.sequence - n)[0]
+
+    def follow(self, period=0.01):
+        """Yields samples as they are written"""
+        sequence = self.sequence
+        while True:
+            samples, sequence = self.since(sequence)
+            yield from samples
+            if not samples:
+                time.sleep(period)
+
+    def close(self):
+        self._map.close()
+
+
+def station_path(path, station):
+    """Stream of the scale of a serving station, settings.WEIGHT_STREAM_PATH for the first one"""
+    return path if not station else '%s-%i' % (path, station)
+
+
+def writer_running(path):
+    """A process, such as the artist, holds the writer of the stream at path"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+    return False
+
+
+def open_writer(path, slots):
+    """Writer for the WeightModule, None if the stream cannot be created"""
+    if not path:
+        return None
+    try:
+        return WeightStreamWriter(path, slots)
+    except OSError as e:
+        logger.warning('No weight stream at %s: %s', path, e)
+        return None
@@ -119,8 +119,11 @@ class MixAdmin(admin.ModelAdmin):
 class DispenserAdmin(admin.ModelAdmin):
     list_display = (
         'number',
+        'station',
         'ingredient',
         'is_empty',
+        'pwm_ramp_weight',
+        'pwm_min_speed',
         'updated_at',
     )
     ordering = ('number',)
@@ -133,6 +136,7 @@ class OrderAdmin(admin.ModelAdmin):
         'updated_at',
         'status',
         'accepted',
+        'station',
         'mix',
     )
     list_filter = (
@@ -0,0 +1,118 @@
+"""
+Catalog records: mixes with their doses and ingredients as plain dicts, keyed by name since
+ids differ between databases. Used to push the catalog of a fleet coordinator to its bars.
+"""
+import hashlib
+import json
+
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import Dose, Ingredient, Mix
+
+MIX_FIELDS = ('description', 'verified')  # likes and count are local to each bar
+INGREDIENT_FIELDS = ('alcohol_percentage', 'density', 'added_separately')
+BATCH_SIZE = 500  # rows per bulk query
+
+
+def ingredient_record(ingredient):
+    return {field: getattr(ingredient, field) for field in INGREDIENT_FIELDS}
+
+
+def mix_records(mixes=None):
+    """name -> record of every mix of the queryset mixes (all by default), with two queries"""
+    mixes = mixes if mixes is not None else Mix.objects.all()
+    records = {
+        name: {'name': name, 'description': description, 'verified': verified, 'doses': []}
+        for name, description, verified in mixes.values_list('name', *MIX_FIELDS)
+    }
+    doses = Dose.objects.filter(mix__in=mixes).select_related('mix', 'ingredient').order_by('mix_id', 'number')
+    for dose in doses:
+        records[dose.mix.name]['doses'].append({
+            'number': dose.number,
+            'quantity': dose.quantity,
+            'ingredient': dose.ingredient.name,
+            'added_separately': dose.ingredient.added_separately,
+        })
+    return records
+
+
+def digest(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+
+def real_ingredients(record):
+    """Names of the ingredients of a mix record a dispenser must provide"""
+    return {dose['ingredient'] for dose in record['doses'] if not dose['added_separately']}
+
+
+@transaction.atomic
+def apply_records(mixes, ingredients, deleted=(), images=None):
+    """
+    Create or update mixes (records) and their ingredients (name -> record) by name, in bulk.
+    Rows already up to date are not written, the doses of a mix are replaced when they differ.
+    Mixes named in deleted are removed. images maps a mix name to the (name, width, height) of
+    its image file, already in the storage. Bypasses Mix.save, which saves every dose again.
+    Returns the number of mixes created and updated.
+    """
+    now = timezone.now()
+    existing = {ingredient.name: ingredient for ingredient in Ingredient.objects.filter(name__in=list(ingredients))}
+    Ingredient.objects.bulk_create([
+        Ingredient(name=name, **record) for name, record in ingredients.items() if name not in existing])
+    changed = []
+    for name, record in ingredients.items():
+        ingredient = existing.get(name)
+        if ingredient is not None and ingredient_record(ingredient) != record:
+            for field, value in record.items():
+                setattr(ingredient, field, value)
+            ingredient.updated_at = now
+            changed.append(ingredient)
+    Ingredient.objects.bulk_update(changed, INGREDIENT_FIELDS + ('updated_at',), batch_size=BATCH_SIZE)
+
+    names = [record['name'] for record in mixes]
+    current = mix_records(Mix.objects.filter(name__in=names))
+    existing = {mix.name: mix for mix in Mix.objects.filter(name__in=names).only('name', *MIX_FIELDS)}
+    Mix.objects.bulk_create([
+        Mix(name=record['name'], **{field: record[field] for field in MIX_FIELDS})
+        for record in mixes if record['name'] not in existing
+    ])
+    images = images or {}
+    # raw values, a Mix instance fills its missing image dimensions from the file when loaded
+    current_images = {
+        name: (image or None, width, height) for name, image, width, height in
+        Mix.objects.filter(name__in=list(images)).values_list('name', 'image', 'image_width', 'image_height')
+    }
+    changed = []
+    for record in mixes:
+        mix = existing.get(record['name'])
+        if mix is None:
+            continue
+        differs = any(getattr(mix, field) != record[field] for field in MIX_FIELDS)
+        if differs or current[record['name']]['doses'] != record['doses'] or (
+                record['name'] in images and current_images[record['name']] != images[record['name']]):
+            for field in MIX_FIELDS:
+                setattr(mix, field, record[field])
+            mix.updated_at = now
+            changed.append(mix)
+    Mix.objects.bulk_update(changed, MIX_FIELDS + ('updated_at',), batch_size=BATCH_SIZE)
+    for name, (image, width, height) in images.items():
+        if current_images.get(name) != (image, width, height):  # rare, one query each
+            Mix.objects.filter(name=name).update(image=image, image_width=width, image_height=height)
+
+    redo = [record for record in mixes if current.get(record['name'], {}).get('doses') != record['doses']]
+    if redo:
+        mix_ids = dict(Mix.objects.filter(name__in=[record['name'] for record in redo]).values_list('name', 'id'))
+        ingredient_ids = dict(Ingredient.objects.filter(
+            name__in=list({dose['ingredient'] for record in redo for dose in record['doses']})).values_list('name', 'id'))
+        Dose.objects.filter(mix_id__in=list(mix_ids.values())).delete()
+        Dose.objects.bulk_create([
+            Dose(
+                mix_id=mix_ids[record['name']],
+                ingredient_id=ingredient_ids[dose['ingredient']],
+                number=dose['number'],
+                quantity=dose['quantity'])
+            for record in redo for dose in record['doses']
+        ], batch_size=BATCH_SIZE)
+    if deleted:
+        Mix.objects.filter(name__in=list(deleted)).delete()
+    return {'created': len(mixes) - len(existing), 'updated': len(changed)}
@@ -0,0 +1,362 @@
+"""
+Fleet mode: several bars sharing a catalog and the guests orders.
+
+The coordinator (runcoordinator command) holds the catalog in its own database. Each bar runs
+a node agent (runnode command) which reports its dispensers and queue depth every
+settings.FLEET_HEARTBEAT and pulls the catalog changes since its version. Orders posted to the
+coordinator go to the bar that can make the mix with the shortest estimated wait, the bar
+accepts them on its fleet/order endpoint like an order of its own kiosk.
+
+Everything is JSON over HTTP, with the shared settings.FLEET_TOKEN: requests without it are
+refused, by the coordinator and by the bars. Without settings.FLEET_COORDINATOR a bar works on its own.
+"""
+import hmac
+import json
+import math
+import socket
+import statistics
+import threading
+import time
+import urllib.request
+import uuid
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+from django.utils.log import logging
+
+from recipes import catalog
+from recipes.models import Dispenser, Ingredient, Order
+
+logger = logging.getLogger('autobar')
+
+TOKEN_HEADER = 'X-Fleet-Token'
+
+
+class FleetUnavailable(Exception):
+    pass
+
+
+def node_name():
+    return getattr(settings, 'FLEET_NODE_NAME', None) or socket.gethostname()
+
+
+def request(url, payload=None, timeout=5):
+    """GET, or POST of payload as JSON, returns the decoded JSON response"""
+    data = json.dumps(payload).encode() if payload is not None else None
+    headers = {'Content-Type': 'application/json'}
+    if getattr(settings, 'FLEET_TOKEN', None):
+        headers[TOKEN_HEADER] = settings.FLEET_TOKEN
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=timeout) as response:
+            return json.loads(response.read().decode())
+    except (OSError, ValueError) as e:  # URLError and HTTPError are OSError
+        raise FleetUnavailable('%s: %s' % (url, e))
+
+
+def authorized(headers):
+    """The request has the fleet token, always False while settings.FLEET_TOKEN is not set"""
+    token = getattr(settings, 'FLEET_TOKEN', None)
+    return bool(token) and hmac.compare_digest(headers.get(TOKEN_HEADER, '').encode(), token.encode())
+
+
+class Catalog:
+    """
+    Versioned catalog of the coordinator database. Each refresh compares the digest of every
+    mix and ingredient with the previous one, any change makes a new version. A changed
+    ingredient (density, alcohol...) counts as a change of every mix using it. Versions are only comparable
+    within an epoch, a node of another epoch (the coordinator restarted) gets everything.
+    """
+    def __init__(self, min_refresh_period=1.):
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.min_refresh_period = min_refresh_period  # [s]
+        self.records = {}  # mix name -> record
+        self.ingredients = {}  # ingredient name -> record
+        self.needs = {}  # mix name -> names of the ingredients a dispenser must provide
+        self._digests = {}
+        self._ingredient_digests = {}
+        self._changed = {}  # mix name -> version of its last change, deleted mixes included
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._refreshed_at is not None and now - self._refreshed_at < self.min_refresh_period:
+                return self.version
+            self._refreshed_at = now
+            records = catalog.mix_records()
+            ingredients = {ingredient.name: catalog.ingredient_record(ingredient) for ingredient in Ingredient.objects.all()}
+            digests = {name: catalog.digest(record) for name, record in records.items()}
+            ingredient_digests = {name: catalog.digest(record) for name, record in ingredients.items()}
+            changed_ingredients = {
+                name for name, value in ingredient_digests.items() if self._ingredient_digests.get(name) != value}
+            changed = [
+                name for name, value in digests.items()
+                if self._digests.get(name) != value
+                or any(dose['ingredient'] in changed_ingredients for dose in records[name]['doses'])]
+            deleted = [name for name in self._digests if name not in digests]
+            if changed or deleted or changed_ingredients or not self.version:
+                self.version += 1
+                for name in changed + deleted:
+                    self._changed[name] = self.version
+            self.records = records
+            self.ingredients = ingredients
+            self.needs = {name: catalog.real_ingredients(record) for name, record in records.items()}
+            self._digests = digests
+            self._ingredient_digests = ingredient_digests
+            return self.version
+
+    def delta(self, epoch, since):
+        """Mixes changed after version since, their ingredients and the mixes deleted since"""
+        self.refresh()
+        with self._lock:
+            if epoch != self.epoch or since > self.version:
+                since = 0
+            names = [name for name, version in self._changed.items() if version > since]
+            mixes = [self.records[name] for name in names if name in self.records]
+            ingredients = {dose['ingredient'] for record in mixes for dose in record['doses']}
+            return {
+                'epoch': self.epoch,
+                'version': self.version,
+                'mixes': mixes,
+                'ingredients': {name: self.ingredients[name] for name in ingredients},
+                'deleted': [name for name in names if name not in self.records],
+            }
+
+
+class Node:
+    """What the coordinator knows of a bar, from its last heartbeat"""
+
+    def __init__(self, name):
+        self.name = name
+        self.url = None
+        self.seen_at = None
+        self.stations = 1
+        self.queue_depth = 0
+        self.serve_time = settings.FLEET_DEFAULT_SERVE_TIME  # [s] per order
+        self.ingredients = []  # per station, names available in its dispensers
+        self.catalog = None  # (epoch, version) applied
+
+    def update(self, heartbeat):
+        self.url = heartbeat['url']
+        self.seen_at = time.monotonic()
+        self.stations = max(1, heartbeat['stations'])
+        self.queue_depth = heartbeat['queue_depth']
+        self.serve_time = heartbeat['serve_time']
+        self.catalog = (heartbeat['catalog_epoch'], heartbeat['catalog_version'])
+        ingredients = [set() for _ in range(self.stations)]
+        for dispenser in heartbeat['dispensers']:
+            if dispenser['ingredient'] and not dispenser['is_empty'] and dispenser['station'] < self.stations:
+                ingredients[dispenser['station']].add(dispenser['ingredient'])
+        self.ingredients = ingredients
+
+    @property
+    def alive(self):
+        return self.seen_at is not None and time.monotonic() - self.seen_at < settings.FLEET_NODE_TIMEOUT
+
+    def can_make(self, needs):
+        return any(needs <= available for available in self.ingredients)
+
+    def eta(self):
+        """[s] until a new order is served, the orders ahead are shared between the stations"""
+        ahead = max(0, self.queue_depth + 1 - self.stations)
+        return self.serve_time * (1 + math.ceil(ahead / self.stations))
+
+    def status(self):
+        return {
+            'name': self.name,
+            'url': self.url,
+            'alive': self.alive,
+            'stations': self.stations,
+            'queue_depth': self.queue_depth,
+            'serve_time': self.serve_time,
+            'eta': self.eta(),
+            'catalog': self.catalog,
+        }
+
+
+class Coordinator:
+    def __init__(self):
+        self.catalog = Catalog()
+        self.nodes = {}
+        self._lock = threading.Lock()  # the nodes
+
+    def heartbeat(self, heartbeat):
+        with self._lock:
+            node = self.nodes.get(heartbeat['name'])
+            if node is None:
+                logger.info('Node %s joined the fleet at %s', heartbeat['name'], heartbeat['url'])
+                node = self.nodes[heartbeat['name']] = Node(heartbeat['name'])
+            node.update(heartbeat)
+        return {'catalog_epoch': self.catalog.epoch, 'catalog_version': self.catalog.refresh()}
+
+    def route(self, mix_name):
+        """Sends the order to the bar with the shortest wait, returns the node answer and its name"""
+        self.catalog.refresh()
+        needs = self.catalog.needs.get(mix_name)
+        if needs is None:
+            return {'accepted': False, 'error': 'Unknown mix %s' % mix_name}
+        with self._lock:
+            candidates = sorted(
+                (node for node in self.nodes.values() if node.alive and node.can_make(needs)),
+                key=lambda node: node.eta())
+        for node in candidates:
+            try:
+                answer = request(node.url.rstrip('/') + '/fleet/order', {'mix': mix_name})
+            except FleetUnavailable as e:
+                logger.warning('Node %s did not take the order, %s', node.name, e)
+                continue
+            if answer.get('accepted'):
+                with self._lock:
+                    node.queue_depth += 1  # until its next heartbeat
+                logger.info('%s routed to %s, eta %.0fs', mix_name, node.name, node.eta())
+                return dict(answer, node=node.name)
+        return {'accepted': False, 'error': 'No bar can make %s now' % mix_name}
+
+    def status(self):
+        with self._lock:
+            nodes = [node.status() for node in self.nodes.values()]
+        return {'catalog_epoch': self.catalog.epoch, 'catalog_version': self.catalog.version, 'nodes': nodes}
+
+
+class CoordinatorHandler(BaseHTTPRequestHandler):
+    """
+    POST /heartbeat  node state, answers the catalog version
+    GET  /catalog?epoch=&since=  catalog delta
+    POST /order  {"mix": name}, answers the node, its order id and if it was accepted
+    GET  /nodes  fleet status
+    """
+    def _respond(self, code, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _dispatch(self, method):
+        if not authorized(self.headers):
+            return self._respond(403, {'error': 'Bad fleet token'})
+        url = urlsplit(self.path)
+        coordinator = self.server.coordinator
+        try:
+            if method == 'POST':
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+            if (method, url.path) == ('POST', '/heartbeat'):
+                return self._respond(200, coordinator.heartbeat(payload))
+            if (method, url.path) == ('POST', '/order'):
+                return self._respond(200, coordinator.route(payload['mix']))
+            if (method, url.path) == ('GET', '/catalog'):
+                query = parse_qs(url.query)
+                return self._respond(200, coordinator.catalog.delta(
+                    query.get('epoch', [''])[0], int(query.get('since', ['0'])[0])))
+            if (method, url.path) == ('GET', '/nodes'):
+                return self._respond(200, coordinator.status())
+            return self._respond(404, {'error': 'Unknown path %s' % url.path})
+        except (KeyError, ValueError) as e:
+            return self._respond(400, {'error': '%s: %s' % (e.__class__.__name__, e)})
+        finally:
+            close_old_connections()
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass  # a heartbeat every FLEET_HEARTBEAT from each node, errors are in the answers
+
+
+def serve(address):
+    """Run the coordinator, blocks until interrupted"""
+    server = ThreadingHTTPServer(address, CoordinatorHandler)
+    server.daemon_threads = True
+    server.coordinator = Coordinator()
+    logger.info('Fleet coordinator listening on %s:%s', *address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+def local_state(catalog_epoch, catalog_version):
+    """Heartbeat of this bar, from its database"""
+    since = timezone.now() - timedelta(hours=1)  # older unfinished orders were lost, the bar restarted meanwhile
+    finished = Order.objects.filter(status=3).order_by('-updated_at').values_list('created_at', 'updated_at')[:20]
+    durations = [(updated - created).total_seconds() for created, updated in finished]
+    return {
+        'name': node_name(),
+        'url': settings.FLEET_NODE_URL,
+        'stations': len(settings.STATIONS),
+        'dispensers': [
+            {'number': number, 'station': station, 'ingredient': ingredient, 'is_empty': is_empty}
+            for number, station, ingredient, is_empty
+            in Dispenser.objects.values_list('number', 'station', 'ingredient__name', 'is_empty')
+        ],
+        'queue_depth': Order.objects.filter(
+            accepted=True, status__in=(0, 1, 2), created_at__gte=since).count(),
+        'serve_time': statistics.median(durations) if durations else settings.FLEET_DEFAULT_SERVE_TIME,
+        'catalog_epoch': catalog_epoch,
+        'catalog_version': catalog_version,
+    }
+
+
+class NodeAgent(threading.Thread):
+    """Heartbeats of a bar to the coordinator, and the catalog pulls"""
+
+    def __init__(self, coordinator_url):
+        super().__init__(daemon=True)
+        self.coordinator_url = coordinator_url.rstrip('/')
+        self.catalog_epoch = ''
+        self.catalog_version = 0
+        self._exit = threading.Event()
+
+    def stop(self):
+        self._exit.set()
+
+    def step(self):
+        answer = request(self.coordinator_url + '/heartbeat', local_state(self.catalog_epoch, self.catalog_version))
+        if (answer['catalog_epoch'], answer['catalog_version']) != (self.catalog_epoch, self.catalog_version):
+            self.pull()
+
+    def pull(self):
+        delta = request('%s/catalog?epoch=%s&since=%i' % (self.coordinator_url, self.catalog_epoch, self.catalog_version), timeout=60)
+        catalog.apply_records(delta['mixes'], delta['ingredients'], delta['deleted'])
+        logger.info(
+            'Catalog version %s applied, %i mixes changed and %i deleted',
+            delta['version'], len(delta['mixes']), len(delta['deleted']))
+        self.catalog_epoch, self.catalog_version = delta['epoch'], delta['version']
+
+    def run(self):
+        while not self._exit.is_set():
+            try:
+                self.step()
+            except FleetUnavailable as e:
+                logger.warning('Fleet coordinator unavailable, %s', e)
+            except Exception:
+                logger.exception('Fleet node failed')
+            finally:
+                close_old_connections()
+            self._exit.wait(settings.FLEET_HEARTBEAT)
+
+
+def route_order(mix):
+    """
+    Asks the coordinator where to serve mix, the answer of the bar it chose with its node name.
+    None if it cannot be reached or no bar took the order, such as a mix not in its catalog yet.
+    """
+    try:
+        answer = request(settings.FLEET_COORDINATOR.rstrip('/') + '/order', {'mix': mix.name}, timeout=10)
+    except FleetUnavailable as e:
+        logger.error('Fleet coordinator unavailable, serving here, %s', e)
+        return None
+    if not answer.get('accepted') or not answer.get('node'):
+        logger.info('Fleet coordinator did not route %s, serving here, %s', mix, answer.get('error'))
+        return None
+    return answer
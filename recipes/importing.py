@@ -0,0 +1,271 @@
+"""
+Bulk import of drinks in the format of thecocktaildb lookups: strDrink, strInstructions,
+strDrinkThumb and strIngredientN with strMeasureN for N from 1 to 15. iter_drinks() reads them
+from a dump file one at a time, so memory does not grow with the size of the dump.
+
+Drinks are validated and normalised in memory, then each batch is written in one transaction:
+the new ingredients, the mixes and their doses with bulk_create, a few queries per batch instead
+of a few per dose and one commit instead of one per row. Mix.save is bypassed, the doses of the
+ingredients added separately get their zero quantity here. Images are attached afterwards, once
+downloaded, to the mixes created or still without one.
+"""
+import gzip
+import json
+
+from django.core.files.base import ContentFile
+from django.core.files.images import get_image_dimensions
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils.log import logging
+
+from recipes.matching import BKTree
+from recipes.measures import GLASS_BASE, get_clean_measure
+from recipes.models import Dose, Ingredient, Mix, mix_upload_to
+
+logger = logging.getLogger('autobar')
+
+INGREDIENT_KEYS = [(number, 'strIngredient%i' % number, 'strMeasure%i' % number) for number in range(1, 16)]
+NAME_LENGTH = Mix._meta.get_field('name').max_length
+
+
+class InvalidDrink(Exception):
+    pass
+
+
+def skip_to_array(stream, chunk_size):
+    """Reads the stream up to its first [ out of a JSON string, returns what follows in the chunk"""
+    in_string = escaped = False
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            raise ValueError('No JSON array')
+        for index, char in enumerate(chunk):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == '[':
+                return chunk[index + 1:]
+
+
+def iter_json_array(stream, chunk_size=1 << 16, max_item_size=1 << 20):
+    """
+    Items of the first JSON array of a text stream, such as {"drinks": [...]} or [...], decoded
+    one at a time while the stream is read by chunks. Raises ValueError on malformed JSON, or
+    for an item longer than max_item_size characters, so a broken dump is not read whole.
+    """
+    decoder = json.JSONDecoder()
+    buffer = skip_to_array(stream, chunk_size)
+    end_of_stream = False
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError as e:
+            # an item cut by the end of the buffer fails there, in a string or in a true, false or null
+            cut = len(buffer) - e.pos <= len('false') or e.msg.startswith('Unterminated string')
+            if end_of_stream or not cut:
+                raise
+            if len(buffer) > max_item_size:
+                raise ValueError('JSON item longer than %i characters at: %.100s' % (max_item_size, buffer))
+            chunk = stream.read(chunk_size)
+            end_of_stream = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def iter_json_lines(stream):
+    """Items of a JSON-lines stream, a line may also be a lookup response {"drinks": [...]}"""
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as e:
+            raise ValueError('Line %i: %s' % (number, e))
+        if isinstance(item, dict) and isinstance(item.get('drinks'), list):
+            yield from item['drinks']
+        else:
+            yield item
+
+
+def iter_drinks(path, format=None):
+    """
+    Drinks of a dump file, a lookup response {"drinks": [...]} or a JSON array (format 'json'),
+    or one drink or lookup response per line (format 'jsonl'). The format follows the file
+    extension by default, .gz files are decompressed.
+    """
+    name = path[:-len('.gz')] if path.endswith('.gz') else path
+    if format is None:
+        format = 'jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'json'
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as stream:
+        yield from (iter_json_lines(stream) if format == 'jsonl' else iter_json_array(stream))
+
+
+def normalise(drink, review=None):
+    """
+    Record {id, name, description, image_url, doses: [(number, ingredient name, quantity)]} of a
+    lookup drink, raises InvalidDrink. Doses without a measure are left out, as garnishes.
+    """
+    if not isinstance(drink, dict):
+        raise InvalidDrink('Not a drink: %.50r' % (drink,))
+    name = (drink.get('strDrink') or '').strip()
+    if not name:
+        raise InvalidDrink('No name')
+    if len(name) > NAME_LENGTH:
+        raise InvalidDrink('Name longer than %i characters: %s' % (NAME_LENGTH, name))
+    doses = []
+    for number, ingredient_key, measure_key in INGREDIENT_KEYS:
+        ingredient = (drink.get(ingredient_key) or '').strip()
+        measure = (drink.get(measure_key) or '').strip()
+        if not ingredient or not measure:
+            continue
+        if len(ingredient) > NAME_LENGTH:
+            raise InvalidDrink('Ingredient name longer than %i characters: %s' % (NAME_LENGTH, ingredient))
+        quantity = max(get_clean_measure(measure, ingredient) or 0, 0)
+        if quantity > GLASS_BASE and review is not None:
+            review.write('measure', mix=name, drink=drink.get('idDrink'), ingredient=ingredient, measure=measure, quantity=quantity)
+        doses.append((number, ingredient, quantity))
+    return {
+        'id': drink.get('idDrink'),
+        'name': name,
+        'description': (drink.get('strInstructions') or '').strip(),
+        'image_url': drink.get('strDrinkThumb') or None,
+        'doses': doses,
+    }
+
+
+class IngredientResolver:
+    """
+    Ingredient of an imported name without asking: the one with the same name ignoring case, else
+    the closest one within max_distance edits and less than half the name, else a new one.
+    The last two go to the review file, once per name. The names are indexed once, with the ones
+    created, and each name is looked up once.
+    """
+    def __init__(self, review, max_distance=2):
+        self.review = review
+        self.max_distance = max_distance
+        self.ids = dict(Ingredient.objects.values_list('name', 'id'))
+        self.added_separately = set(Ingredient.objects.filter(added_separately=True).values_list('name', flat=True))
+        self.index = BKTree(self.ids)
+        self.new = []  # names resolved to an ingredient to create
+        self.resolved = {}  # imported name -> name of the ingredient
+
+    def resolve(self, name, mix_name):
+        """Name of the ingredient to use for name"""
+        resolved = self.resolved.get(name)
+        if resolved is None:
+            resolved = self.resolved[name] = self._resolve(name, mix_name)
+        return resolved
+
+    def _resolve(self, name, mix_name):
+        found = self.index.closest(name, 1, self.max_distance)
+        if found:
+            closest_distance, closest = found[0]
+            if not closest_distance:
+                return closest
+            if 2 * closest_distance < len(name):
+                self.review.write('matched', mix=mix_name, ingredient=name, chosen=closest, distance=closest_distance)
+                return closest
+        found = self.index.closest(name)
+        self.review.write(
+            'created', mix=mix_name, ingredient=name,
+            closest=found[0][1] if found else None, distance=found[0][0] if found else None)
+        self.new.append(name)
+        self.index.add(name)
+        return name
+
+    def create_new(self):
+        if not self.new:
+            return
+        Ingredient.objects.bulk_create([Ingredient(name=name, alcohol_percentage=0) for name in self.new])
+        self.ids.update(Ingredient.objects.filter(name__in=self.new).values_list('name', 'id'))
+        self.new = []
+
+
+class BulkImporter:
+    def __init__(self, resolver, review=None, batch_size=500):
+        self.resolver = resolver
+        self.review = review
+        self.batch_size = batch_size
+        self.pending = []
+        self.needs_image = {}  # mix name -> image URL, of the mixes created or without an image
+        self.created = 0
+        self.existing = 0
+        self.invalid = 0
+
+    def add(self, drink):
+        """Queue a lookup drink, written with its batch. False if invalid"""
+        try:
+            self.pending.append(normalise(drink, self.review))
+        except InvalidDrink as e:
+            drink_id = drink.get('idDrink') if isinstance(drink, dict) else None
+            logger.warning('Drink %s not imported: %s', drink_id, e)
+            if self.review is not None:
+                self.review.write('invalid', drink=drink_id, error=str(e))
+            self.invalid += 1
+            return False
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    @transaction.atomic
+    def flush(self):
+        records = {}
+        for record in self.pending:
+            records.setdefault(record['name'], record)  # the first of the same name wins
+        self.pending = []
+        if not records:
+            return
+        existing = dict(Mix.objects.filter(name__in=list(records)).values_list('name', 'image'))
+        for name, image in existing.items():
+            if not image and records[name]['image_url']:
+                self.needs_image[name] = records[name]['image_url']
+        new = [record for name, record in records.items() if name not in existing]
+        for record in new:
+            record['doses'] = [
+                (number, self.resolver.resolve(ingredient, record['name']), quantity)
+                for number, ingredient, quantity in record['doses']
+            ]
+        self.resolver.create_new()
+        Mix.objects.bulk_create([Mix(name=record['name'], description=record['description']) for record in new])
+        mix_ids = dict(Mix.objects.filter(name__in=[record['name'] for record in new]).values_list('name', 'id'))
+        Dose.objects.bulk_create([
+            Dose(
+                mix_id=mix_ids[record['name']],
+                ingredient_id=self.resolver.ids[ingredient],
+                number=number,
+                quantity=0 if ingredient in self.resolver.added_separately else quantity,
+            )
+            for record in new for number, ingredient, quantity in record['doses']
+        ])
+        for record in new:
+            if record['image_url']:
+                self.needs_image[record['name']] = record['image_url']
+        self.created += len(new)
+        self.existing += len(existing)
+
+
+@transaction.atomic
+def attach_images(images):
+    """Save the images, mix name -> (file name, data), and set them on the mixes without Mix.save"""
+    if not images:
+        return 0
+    mixes = list(Mix.objects.filter(name__in=list(images)).only('id', 'name'))
+    for mix in mixes:
+        filename, data = images[mix.name]
+        content = ContentFile(data)
+        mix.image = default_storage.save(mix_upload_to(mix, filename), content)
+        mix.image_width, mix.image_height = get_image_dimensions(content)
+    Mix.objects.bulk_update(mixes, ('image', 'image_width', 'image_height'))
+    return len(mixes)
@@ -1,8 +1,6 @@
-import os
-import json
-
 from django.core.management.base import BaseCommand
 
+from recipes.importing import iter_drinks
 from recipes.models import *
 
 
@@ -14,12 +12,9 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         filepath = options['filepath']
-        with open(filepath, 'r') as myfile:
-            content = json.load(myfile)
-        ingredients = [drink['strIngredient1'] for drink in content['drinks']]
-        for ingredient_name in ingredients:
-            try:
-                found = Ingredient.objects.get(name=ingredient_name)
-            except Ingredient.DoesNotExist:
-                Ingredient.objects.create(name=ingredient_name, alcohol_percentage=0)
-                print('Added %s to DB' % ingredient_name)
+        names = {drink['strIngredient1'] for drink in iter_drinks(filepath) if drink.get('strIngredient1')}
+        known = set(Ingredient.objects.filter(name__in=names).values_list('name', flat=True))
+        added = sorted(names - known)
+        Ingredient.objects.bulk_create([Ingredient(name=name, alcohol_percentage=0) for name in added])
+        for ingredient_name in added:
+            print('Added %s to DB' % ingredient_name)
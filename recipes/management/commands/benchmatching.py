@@ -0,0 +1,76 @@
+import random
+import time
+
+from Levenshtein import distance
+
+from django.core.management.base import BaseCommand
+
+from recipes.matching import BKTree
+
+BRANDS = ('', 'Absolut', 'Bacardi', 'Bols', 'Cointreau', 'DeKuyper', 'Finlandia', 'Gordons', 'Havana', 'Jameson', 'Monin', 'Smirnoff')
+FLAVORS = ('', 'Apple', 'Apricot', 'Banana', 'Blackberry', 'Cherry', 'Citron', 'Coconut', 'Cranberry', 'Lemon', 'Lime', 'Mango', 'Melon', 'Mint', 'Orange', 'Peach', 'Pear', 'Raspberry', 'Strawberry', 'Vanilla')
+KINDS = ('Brandy', 'Cordial', 'Gin', 'Juice', 'Liqueur', 'Nectar', 'Rum', 'Schnapps', 'Soda', 'Syrup', 'Tea', 'Tequila', 'Vodka', 'Whisky')
+
+
+def make_names(count, generator):
+    names = set()
+    while len(names) < count:
+        names.add(' '.join(word for word in (
+            generator.choice(BRANDS), generator.choice(FLAVORS), generator.choice(FLAVORS), generator.choice(KINDS)) if word))
+    return sorted(names)
+
+
+def misspell(name, generator):
+    position = generator.randrange(len(name))
+    edit = generator.choice(('swap', 'drop', 'change', 'case'))
+    if edit == 'swap' and position < len(name) - 1:
+        return name[:position] + name[position + 1] + name[position] + name[position + 2:]
+    if edit == 'drop':
+        return name[:position] + name[position + 1:]
+    if edit == 'case':
+        return name.upper()
+    return name[:position] + generator.choice('aeiourst') + name[position + 1:]
+
+
+class Command(BaseCommand):
+    help = 'Closest ingredient lookups in a BK-tree against the scan of every name'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--names', type=int, default=5000)
+        parser.add_argument('--queries', type=int, default=1000, help='Misspelled names, one in ten unknown')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = random.Random(options['seed'])
+        names = make_names(options['names'], generator)
+        queries = [
+            misspell(generator.choice(names), generator) if index % 10 else 'Unknown %i thing' % index
+            for index in range(options['queries'])
+        ]
+        self.stdout.write('%i names, %i queries' % (len(names), len(queries)))
+
+        start = time.perf_counter()
+        keys = [(name.lower(), name) for name in names]
+        expected = []
+        for query in queries:
+            key = query.lower()
+            expected.append(min((distance(key, name_key), name) for name_key, name in keys))
+        self.report('scan of every name', start, len(queries), len(names))
+
+        start = time.perf_counter()
+        index = BKTree(names)
+        self.stdout.write('%-28s %8.1f ms' % ('BK-tree build', (time.perf_counter() - start) * 1000))
+        for k, max_distance in ((1, None), (3, None), (1, 2), (3, 2)):
+            index.comparisons = 0
+            start = time.perf_counter()
+            results = [index.closest(query, k, max_distance) for query in queries]
+            self.report('BK-tree, k=%i, max %s' % (k, max_distance), start, len(queries), index.comparisons / len(queries))
+            wrong = sum(
+                1 for found, best in zip(results, expected)
+                if (found[0][0] if found else None) != (best[0] if max_distance is None or best[0] <= max_distance else None))
+            if wrong:
+                self.stdout.write(self.style.ERROR('%i lookups differ from the scan' % wrong))
+
+    def report(self, name, start, queries, comparisons):
+        self.stdout.write('%-28s %8.1f us/lookup, %6.0f distances/lookup' % (
+            name, (time.perf_counter() - start) / queries * 1e6, comparisons))
@@ -0,0 +1,61 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes import measures
+from recipes.importing import INGREDIENT_KEYS, iter_drinks
+from recipes.tests import MEASURES
+
+
+def legacy_clean_measure(measure):
+    """The replace rules and unit substrings used before, to compare"""
+    measure = measure.lower()
+    for match, replacement in LEGACY_REPLACING:
+        measure = measure.replace(match, replacement)
+    for unit in LEGACY_CONVERSIONS:
+        if unit in measure:
+            try:
+                return float(measure.split()[0]) * LEGACY_CONVERSIONS[unit]
+            except ValueError:
+                if measure.split()[0] in LEGACY_CONVERSIONS:
+                    return LEGACY_CONVERSIONS[measure.split()[0]]
+                return None
+
+
+LEGACY_CONVERSIONS = {
+    'oz': 3, 'tsp': 0.6, 'shot': 3, 'part': 3, 'parts': 3, 'shots': 3, 'twist of': 1, 'tblsp': 1.5,
+    'gr': 0.1, 'ml': 0.1, 'cl': 1, 'dash': 1.5, 'dashes': 1.5, 'twist': 1.5, 'fifth': 6, 'cup': 30,
+    'cups': 30, 'drop': 0.6, 'drops': 0.6,
+}
+LEGACY_REPLACING = (
+    ('1 1/2', '1.5'), ('1/2', '0.5'), ('3/4', '0.75'), ('1/8', '0.125'), ('1/4', '0.25'), ('2/3', '0.66'),
+    ('1/3', '0.33'), ('3-4', '3.5'), ('1-3', '2'), ('2-3', '2.5'), ('1-2', '1.5'), ('Fill with', '10 oz'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Time the measure parser over the measures of a dump, against the replace rules used before'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dump', nargs='?', help='Drinks dump as read by importdrinks, the measures of recipes.tests 1000 times by default')
+        parser.add_argument('--format', choices=('json', 'jsonl'), default=None)
+
+    def handle(self, *args, **options):
+        if options['dump']:
+            samples = [
+                drink[measure_key] for drink in iter_drinks(options['dump'], options['format'])
+                for _, _, measure_key in INGREDIENT_KEYS if isinstance(drink, dict) and drink.get(measure_key)
+            ]
+        else:
+            samples = [measure for measure, _ in MEASURES] * 1000
+        self.stdout.write('%i measures, %i distinct' % (len(samples), len(set(samples))))
+        measures.parse_measure.cache_clear()
+        for name, function in (
+                ('replace rules', legacy_clean_measure),
+                ('tokenizer', measures.parse_measure.__wrapped__),
+                ('tokenizer and cache', measures.get_clean_measure)):
+            start = time.perf_counter()
+            for measure in samples:
+                function(measure)
+            duration = time.perf_counter() - start
+            self.stdout.write('%-20s %10.0f measures/s' % (name, len(samples) / duration))
@@ -0,0 +1,53 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.importing import BulkImporter, IngredientResolver, attach_images, iter_drinks
+from recipes.scraping import ReviewFile
+
+
+class Command(BaseCommand):
+    help = 'Import the drinks of thecocktaildb lookup dumps, JSON or JSON lines, without network'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Dump files, .gz ones are decompressed')
+        parser.add_argument('--format', choices=('json', 'jsonl'), default=None, help='Guessed from the file extension by default')
+        parser.add_argument('--batch-size', type=int, default=500, help='Drinks written per transaction')
+        parser.add_argument('--images', default=None, help='Directory with the images, named like the end of their strDrinkThumb URL')
+        parser.add_argument('--review', default='import-review.jsonl', help='Ingredients matched or created and suspicious measures are appended there')
+        parser.add_argument('--max-distance', type=int, default=2, help='Use the closest known ingredient up to this edit distance, create one otherwise')
+
+    def handle(self, *args, **options):
+        review = ReviewFile(options['review'])
+        importer = BulkImporter(IngredientResolver(review, options['max_distance']), review, options['batch_size'])
+        start = time.perf_counter()
+        images = 0
+        for path in options['paths']:
+            try:
+                for drink in iter_drinks(path, options['format']):
+                    importer.add(drink)
+                    if len(importer.needs_image) >= options['batch_size']:
+                        images += self.attach(importer, options['images'])
+            except (OSError, ValueError) as e:
+                importer.flush()  # the drinks read before the error
+                self.attach(importer, options['images'])
+                raise CommandError('%s: %s, %i mixes created before' % (path, e, importer.created))
+            importer.flush()
+            self.stdout.write('%s: %i mixes created so far' % (path, importer.created))
+        images += self.attach(importer, options['images'])
+        self.stdout.write('%i mixes created, %i existing, %i invalid drinks, %i images in %.1fs, %i decisions to review in %s' % (
+            importer.created, importer.existing, importer.invalid, images, time.perf_counter() - start,
+            review.count, options['review']))
+
+    def attach(self, importer, directory):
+        found = {}
+        for name, url in importer.needs_image.items() if directory else ():
+            filename = url.split('/')[-1]
+            try:
+                with open(os.path.join(directory, filename), 'rb') as f:
+                    found[name] = (filename, f.read())
+            except OSError:
+                pass  # no image, as when the download fails
+        importer.needs_image = {}
+        return attach_images(found)
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.fleet import serve
+
+
+class Command(BaseCommand):
+    help = 'Run the fleet coordinator: catalog of this database, heartbeats of the bars and order routing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8100)
+
+    def handle(self, *args, **options):
+        if not settings.FLEET_TOKEN:
+            raise CommandError('Set FLEET_TOKEN in the settings, the same on the coordinator and the bars')
+        try:
+            serve((options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
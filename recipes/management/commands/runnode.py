@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.fleet import NodeAgent
+
+
+class Command(BaseCommand):
+    help = 'Report this bar to the fleet coordinator and keep its catalog up to date'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--coordinator', default=settings.FLEET_COORDINATOR, help='URL of the coordinator')
+
+    def handle(self, *args, **options):
+        if not options['coordinator']:
+            raise CommandError('Set FLEET_COORDINATOR in the settings or use --coordinator')
+        if not settings.FLEET_NODE_URL:
+            raise CommandError('Set FLEET_NODE_URL in the settings, the coordinator sends orders there')
+        if not settings.FLEET_TOKEN:
+            raise CommandError('Set FLEET_TOKEN in the settings, the same on the coordinator and the bars')
+        agent = NodeAgent(options['coordinator'])
+        try:
+            agent.run()  # in this thread
+        except KeyboardInterrupt:
+            agent.stop()
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recipes.scraping import serve_fixtures
+
+
+class Command(BaseCommand):
+    help = 'Serve generated thecocktaildb pages, or a response cache, to run scrap --url http://localhost:8300 offline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8300)
+        parser.add_argument('--drinks', type=int, default=5, help='Drinks per letter, at most 100')
+        parser.add_argument('--seed', type=int, default=0, help='Other drinks for another seed')
+        parser.add_argument('--fail-rate', type=float, default=0, help='Share of the requests answered HTTP 503')
+        parser.add_argument('--delay', type=float, default=0, help='[s] before each answer')
+        parser.add_argument('--replay', default=None, help='Serve the responses of this scrap cache directory instead')
+
+    def handle(self, *args, **options):
+        try:
+            serve_fixtures(
+                (options['host'], options['port']), min(options['drinks'], 100), options['seed'],
+                options['fail_rate'], options['delay'], options['replay'])
+        except KeyboardInterrupt:
+            pass
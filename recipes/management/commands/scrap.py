@@ -1,69 +1,19 @@
-import os
-import demjson
-import urllib3
-import urllib.request
+import json
+import time
 import certifi
-from Levenshtein import distance
 import re
-from pprint import pprint
 
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.core.files import File
+from django.utils.log import logging
 
-from recipes.models import Ingredient, Mix, Dose, mix_upload_to
+from recipes.importing import BulkImporter, IngredientResolver, attach_images
+from recipes.measures import CONVERSIONS, GLASS_BASE, get_clean_measure  # where they used to be
+from recipes.scraping import LETTERS, Checkpoint, Fetcher, FetchError, PoolManagerCounter, ResponseCache, ReviewFile
 
-URL = 'https://www.thecocktaildb.com/'
-
-GLASS_BASE = 30
-
-CONVERSIONS = {  # to cL approximately
-    'oz': 3,
-    'tsp': 0.6,
-    'shot': 3,
-    'part': 3,  # TODO
-    'parts': 3,  # TODO
-    'shots': 3,
-    'twist of': 1,
-    'tblsp': 1.5,
-    'gr': 0.1,
-    'ml': 0.1,
-    'cl': 1,
-    'dash': 1.5,  # TODO
-    'dashes': 1.5,  # TODO
-    'twist': 1.5,
-    'fifth': GLASS_BASE / 5,
-    'cup': 30,
-    'cups': 30,
-    'drop': 0.6,
-    'drops': 0.6,
-    #'': GLASS_BASE,  # last in dict !
-}
-
-REPLACING = (
-    ('1 1/2', '1.5'),
-    ('1/2', '0.5'),
-    ('3/4', '0.75'),
-    ('1/8', '0.125'),
-    ('1/4', '0.25'),
-    ('2/3', '0.66'),
-    ('1/3', '0.33'),
-    ('3-4', '3.5'),
-    ('1-3', '2'),
-    ('2-3', '2.5'),
-    ('1-2', '1.5'),
-    ('Fill with', '10 oz')
-)
-
-
-class PoolManagerCounter(urllib3.PoolManager):
-    def __init__(self, num_pools=10, headers=None, **connection_pool_kw):
-        self.counter = 0
-        urllib3.PoolManager.__init__(self, num_pools=num_pools, headers=headers, **connection_pool_kw)
-
-    def urlopen(self, method, url, redirect=True, **kw):
-        self.counter += 1
-        return urllib3.PoolManager.urlopen(self, method, url, redirect=redirect, **kw)
+logger = logging.getLogger('autobar')
 
+URL = 'https://www.thecocktaildb.com/'
 
 # PoolManagerCounter(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
 
@@ -73,141 +23,88 @@ def open_page(url, pool_manager):
     return r.data
 
 
-def get_browse_url_by_letter(letter):
-    return URL + 'browse.php?b=' + str(letter)
-
-
-def get_lookup_url_by_id(drink_id):
-    return URL + 'api/json/v1/1/lookup.php?i=' + str(drink_id)
-
+def get_browse_url_by_letter(letter, base_url=URL):
+    return base_url + 'browse.php?b=' + str(letter)
 
-def make_json_keys_list():
-    ingredient, measure = 'strIngredient', 'strMeasure'
-    l = []
-    for i in range(1, 16):
-        l.append(
-            (
-                i,
-                ingredient + str(i),
-                measure + str(i)
-            )
-        )
-    return l
 
+def get_lookup_url_by_id(drink_id, base_url=URL):
+    return base_url + 'api/json/v1/1/lookup.php?i=' + str(drink_id)
 
-INGREDIENT_KEYS = make_json_keys_list()
 
-
-def get_closest_ingredient(name):
-    ingredients = Ingredient.objects.values_list('name', flat=True)
-    distances = [distance(name, known_name) for known_name in ingredients]
-    min_index, min_value = min(enumerate(distances), key=lambda p: p[1])
-    return Ingredient.objects.get(name=ingredients[min_index])
-
-
-def get_clean_measure(measure, ingredient=None):
-    measure = measure.lower()
-    for match, replacement in REPLACING:
-        measure = measure.replace(match, replacement)
-    for unit in CONVERSIONS:
-        if unit in measure:
-            try:
-                value = float(measure.split()[0]) * CONVERSIONS[unit]
-                # print('recognized %s [cL]' % value)
-                return value
-            except ValueError:
-                if measure.split()[0] in CONVERSIONS:
-                    value = CONVERSIONS[measure.split()[0]]
-                    return value
-                print('PASSED', measure, ingredient)
-
-
-def add_image(url, mix):
-    original_filename = url.split('/')[-1]
-    temp_location = os.path.join('/tmp', original_filename)
-    urllib.request.urlretrieve(url, temp_location)
-    image_name = os.path.basename(mix_upload_to(mix, original_filename))
-    mix.image.save(image_name, File(open(temp_location, 'rb')))
+def get_drink_ids(html):
+    ids = re.findall(r'drink.php\?c=(\d+)', html.decode(errors='replace'))
+    return list(dict.fromkeys(map(int, ids)))  # once each, in page order
 
 
 class Command(BaseCommand):
-    help = 'Scraps all cocktails from thecocktaildb.com'
+    help = 'Scraps all cocktails from thecocktaildb.com, resumes where an interrupted run stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--letters', default=LETTERS, help='First letters of the drinks to scrap')
+        parser.add_argument('--url', default=URL, help='Site to scrap, such as the one of runscrapfixtures')
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent requests')
+        parser.add_argument('--rate', type=float, default=5, help='[requests/s] at most, 0 for no limit')
+        parser.add_argument('--retries', type=int, default=3, help='Attempts after a failed request')
+        parser.add_argument('--cache', default=settings.SCRAP_CACHE_DIR, help='Directory of the cached responses, empty to disable')
+        parser.add_argument('--checkpoint', default=settings.SCRAP_CHECKPOINT, help='Progress file, empty to disable')
+        parser.add_argument('--restart', action='store_true', help='Forget the progress of the previous runs')
+        parser.add_argument('--review', default='scrap-review.jsonl', help='Ingredients matched or created and suspicious measures are appended there')
+        parser.add_argument('--max-distance', type=int, default=2, help='Use the closest known ingredient up to this edit distance, create one otherwise')
+        parser.add_argument('--no-images', action='store_true')
 
     def handle(self, *args, **options):
-        pool_manager = PoolManagerCounter(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
-        for letter in 'z':
-            url = get_browse_url_by_letter(letter)
-            html_letter = open_page(url, pool_manager)
-            ids = re.findall(r'drink.php\?c=\d+', str(html_letter))
-            ids = map(lambda s: s[len("drink.php?c="):], ids)
-            ids = list(map(int, ids))
-            for drink_id in ids:
-                json_url = get_lookup_url_by_id(drink_id)
-                json_text = open_page(json_url, pool_manager)
-                drinks = demjson.decode(json_text, encoding="ascii")
-                drink = drinks['drinks'][0]
-                name = drink['strDrink']
-                image_url = drink['strDrinkThumb']
-                description = drink['strInstructions']
+        base_url = options['url'] if options['url'].endswith('/') else options['url'] + '/'
+        pool_manager = PoolManagerCounter(
+            maxsize=options['workers'], block=True, cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
+        cache = ResponseCache(options['cache'], base_url) if options['cache'] else None
+        fetcher = Fetcher(pool_manager, cache, options['rate'], options['retries'], options['workers'])
+        checkpoint = Checkpoint(options['checkpoint'])
+        if options['restart']:
+            checkpoint.letters, checkpoint.drinks = set(), set()
+        review = ReviewFile(options['review'])
+        importer = BulkImporter(IngredientResolver(review, options['max_distance']), review)
+        failed = 0
+        start = time.perf_counter()
+        try:
+            for letter in options['letters']:
+                if letter in checkpoint.letters:
+                    continue
                 try:
-                    mix = Mix.objects.get(name=name)
-                    if not mix.image:
-                        add_image(image_url, mix)
+                    ids = get_drink_ids(fetcher.get(get_browse_url_by_letter(letter, base_url)))
+                except FetchError as e:
+                    logger.warning('Letter %s skipped: %s', letter, e)
                     continue
-                except Mix.DoesNotExist:
-                    pass
-                mix = Mix.objects.create(
-                    name=name,
-                    description=description,
-                )
-                add_image(image_url, mix)
-                for i, ingredient_key, measure_key in INGREDIENT_KEYS:
-                    ingredient_name = drink[ingredient_key]
-                    measure = drink[measure_key]
-                    ingredient_name = ingredient_name.strip() if ingredient_name is not None else ingredient_name
-                    measure = measure.strip() if measure is not None else measure
-                    if ingredient_name and measure:
-                        try:
-                            ingredient = Ingredient.objects.get(name=ingredient_name)
-                        except Ingredient.DoesNotExist:
-                            ingredient = get_closest_ingredient(ingredient_name)
-                            if distance(ingredient.name.lower(), ingredient_name.lower()) != 0:
-                                choice = input('%s does not exist, would you like to create a new, use %s or other? (n/u/o) '
-                                               % (ingredient_name, ingredient.name))
-                                if choice == 'n':
-                                    ingredient = Ingredient.objects.create(
-                                        name=ingredient_name,
-                                        alcohol_percentage=0,
-                                    )
-                                elif choice == 'u':
-                                    pass
-                                elif choice == 'o':
-                                    other_name = input('type the exact ingredient name : ')
-                                    try:
-                                        ingredient = Ingredient.objects.get(name=other_name)
-                                    except Ingredient.DoesNotExist:
-                                        print('Did not understand. Next !')
-                                        continue
-                                else:
-                                    print('Did not understand. Next !')
-                                    continue
-                        measure_clean = get_clean_measure(measure, ingredient_name)
-                        if measure_clean:
-                            if measure_clean > GLASS_BASE:
-                                print(measure, ingredient_name, 'became', measure_clean)
-                                print('do you want to correct it ? (%s, %s)' % (name, drink_id))
-                                choice = input('y/n : ')
-                                if choice == 'y':
-                                    try:
-                                        measure_clean = float(input("float value : "))
-                                    except ValueError:
-                                        print("fail noob")
-                                        measure_clean = 0
-                        else:
-                            measure_clean = 0
-                        dose = Dose.objects.create(
-                            mix=mix,
-                            ingredient=ingredient,
-                            quantity=measure_clean,
-                            number=i,
-                        )
+                ids = [drink_id for drink_id in ids if drink_id not in checkpoint.drinks]
+                lookups = fetcher.get_many([get_lookup_url_by_id(drink_id, base_url) for drink_id in ids])
+                done = []
+                for drink_id, (url, body) in zip(ids, lookups.items()):
+                    try:
+                        if isinstance(body, FetchError):
+                            raise body
+                        importer.add(json.loads(body)['drinks'][0])
+                        done.append(drink_id)
+                    except (FetchError, ValueError, KeyError, IndexError, TypeError) as e:
+                        logger.warning('Drink skipped: %s %s', url, e)
+                        failed += 1
+                importer.flush()
+                if not options['no_images'] and importer.needs_image:
+                    urls = importer.needs_image
+                    images = fetcher.get_many(list(urls.values()))
+                    for name, url in urls.items():
+                        if isinstance(images[url], FetchError):
+                            logger.warning('No image for %s: %s', name, images[url])
+                    attach_images({
+                        name: (url.split('/')[-1], images[url])
+                        for name, url in urls.items() if not isinstance(images[url], FetchError)})
+                importer.needs_image = {}
+                checkpoint.drinks.update(done)
+                if len(done) == len(ids):  # done, or tried again at the next run
+                    checkpoint.letters.add(letter)
+                checkpoint.save()
+                self.stdout.write('%s: %i drinks, %i mixes created so far' % (letter, len(done), importer.created))
+        finally:
+            checkpoint.save()
+            self.stdout.write(
+                '%i mixes created, %i drinks failed, %i requests and %i cache hits in %.1fs, %i decisions to review in %s' % (
+                    importer.created, failed + importer.invalid, pool_manager.counter, fetcher.hits, time.perf_counter() - start,
+                    review.count, options['review']))
@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+import time
+import urllib.request
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import fleet, sync
+
+
+def load_state():
+    try:
+        with open(settings.CATALOG_SYNC_STATE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state):
+    temporary = settings.CATALOG_SYNC_STATE + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(temporary, settings.CATALOG_SYNC_STATE)
+
+
+class Command(BaseCommand):
+    help = 'Export the catalog changes since a watermark to a bundle, apply a bundle, or pull the changes of another bar'
+
+    def add_arguments(self, parser):
+        actions = parser.add_subparsers(dest='action', required=True)
+        export = actions.add_parser('export', help='Write the bundle of the changes since --since')
+        export.add_argument('--since', default='', help='ISO 8601 watermark, everything if empty')
+        export.add_argument('--output', default='-', help='Bundle file, - for stdout')
+        apply = actions.add_parser('apply', help='Apply a bundle file')
+        apply.add_argument('bundle', help='Bundle file, - for stdin')
+        pull = actions.add_parser('pull', help='Apply the changes of another bar since the last pull')
+        pull.add_argument('url', help='Web server of the other bar, such as http://192.168.1.11:8000')
+        pull.add_argument('--since', default=None, help='ISO 8601 watermark instead of the one of the last pull, empty for everything')
+        pull.add_argument('--timeout', type=float, default=60, help='[s]')
+
+    def handle(self, *args, **options):
+        try:
+            getattr(self, options['action'])(options)
+        except sync.BundleError as e:
+            raise CommandError(e)
+
+    def export(self, options):
+        start = time.perf_counter()
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        size = 0
+        with output:
+            for chunk in sync.export(sync.parse_watermark(options['since'])):
+                output.write(chunk)
+                size += len(chunk)
+        self.stderr.write('Exported %i bytes in %.2fs' % (size, time.perf_counter() - start))
+
+    def apply(self, options):
+        start = time.perf_counter()
+        stream = sys.stdin.buffer if options['bundle'] == '-' else open(options['bundle'], 'rb')
+        with stream:
+            self.report(sync.apply(stream), start)
+
+    def pull(self, options):
+        start = time.perf_counter()
+        url = options['url'].rstrip('/')
+        state = load_state()
+        since = options['since'] if options['since'] is not None else state.get(url, '')
+        query = urlencode({'since': sync.parse_watermark(since).isoformat()}) if since else ''
+        if not settings.FLEET_TOKEN:
+            raise CommandError('Set FLEET_TOKEN in the settings, the same as on %s' % url)
+        request = urllib.request.Request('%s/catalog/export?%s' % (url, query), headers={fleet.TOKEN_HEADER: settings.FLEET_TOKEN})
+        try:
+            with urllib.request.urlopen(request, timeout=options['timeout']) as response:
+                result = sync.apply(response)
+        except OSError as e:  # URLError and HTTPError are OSError
+            raise CommandError('%s: %s' % (url, e))
+        state[url] = result['until']  # only once applied, a failed pull is done again
+        save_state(state)
+        self.report(result, start)
+
+    def report(self, result, start):
+        self.stdout.write('Changes since %s until %s: %i mixes created, %i updated, %i images written in %.2fs' % (
+            result['since'] or 'the beginning', result['until'], result['created'], result['updated'],
+            result['images'], time.perf_counter() - start))
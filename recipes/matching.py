@@ -0,0 +1,99 @@
+"""
+Approximate name lookups: the known names closest to a misspelled one under the Levenshtein
+distance, without comparing it to every name.
+
+A BK-tree keys the children of a node by their distance to it. By the triangle inequality, the
+names within r of a query are in the children whose key is within r of the distance between the
+query and the node, the other subtrees are skipped. The nearest subtrees are searched first, from
+buckets of their lower bound, so the radius soon shrinks to the distance of the k-th nearest name
+found, kept at the top of a max-heap of size k. Built once per import run and grown as names
+are created.
+"""
+import heapq
+
+from Levenshtein import distance
+
+
+class _Farthest:
+    """A name ordered backwards, so the top of the max-heap of closest() is the last of the ties"""
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __lt__(self, other):
+        return other.name < self.name
+
+
+class BKTree:
+    def __init__(self, names=(), key=str.lower):
+        self.key = key  # names are compared by key(name), None to compare them as they are
+        self.root = None  # node is [key, names, {distance: child}]
+        self.size = 0
+        self.longest = 0  # length of the longest key, no distance is larger
+        self.comparisons = 0  # distances computed by the lookups, to benchmark
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return self.size
+
+    def _key(self, name):
+        return self.key(name) if self.key is not None else name
+
+    def add(self, name):
+        key = self._key(name)
+        self.longest = max(self.longest, len(key))
+        if self.root is None:
+            self.root = [key, [name], {}]
+            self.size += 1
+            return
+        node = self.root
+        while True:
+            d = distance(key, node[0])
+            if d == 0:
+                if name not in node[1]:  # same key, such as another case
+                    node[1].append(name)
+                    self.size += 1
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [key, [name], {}]
+                self.size += 1
+                return
+            node = child
+
+    def closest(self, name, k=1, max_distance=None):
+        """Up to k (distance, name) nearest to name, nearest first, ties by name"""
+        if self.root is None or k < 1:
+            return []
+        key = self._key(name)
+        limit = max_distance if max_distance is not None else float('inf')
+        found = []  # max-heap of the k nearest so far, as (-distance, _Farthest(name))
+        buckets = [[] for _ in range(max(len(key), self.longest) + 1)]  # nodes by lower bound of their subtree
+        buckets[0].append(self.root)
+        bound = 0
+        comparisons = 0
+        while bound < len(buckets) and bound <= limit:  # past limit, every other subtree is skipped
+            bucket = buckets[bound]
+            if not bucket:
+                bound += 1
+                continue
+            node_key, node_names, children = bucket.pop()
+            d = distance(key, node_key)
+            comparisons += 1
+            if d <= limit:
+                for candidate in node_names:
+                    if len(found) < k:
+                        heapq.heappush(found, (-d, _Farthest(candidate)))
+                    else:
+                        heapq.heappushpop(found, (-d, _Farthest(candidate)))
+                if len(found) == k:  # only as near as the k-th nearest so far from now on
+                    limit = -found[0][0]
+            low, high = d - limit, d + limit  # children keyed out of [low, high] are skipped
+            for child_distance, child in children.items():
+                if low <= child_distance <= high:
+                    child_bound = d - child_distance if d > child_distance else child_distance - d
+                    buckets[child_bound if child_bound > bound else bound].append(child)  # the buckets before are done
+        self.comparisons += comparisons
+        return sorted((-d, candidate.name) for d, candidate in found)
@@ -0,0 +1,100 @@
+"""
+Measures of thecocktaildb, such as '1 1/2 oz' or '2 dashes', converted to cL.
+
+A measure is tokenized by one compiled regex: amounts (integers, decimals, fractions such as
+'1 1/2' or '¾', ranges such as '3-4' taken at their middle) and units, matched as whole words
+longest first so 'dashes' is not read as 'dash' nor 'gr' found in 'grenadine'. The first amount
+times the factor of the first unit is the quantity, a unit alone counts once ('dash of' bitters).
+Catalogs repeat the same few hundred measures, so the results are cached.
+"""
+import re
+from functools import lru_cache
+
+GLASS_BASE = 30
+
+CONVERSIONS = {  # to cL approximately
+    'oz': 3,
+    'ounce': 3,
+    'ounces': 3,
+    'tsp': 0.6,
+    'teaspoon': 0.6,
+    'teaspoons': 0.6,
+    'shot': 3,
+    'part': 3,  # parts are relative to each other, one is taken as a shot
+    'parts': 3,
+    'shots': 3,
+    'jigger': 4.5,
+    'twist of': 1,
+    'tblsp': 1.5,
+    'tbsp': 1.5,
+    'tablespoon': 1.5,
+    'tablespoons': 1.5,
+    'gr': 0.1,
+    'ml': 0.1,
+    'cl': 1,
+    'dl': 10,
+    'dash': 1.5,  # more than a real dash, as the mixes imported until now
+    'dashes': 1.5,
+    'twist': 1.5,
+    'fifth': GLASS_BASE / 5,
+    'cup': 30,
+    'cups': 30,
+    'drop': 0.6,
+    'drops': 0.6,
+    'fill with': GLASS_BASE,  # the rest of the glass
+}
+
+VULGAR_FRACTIONS = {'½': 1 / 2, '⅓': 1 / 3, '⅔': 2 / 3, '¼': 1 / 4, '¾': 3 / 4, '⅛': 1 / 8}
+
+NUMBER = r'''
+    (?:(?P<{0}whole>\d+)(?:\s+|-)(?P<{0}mixed_numerator>\d+)/(?P<{0}mixed_denominator>\d+))  # 1 1/2, 1-1/2
+    |(?:(?P<{0}numerator>\d+)/(?P<{0}denominator>\d+))  # 3/4
+    |(?:(?P<{0}vulgar_whole>\d+)?\s*(?P<{0}vulgar>[{1}]))  # 1½
+    |(?P<{0}decimal>\d*[.,]\d+|\d+)  # 0.5, 2
+'''.format
+TOKENS = re.compile(r'''
+    (?P<amount>{first}(?:\s*(?:-|–|to|or)\s*{second})?)
+    |(?<![a-z])(?P<unit>{units})(?![a-z])
+'''.format(
+    first=NUMBER('first_', ''.join(VULGAR_FRACTIONS)),
+    second='(?:%s)' % NUMBER('second_', ''.join(VULGAR_FRACTIONS)),
+    units='|'.join(re.escape(unit).replace(r'\ ', r'\s+') for unit in sorted(CONVERSIONS, key=len, reverse=True)),
+), re.VERBOSE)
+
+
+def _number(match, prefix):
+    def group(name):
+        return match.group(prefix + name)
+    if group('whole') is not None:
+        return int(group('whole')) + int(group('mixed_numerator')) / int(group('mixed_denominator'))
+    if group('numerator') is not None:
+        denominator = int(group('denominator'))
+        return int(group('numerator')) / denominator if denominator else None
+    if group('vulgar') is not None:
+        return int(group('vulgar_whole') or 0) + VULGAR_FRACTIONS[group('vulgar')]
+    if group('decimal') is not None:
+        return float(group('decimal').replace(',', '.'))
+    return None
+
+
+@lru_cache(maxsize=4096)
+def parse_measure(measure):
+    """Quantity in cL of a measure, None without a known unit"""
+    amount = factor = None
+    for match in TOKENS.finditer(measure.lower()):
+        if match.group('unit') is not None:
+            factor = CONVERSIONS[' '.join(match.group('unit').split())]
+            break
+        if amount is None:
+            amount = _number(match, 'first_')
+            second = _number(match, 'second_')
+            if amount is not None and second is not None:
+                amount = (amount + second) / 2
+    if factor is None:
+        return None
+    return factor if amount is None else round(amount * factor, 3)
+
+
+def get_clean_measure(measure, ingredient=None):
+    """Quantity in cL of a measure of ingredient, None if not understood"""
+    return parse_measure(measure.strip())
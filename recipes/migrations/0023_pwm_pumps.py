@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0022_configuration_clean_pumps_now'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuration',
+            name='hardware_use_pwm_pumps',
+            field=models.BooleanField(default=False, help_text='Drive pumps with PWM to slow them down near the end of a dose (see the dispensers ramp settings)'),
+        ),
+        migrations.AddField(
+            model_name='dispenser',
+            name='pwm_min_speed',
+            field=models.FloatField(default=0.3, help_text='Speed between 0 and 1 of a PWM pump when the dose is almost reached'),
+        ),
+        migrations.AddField(
+            model_name='dispenser',
+            name='pwm_ramp_weight',
+            field=models.FloatField(default=20, help_text='[g] remaining weight below which a PWM pump slows down, 0 to never slow down'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0023_pwm_pumps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuration',
+            name='clean_pumps_container_capacity',
+            field=models.FloatField(default=500, help_text='[g] weight of liquid the collection container can take, cleaning pauses until it is emptied'),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='clean_pumps_timeout',
+            field=models.FloatField(default=60, help_text='[s] length of time a pump may run before giving up on reaching clean_pumps_weight'),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='clean_pumps_weight',
+            field=models.FloatField(default=100, help_text='[g] weight of cleaning liquid each pump must move before it is clean'),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='hardware_max_running_pumps',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Power budget, number of pumps the supply can run at the same time, more than 1 only if it was sized for it'),
+        ),
+        migrations.AlterField(
+            model_name='configuration',
+            name='clean_pumps_now',
+            field=models.BooleanField(default=False, help_text='Trigger cleaning the pumps now. Tips: press the green button to skip the running pumps'),
+        ),
+    ]
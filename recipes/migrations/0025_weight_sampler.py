@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0024_cleaning_scheduler'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuration',
+            name='weight_sampler_idle_period',
+            field=models.FloatField(default=1, help_text='[s] length of time between two weight measures while no order is served'),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='weight_sampler_power_down_delay',
+            field=models.FloatField(default=600, help_text='[s] the weight cell is powered down after this idle time, 0 to keep it always on'),
+        ),
+    ]
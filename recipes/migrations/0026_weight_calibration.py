@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0025_weight_sampler'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='configuration',
+            name='weight_cell_quadratic',
+            field=models.FloatField(default=0, help_text='Quadratic term on the tared value, set by the calibrateweight command'),
+        ),
+        migrations.AddField(
+            model_name='configuration',
+            name='weight_zero_tracking_range',
+            field=models.FloatField(default=3, help_text='[g] while idle, a steady weight closer to zero than this is taken as the new tare, 0 to disable'),
+        ),
+    ]
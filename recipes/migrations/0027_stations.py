@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 14:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0026_weight_calibration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dispenser',
+            name='station',
+            field=models.PositiveSmallIntegerField(choices=[(0, 0)], default=0, help_text='Serving station the pump pours into, see settings.STATIONS'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='station',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Where it is served, set when accepted', null=True),
+        ),
+    ]
@@ -5,12 +5,14 @@ import solo.models
 from django.conf import settings
 from django.db import models
 from django.db.utils import OperationalError
+from django.utils import timezone
 from django.utils.log import logging
 from django.utils.text import get_valid_filename
 
 from recipes.animation import get_animation_for_mix
 
 DISPENSER_CHOICES = [(i, i) for i in range(len(settings.GPIO_PUMPS))]
+STATION_CHOICES = [(i, i) for i in range(len(settings.STATIONS))]
 
 
 logger = logging.getLogger('autobar')
@@ -30,6 +32,12 @@ class Configuration(solo.models.SingletonModel):
     ux_show_only_available_mixes = models.BooleanField(default=False)
     ux_show_only_verified_mixes = models.BooleanField(default=True)
     hardware_use_dummy = models.BooleanField(default=True, help_text="For debug, keep False otherwise")
+    hardware_use_pwm_pumps = models.BooleanField(
+        default=False,
+        help_text="Drive pumps with PWM to slow them down near the end of a dose (see the dispensers ramp settings)")
+    hardware_max_running_pumps = models.PositiveSmallIntegerField(
+        default=1,
+        help_text="Power budget, number of pumps the supply can run at the same time, more than 1 only if it was sized for it")
     ux_mark_not_serving_dispensers_as_empty = models.BooleanField(
         default=False,
         help_text="Mark dispenser empty if cannot reach target weight within the timeout limit")
@@ -79,12 +87,33 @@ class Configuration(solo.models.SingletonModel):
         help_text="Gain 32 is only for channel B, others for channel A")
     weight_cell_offset = models.FloatField(default=0, help_text="The tare value")
     weight_cell_ratio = models.FloatField(default=1, help_text="Transforms a tared value to grams")
+    weight_cell_quadratic = models.FloatField(
+        default=0,
+        help_text="Quadratic term on the tared value, set by the calibrateweight command")
+    weight_zero_tracking_range = models.FloatField(
+        default=3,
+        help_text="[g] while idle, a steady weight closer to zero than this is taken as the new tare, 0 to disable")
     weight_module_queue_length = models.SmallIntegerField(default=10,
         help_text="Weight is the median on X samples")
     weight_module_delay_measure = models.FloatField(default=0.02,
         help_text="[s] length of time between two weight measures, try to keep it between 10 and 100Hz")
-
-    clean_pumps_now = models.BooleanField(default=False, help_text="Trigger cleaning the pumps now. Tips: lift the weight module to skip to next pump")
+    weight_sampler_idle_period = models.FloatField(
+        default=1,
+        help_text="[s] length of time between two weight measures while no order is served")
+    weight_sampler_power_down_delay = models.FloatField(
+        default=600,
+        help_text="[s] the weight cell is powered down after this idle time, 0 to keep it always on")
+
+    clean_pumps_now = models.BooleanField(default=False, help_text="Trigger cleaning the pumps now. Tips: press the green button to skip the running pumps")
+    clean_pumps_weight = models.FloatField(
+        default=100,
+        help_text="[g] weight of cleaning liquid each pump must move before it is clean")
+    clean_pumps_timeout = models.FloatField(
+        default=60,
+        help_text="[s] length of time a pump may run before giving up on reaching clean_pumps_weight")
+    clean_pumps_container_capacity = models.FloatField(
+        default=500,
+        help_text="[g] weight of liquid the collection container can take, cleaning pauses until it is emptied")
 
     class Meta:
         verbose_name = "Configuration"
@@ -95,19 +124,20 @@ class Configuration(solo.models.SingletonModel):
     def save(self, *args, **kwargs):
         # import here to avoid cross ref
         try:
-            from hardware.serving import CocktailArtist
-            artist = CocktailArtist.getInstance()
-            artist.reload_with_new_config(self)  # we provide self/config since we have not saved yet
+            from hardware.rpc import get_artist
+            artist = get_artist()
             if self.clean_pumps_now:
                 logger.info("Asking artist to clean pumps")
-                artist.clean_pumps()
-                self.clean_pumps_now = False
+            # we provide self/config since we have not saved yet
+            artist.reload_with_new_config(self, clean_pumps=self.clean_pumps_now)
+            self.clean_pumps_now = False
         except OperationalError:
             logger.error("Pass artist reload. This is normal during migrations")
         super().save(*args, **kwargs)
 
 
 class Ingredient(models.Model):
+    updated_at = models.DateTimeField(auto_now=True)
     name = models.CharField(unique=True, max_length=50)
     alcohol_percentage = models.FloatField(
         help_text='Should be between 0 and 100'
@@ -131,16 +161,19 @@ class Ingredient(models.Model):
     def __str__(self):
         return self.name
 
-    def dispensers(self, filter_out_empty):
+    def dispensers(self, filter_out_empty, station=None):
         dispensers = self.dispenser_set.all()
         if filter_out_empty:
             dispensers = dispensers.filter(is_empty=False)
+        if station is not None:
+            dispensers = dispensers.filter(station=station)
         return dispensers
 
-    def is_available(self):
-        """potentially slow"""
+    def is_available(self, station=None):
+        """potentially slow. With station, only its dispensers count"""
         config = Configuration.get_solo()
-        return self.added_separately or self.dispensers(filter_out_empty=config.ux_empty_dispenser_makes_mix_not_available).exists()
+        return self.added_separately or self.dispensers(
+            filter_out_empty=config.ux_empty_dispenser_makes_mix_not_available, station=station).exists()
 
     @staticmethod
     def available_ingredients(ingredients_in_dispensers=None, include_added_separately=False):
@@ -210,8 +243,10 @@ class Mix(models.Model):
         return self.name
 
     def save(self, *args, **kwargs):
-        for dose in self.doses:
-            dose.set_quantity_to_zero_if_not_required()
+        if self.pk is not None:  # a new mix has no doses yet
+            # what Dose.set_quantity_to_zero_if_not_required does, with one query for all doses
+            self.doses.filter(ingredient__added_separately=True).exclude(quantity=0).update(
+                quantity=0, updated_at=timezone.now())
         super(Mix, self).save(*args, **kwargs)
 
     @property
@@ -244,8 +279,8 @@ class Mix(models.Model):
         q_and_d = self.doses.values_list('quantity', 'ingredient__density')
         return sum(map(lambda qd: qd[0] * settings.FACTOR_VOLUME_TO_MASS * qd[1] / settings.UNIT_DENSITY_DEFAULT, q_and_d))
 
-    def is_available(self):
-        return all(ingredient.is_available() for ingredient in self.ingredients.all())
+    def is_available(self, station=None):
+        return all(ingredient.is_available(station) for ingredient in self.ingredients.all())
 
     def calibrate_volume_to(self, desired_total):
         """Look out you respect the correct units"""
@@ -284,6 +319,7 @@ class Mix(models.Model):
 
 
 class Dose(models.Model):
+    updated_at = models.DateTimeField(auto_now=True)
     mix = models.ForeignKey(Mix, on_delete=models.CASCADE)
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
     quantity = models.FloatField(
@@ -332,6 +368,7 @@ class Order(models.Model):
     status = models.PositiveSmallIntegerField(choices=settings.SERVING_STATES_CHOICES, default=0)
     doses_served = models.PositiveSmallIntegerField(default=0)
     accepted = models.BooleanField(default=False)
+    station = models.PositiveSmallIntegerField(null=True, blank=True, help_text='Where it is served, set when accepted')
 
     def __str__(self):
         if self.mix:
@@ -345,9 +382,12 @@ class Order(models.Model):
         elif self.status == 1:
             config = Configuration.get_solo()
             if config.ux_use_green_button_to_start_serving:
-                return 'Press green button to start'
+                verbose = 'Press green button to start'
             else:
-                return 'Put a glass on the scale to start'
+                verbose = 'Put a glass on the scale to start'
+            if len(settings.STATIONS) > 1 and self.station is not None:
+                verbose += ' at station %i' % self.station
+            return verbose
         elif self.status == 2 and self.mix:
             try:
                 doses = self.mix.ordered_doses()
@@ -373,6 +413,16 @@ class Dispenser(models.Model):
         limit_choices_to={'added_separately': False},
     )
     is_empty = models.BooleanField()
+    station = models.PositiveSmallIntegerField(
+        default=0,
+        choices=STATION_CHOICES,
+        help_text="Serving station the pump pours into, see settings.STATIONS")
+    pwm_ramp_weight = models.FloatField(
+        default=20,
+        help_text="[g] remaining weight below which a PWM pump slows down, 0 to never slow down")
+    pwm_min_speed = models.FloatField(
+        default=0.3,
+        help_text="Speed between 0 and 1 of a PWM pump when the dose is almost reached")
 
     def __str__(self):
         return 'Dispenser {} with {}'.format(self.number, self.ingredient)
@@ -380,8 +430,15 @@ class Dispenser(models.Model):
     def save(self, *args, **kwargs):
         if not self.ingredient:
             self.is_empty = True
+        self.pwm_ramp_weight = _cut(self.pwm_ramp_weight, low=0)
+        self.pwm_min_speed = _cut(self.pwm_min_speed, low=0.01, high=1)
         super(Dispenser, self).save(*args, **kwargs)
 
+    def speed_for_remaining(self, remaining):
+        """PWM speed for the remaining weight [g] of a dose"""
+        from hardware.pumps import ramp_speed  # import here to avoid cross ref
+        return ramp_speed(remaining, self.pwm_ramp_weight, self.pwm_min_speed)
+
     @staticmethod
     def ingredients_in_dispensers(filter_out_empty):
         dispensers = Dispenser.objects.all()
@@ -390,9 +447,10 @@ class Dispenser(models.Model):
         return dispensers.values_list('ingredient', flat=True)
 
     @staticmethod
-    def get_available_dispenser(dose):
+    def get_available_dispenser(dose, station=None):
         config = Configuration.get_solo()
-        dispensers_query = dose.ingredient.dispensers(filter_out_empty=config.ux_empty_dispenser_makes_mix_not_available)
+        dispensers_query = dose.ingredient.dispensers(
+            filter_out_empty=config.ux_empty_dispenser_makes_mix_not_available, station=station)
         if dispensers_query.exists():
             return dispensers_query[0]
         else:
@@ -0,0 +1,261 @@
+"""
+Fetching for the scrap command: a few worker threads sharing one connection pool, a polite
+request rate, retries of the failed requests and an on-disk cache of the responses, so a
+rerun downloads nothing it already has. A checkpoint remembers the letters and drinks done and
+the ingredients matched to an existing one or created are written to a review file instead of
+asking at the prompt.
+
+FixtureHandler serves thecocktaildb pages and lookups generated from a seed, or replays a
+response cache, to run the scraper offline (runscrapfixtures command).
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import urllib3
+from django.utils.log import logging
+
+logger = logging.getLogger('autobar')
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class FetchError(Exception):
+    pass
+
+
+class PoolManagerCounter(urllib3.PoolManager):
+    def __init__(self, num_pools=10, headers=None, **connection_pool_kw):
+        self.counter = 0
+        self._counter_lock = threading.Lock()
+        urllib3.PoolManager.__init__(self, num_pools=num_pools, headers=headers, **connection_pool_kw)
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        with self._counter_lock:
+            self.counter += 1
+        return urllib3.PoolManager.urlopen(self, method, url, redirect=redirect, **kw)
+
+
+class ResponseCache:
+    """Bodies of the successful GET, one file each, named after the URL relative to the site"""
+
+    def __init__(self, directory, base_url):
+        self.directory = directory
+        self.base_url = base_url
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        relative = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        return os.path.join(self.directory, hashlib.sha1(relative.encode()).hexdigest())
+
+    def get(self, url):
+        try:
+            with open(self.path(url), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, url, data):
+        path = self.path(url)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+
+class Fetcher:
+    def __init__(self, pool_manager, cache=None, rate=5., retries=3, workers=4, timeout=10.):
+        self.pool_manager = pool_manager
+        self.cache = cache
+        self.period = 1 / rate if rate else 0  # [s] between two requests of all workers
+        self.retries = retries
+        self.workers = workers
+        self.timeout = timeout
+        self.hits = 0
+        self._next_request = 0
+        self._lock = threading.Lock()
+
+    def _wait_turn(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_request)
+            self._next_request = start + self.period
+        time.sleep(start - now)
+
+    def get(self, url):
+        """Body of url, from the cache if there, raises FetchError once the retries are exhausted"""
+        if self.cache is not None:
+            data = self.cache.get(url)
+            if data is not None:
+                self.hits += 1
+                return data
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                time.sleep(min(0.5 * 2 ** (attempt - 1), 10))  # backoff
+            self._wait_turn()
+            try:
+                response = self.pool_manager.request('GET', url, retries=False, timeout=self.timeout)
+            except urllib3.exceptions.HTTPError as e:  # connection refused or reset, timeout
+                error = e
+                continue
+            if response.status == 200:
+                if self.cache is not None:
+                    self.cache.put(url, response.data)
+                return response.data
+            error = 'HTTP %i' % response.status
+            if response.status not in RETRY_STATUS:
+                break
+        raise FetchError('%s: %s' % (url, error))
+
+    def get_many(self, urls):
+        """url -> body or FetchError, fetched by the workers"""
+        def fetch(url):
+            try:
+                return self.get(url)
+            except FetchError as e:
+                return e
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return dict(zip(urls, executor.map(fetch, urls)))
+
+
+class Checkpoint:
+    """Letters and drink ids done, saved in a JSON file to resume an interrupted run"""
+
+    def __init__(self, path):
+        self.path = path
+        self.letters = set()
+        self.drinks = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            self.letters = set(state['letters'])
+            self.drinks = set(state['drinks'])
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump({'letters': sorted(self.letters), 'drinks': sorted(self.drinks)}, f)
+        os.replace(self.path + '.tmp', self.path)
+
+
+class ReviewFile:
+    """Decisions taken without asking, one JSON line each, to check after the run"""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+
+    def write(self, issue, **details):
+        self.count += 1
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(dict(details, issue=issue)) + '\n')
+
+
+# Fixture site
+
+FIXTURE_INGREDIENTS = (
+    'Vodka', 'vodka', 'Vodak', 'Gin', 'Light rum', 'Lime juice', 'Lime Juice', 'Lemon juice',
+    'Triple sec', 'Tripel sec', 'Sugar syrup', 'Orange juice', 'Cranberry juice', 'Mint',
+    'Ice', 'Soda water', 'Fixture bitters',
+)
+FIXTURE_MEASURES = (
+    '1 oz', '1 1/2 oz', '3/4 oz', '2 cl', '4 cl', '1 tsp', '2 dashes', '1 shot', '1/2 cup',
+    'Fill with', '10 ml', 'Garnish', '', None,
+)
+
+
+def fixture_drink(letter, index, seed, base_url):
+    """Lookup record of the index-th drink of a letter, the same for the same seed"""
+    drink_id = 10000 + LETTERS.index(letter) * 100 + index
+    generator = random.Random('%s-%i' % (seed, drink_id))
+    drink = {
+        'idDrink': str(drink_id),
+        'strDrink': '%s fixture %i' % (letter.upper(), index),
+        'strInstructions': 'Shake with ice.',
+        'strDrinkThumb': '%simages/media/drink/%i.png' % (base_url, drink_id),
+    }
+    count = generator.randint(2, 6)
+    for i in range(1, 16):
+        drink['strIngredient%i' % i] = generator.choice(FIXTURE_INGREDIENTS) if i <= count else None
+        drink['strMeasure%i' % i] = generator.choice(FIXTURE_MEASURES) if i <= count else None
+    return drink
+
+
+def fixture_image(drink_id):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), (drink_id % 256, 80, 160)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    """
+    GET /browse.php?b=<letter>  page linking the drinks of the letter
+    GET /api/json/v1/1/lookup.php?i=<id>  {"drinks": [drink]}
+    GET /images/media/drink/<id>.png  image
+    A request fails with HTTP 503 at server.fail_rate, to exercise the retries.
+    """
+    def _respond(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        if server.delay:
+            time.sleep(server.delay)
+        if server.fail_rate and random.random() < server.fail_rate:
+            return self._respond(503, b'Try again', 'text/plain')
+        if server.cache is not None:  # replay of a previous run
+            data = server.cache.get(self.path.lstrip('/'))
+            if data is None:
+                return self._respond(404, b'Not in the cache', 'text/plain')
+            return self._respond(200, data, 'application/octet-stream')
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        base_url = 'http://%s/' % self.headers.get('Host')
+        try:
+            if url.path == '/browse.php':
+                letter = query['b'][0]
+                links = ''.join(
+                    '<a href="/drink.php?c=%s">%s</a>\n' % (drink['idDrink'], drink['strDrink'])
+                    for drink in (fixture_drink(letter, index, server.seed, base_url) for index in range(server.drinks)))
+                return self._respond(200, ('<html><body>%s</body></html>' % links).encode(), 'text/html')
+            if url.path == '/api/json/v1/1/lookup.php':
+                drink_id = int(query['i'][0])
+                letter, index = LETTERS[(drink_id - 10000) // 100], (drink_id - 10000) % 100
+                body = {'drinks': [fixture_drink(letter, index, server.seed, base_url)]}
+                return self._respond(200, json.dumps(body).encode(), 'application/json')
+            if url.path.startswith('/images/media/drink/'):
+                drink_id = int(os.path.splitext(os.path.basename(url.path))[0])
+                return self._respond(200, fixture_image(drink_id), 'image/png')
+        except (KeyError, ValueError, IndexError):
+            return self._respond(400, b'Bad request', 'text/plain')
+        return self._respond(404, b'Unknown path', 'text/plain')
+
+    def log_message(self, format, *args):
+        pass  # one line per request otherwise
+
+
+def serve_fixtures(address, drinks=5, seed=0, fail_rate=0., delay=0., cache_directory=None):
+    """Run the fixture site, blocks until interrupted"""
+    server = ThreadingHTTPServer(address, FixtureHandler)
+    server.daemon_threads = True
+    server.drinks, server.seed, server.fail_rate, server.delay = drinks, seed, fail_rate, delay
+    server.cache = ResponseCache(cache_directory, '') if cache_directory else None
+    logger.info('Scraper fixtures on http://%s:%s/', *address)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
@@ -0,0 +1,194 @@
+"""
+Incremental catalog sync between bars, without copying db.sqlite3.
+
+A bundle holds the ingredients, mixes (with their doses) and mix images changed since a
+watermark, as gzip compressed JSON lines: a header {"bundle", "since", "until"}, the ingredients,
+then the mixes, each image blob once per content hash just before the first mix using it.
+The "until" of the header is the watermark of the next export.
+
+apply() streams a bundle in bulk batches inside one transaction, rows already up to date are not
+written so applying the same bundle twice changes nothing. Deleted mixes are not carried, a
+watermark only sees rows that still exist.
+"""
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import zlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.log import logging
+
+from recipes import catalog
+from recipes.models import Dose, Ingredient, Mix
+
+logger = logging.getLogger('autobar')
+
+FORMAT = 1
+BATCH = 500  # mixes per query and per bulk apply
+
+
+class BundleError(Exception):
+    pass
+
+
+def parse_watermark(value):
+    """Aware datetime of an ISO 8601 watermark, None for an empty one (everything)"""
+    if not value:
+        return None
+    try:
+        watermark = datetime.fromisoformat(value)
+    except ValueError:
+        raise BundleError('Bad watermark %r' % value)
+    return watermark if timezone.is_aware(watermark) else timezone.make_aware(watermark, dt_timezone.utc)
+
+
+def changed_since(since):
+    """Ingredients and mixes changed after since, a mix changes with its doses"""
+    ingredients = Ingredient.objects.all()
+    mixes = Mix.objects.all()
+    if since is not None:
+        ingredients = ingredients.filter(updated_at__gt=since)
+        mixes = mixes.filter(Q(updated_at__gt=since) | Q(dose__updated_at__gt=since)).distinct()
+    return ingredients, mixes
+
+
+def file_hash(name):
+    with default_storage.open(name, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def export_lines(since=None, until=None):
+    """Items of the bundle of the changes in (since, until], until is now by default"""
+    # taken before the queries, a row changed meanwhile is exported again next time
+    until = until or timezone.now()
+    ingredients, mixes = changed_since(since)
+    yield {'bundle': FORMAT, 'since': since.isoformat() if since else None, 'until': until.isoformat()}
+    mix_ids = list(mixes.order_by('id').values_list('id', flat=True))
+    needed = Dose.objects.filter(mix_id__in=mix_ids).values('ingredient_id')
+    for ingredient in Ingredient.objects.filter(Q(id__in=ingredients.values('id')) | Q(id__in=needed)):
+        yield dict(catalog.ingredient_record(ingredient), ingredient=ingredient.name)
+    sent = set()
+    for start in range(0, len(mix_ids), BATCH):
+        chunk = Mix.objects.filter(id__in=mix_ids[start:start + BATCH])
+        records = catalog.mix_records(chunk)
+        for name, image, width, height in chunk.exclude(image='').exclude(image=None).values_list(
+                'name', 'image', 'image_width', 'image_height'):
+            try:
+                with default_storage.open(image, 'rb') as f:
+                    data = f.read()
+            except OSError as e:
+                logger.warning('Image of %s not exported: %s', name, e)
+                continue
+            digest = hashlib.sha1(data).hexdigest()
+            if digest not in sent:
+                sent.add(digest)
+                yield {'image': digest, 'data': base64.b64encode(data).decode()}
+            records[name]['image'] = {'name': image, 'hash': digest, 'width': width, 'height': height}
+        for record in records.values():
+            yield {'mix': record}
+
+
+def export(since=None, until=None):
+    """The bundle as gzip chunks, to stream to a file or an HTTP response"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip container
+    for item in export_lines(since, until):
+        chunk = compressor.compress(json.dumps(item, separators=(',', ':')).encode() + b'\n')
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+
+def safe_image_name(name):
+    name = os.path.normpath(name)
+    if os.path.isabs(name) or name.startswith('..'):
+        raise BundleError('Bad image name %r' % name)
+    return name
+
+
+class Applier:
+    def __init__(self):
+        self.ingredients = {}
+        self.mixes = []
+        self.blobs = {}  # content hash -> data, until the mixes using it are applied
+        self.stored = {}  # content hash -> name in the storage
+        self.counts = {'created': 0, 'updated': 0, 'images': 0}
+
+    def add(self, item):
+        if 'mix' in item:
+            self.mixes.append(item['mix'])
+            if len(self.mixes) >= BATCH:
+                self.flush()
+        elif 'ingredient' in item:
+            name = item.pop('ingredient')
+            self.ingredients[name] = {field: item[field] for field in catalog.INGREDIENT_FIELDS}
+        elif 'image' in item:
+            self.blobs[item['image']] = base64.b64decode(item['data'])
+        else:
+            raise BundleError('Unknown item %s' % ', '.join(item))
+
+    def store_image(self, image):
+        """Name of the image in the storage, written only if its content differs"""
+        name = safe_image_name(image['name'])
+        digest = image['hash']
+        if default_storage.exists(name) and file_hash(name) == digest:
+            self.stored[digest] = name  # for a mix of a later batch with the same picture
+            return name
+        if digest in self.blobs:
+            data = self.blobs[digest]
+        elif digest in self.stored:  # same picture as a previous mix
+            with default_storage.open(self.stored[digest], 'rb') as f:
+                data = f.read()
+        else:
+            raise BundleError('Image %s of %s is not in the bundle' % (digest, name))
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        stored = default_storage.save(name, ContentFile(data))
+        self.stored[digest] = stored
+        self.counts['images'] += 1
+        return stored
+
+    def flush(self):
+        images = {}
+        for record in self.mixes:
+            image = record.pop('image', None)
+            if image is not None:
+                images[record['name']] = (self.store_image(image), image['width'], image['height'])
+        counts = catalog.apply_records(self.mixes, self.ingredients, images=images)
+        for key, value in counts.items():
+            self.counts[key] += value
+        self.ingredients = {}  # all come before the mixes, so with the first batch
+        self.mixes = []
+        self.blobs = {}
+
+
+@transaction.atomic
+def apply(stream):
+    """
+    Apply the gzip bundle of a binary file object, read as it goes.
+    Returns its header with the number of mixes created and updated and of images written.
+    """
+    applier = Applier()
+    header = None
+    try:
+        for line in io.TextIOWrapper(gzip.GzipFile(fileobj=stream), encoding='utf-8'):
+            item = json.loads(line)
+            if header is None:
+                if item.get('bundle') != FORMAT:
+                    raise BundleError('Not a catalog bundle of format %i' % FORMAT)
+                header = item
+                continue
+            applier.add(item)
+    except (OSError, EOFError, ValueError) as e:  # truncated or not gzip, bad JSON
+        raise BundleError('Unreadable bundle: %s' % e)
+    if header is None:
+        raise BundleError('Empty bundle')
+    applier.flush()
+    return dict(header, **applier.counts)
@@ -1,3 +1,124 @@
-from django.test import TestCase
+import io
+import json
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+from recipes.fleet import Catalog
+from recipes.importing import iter_json_array
+from recipes.measures import get_clean_measure
+from recipes.models import Dose, Ingredient, Mix
+
+MEASURES = (  # measure, expected [cL] or None when not understood
+    ('1 oz', 3),
+    ('1 1/2 oz', 4.5),
+    ('1-1/2 oz', 4.5),
+    ('3/4 oz', 2.25),
+    ('1/3 oz', 1),
+    ('2/3 oz', 2),
+    ('½ oz', 1.5),
+    ('1½ oz', 4.5),
+    ('1.5 oz', 4.5),
+    ('1 oz.', 3),
+    ('1oz', 3),
+    ('2 ounces', 6),
+    ('1-2 oz', 4.5),
+    ('2-3 oz', 7.5),
+    ('1 to 2 tsp', 0.9),
+    ('1 or 2 dashes', 2.25),
+    ('2 cl', 2),
+    ('1,5 cl', 1.5),
+    ('10 ml', 1),
+    ('1 dl', 10),
+    ('1 tsp', 0.6),
+    ('1/2 tsp grenadine', 0.3),
+    ('1 tblsp', 1.5),
+    ('2 tbsp', 3),
+    ('1 shot', 3),
+    ('2 shots', 6),
+    ('1 jigger', 4.5),
+    ('2 parts', 6),
+    ('1 dash', 1.5),
+    ('2 dashes', 3),
+    ('Dash', 1.5),
+    ('3 drops', 1.8),
+    ('1/2 cup', 15),
+    ('2 cups', 60),
+    ('1 fifth', 6),
+    ('Twist of', 1),
+    ('1 twist', 1.5),
+    ('10 gr', 1),
+    ('Fill with', 30),
+    ('Garnish', None),
+    ('grenadine', None),
+    ('2 grenadine', None),
+    ('1 club soda', None),
+    ('Juice of 1/2', None),
+    ('1 splash', None),
+    ('', None),
+)
+
+
+class MeasureTestCase(SimpleTestCase):
+    def test_measures(self):
+        for measure, expected in MEASURES:
+            with self.subTest(measure=measure):
+                value = get_clean_measure(measure)
+                if expected is None:
+                    self.assertIsNone(value)
+                else:
+                    self.assertAlmostEqual(value, expected, places=2)
+
+    def test_surrounding_spaces(self):
+        self.assertEqual(get_clean_measure('  1 oz \n'), 3)
+
+
+class ReadStream(io.StringIO):
+    """Counts the characters read"""
+    consumed = 0
+
+    def read(self, size=-1):
+        chunk = super().read(size)
+        self.consumed += len(chunk)
+        return chunk
+
+
+class JsonArrayTestCase(SimpleTestCase):
+    drinks = [{'strDrink': 'Mojito [%i]' % index, 'strMeasure1': '1 "oz"', 'strIngredient1': None} for index in range(50)]
+
+    def test_items(self):
+        text = json.dumps({'meta': 'x[y "z', 'drinks': self.drinks})
+        for chunk_size in (1, 7, 1 << 16):
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(list(iter_json_array(io.StringIO(text), chunk_size=chunk_size)), self.drinks)
+
+    def test_malformed_is_not_read_whole(self):
+        text = json.dumps(self.drinks[:2])[:-1] + ', {"strDrink": oops}, ' + json.dumps(self.drinks)[1:]
+        stream = ReadStream(text)
+        with self.assertRaises(ValueError):
+            list(iter_json_array(stream, chunk_size=64))
+        self.assertLess(stream.consumed, len(text) / 2)
+
+    def test_item_too_long(self):
+        stream = ReadStream('[{"strDrink": "' + 'x' * 10000)
+        with self.assertRaises(ValueError):
+            list(iter_json_array(stream, chunk_size=64, max_item_size=1000))
+        self.assertLess(stream.consumed, 2000)
+
+
+class CatalogTestCase(TestCase):
+    def setUp(self):
+        self.rum = Ingredient.objects.create(name='Rum', alcohol_percentage=40)
+        lime = Ingredient.objects.create(name='Lime', alcohol_percentage=0)
+        for name, ingredient in (('Daiquiri', self.rum), ('Limeade', lime)):
+            Dose.objects.create(mix=Mix.objects.create(name=name), ingredient=ingredient, quantity=4, number=1)
+        self.catalog = Catalog(min_refresh_period=0)
+
+    def test_ingredient_change(self):
+        version = self.catalog.refresh()
+        self.assertEqual(self.catalog.refresh(), version)
+        self.rum.density = 950
+        self.rum.save()
+        delta = self.catalog.delta(self.catalog.epoch, version)
+        self.assertEqual(delta['version'], version + 1)
+        self.assertEqual([mix['name'] for mix in delta['mixes']], ['Daiquiri'])
+        self.assertEqual(delta['ingredients']['Rum']['density'], 950)
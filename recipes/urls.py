@@ -7,6 +7,8 @@ urlpatterns = [
     path('mix-info/<int:pk>', views.MixModalView.as_view(), name='modal_mix'),
     path('order/create/<int:mix_id>', views.CreateOrderView.as_view(), name='create_order'),
     path('order/check/<int:order_id>', views.CheckOrderView.as_view(), name='check_order'),
+    path('catalog/export', views.CatalogExportView.as_view(), name='catalog_export'),
+    path('fleet/order', views.FleetOrderView.as_view(), name='fleet_order'),
     path('mix/like/<int:mix_id>', views.MixLikeView.as_view(), name='like'),
     path('mixes/<slug:sort_by>/<slug:subsort_by>/', views.Mixes.as_view(), name='mixes_ss'),
     path('mixes/<slug:sort_by>/', views.Mixes.as_view(), name='mixes_s'),
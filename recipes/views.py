@@ -1,8 +1,12 @@
+import json
 from collections import OrderedDict
 
+from django.conf import settings
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import TemplateView
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseServerError, JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseServerError, JsonResponse, StreamingHttpResponse
+from django.utils.decorators import method_decorator
 from django.utils.log import logging
 from django.shortcuts import get_object_or_404
 from django.http import Http404
@@ -10,7 +14,9 @@ from django.http import Http404
 from bootstrap_modal_forms.generic import BSModalReadView
 
 from .models import Mix, Order, Configuration
-from hardware.serving import CocktailArtist
+from recipes import fleet, sync
+from hardware.rpc import get_artist
+from hardware.views import TimedViewMixin
 
 
 logger = logging.getLogger('autobar')
@@ -90,16 +96,40 @@ class Mixes(TemplateView):
         return context
 
 
-class CreateOrderView(View):
+def place_order(mix):
+    order = Order.objects.create(mix=mix)  # saved first, the artist may run in another process
+    artist = get_artist()
+    order.accepted = artist.accept_new_order(order)
+    order.save(update_fields=['accepted'])
+    if order.accepted:
+        mix.count += 1
+        mix.save()
+    return order
+
+
+class CreateOrderView(TimedViewMixin, View):
     def post(self, request, mix_id, *args, **kwargs):
         mix = get_object_or_404(Mix, id=mix_id)
-        order = Order(mix=mix)
-        artist = CocktailArtist.getInstance()
-        order.accepted = artist.accept_new_order(order)
-        order.save()
-        if order.accepted:
-            mix.count += 1
-            mix.save()
+        if settings.FLEET_COORDINATOR and settings.FLEET_ROUTE_ORDERS:
+            routed = fleet.route_order(mix)  # None when no bar took it, it is served here
+            if routed is not None and routed['node'] != fleet.node_name():
+                return JsonResponse(
+                    {
+                        'order_id': None,
+                        'accepted': routed['accepted'],
+                        'node': routed['node'],
+                        'status_verbose': 'Served by %s' % routed['node'],
+                    }
+                )
+            if routed is not None:
+                # the coordinator chose this bar, the order went through FleetOrderView
+                return JsonResponse(
+                    {
+                        'order_id': routed['order_id'],
+                        'accepted': routed['accepted'],
+                    }
+                )
+        order = place_order(mix)
         return JsonResponse(
             {
                 'order_id': order.pk,
@@ -108,7 +138,43 @@ class CreateOrderView(View):
         )
 
 
-class CheckOrderView(View):
+@method_decorator(csrf_exempt, name='dispatch')
+class FleetOrderView(TimedViewMixin, View):
+    """Orders routed to this bar by the fleet coordinator, {"mix": name}"""
+
+    def post(self, request, *args, **kwargs):
+        if not fleet.authorized(request.headers):
+            return HttpResponseForbidden('Bad fleet token')
+        try:
+            name = json.loads(request.body.decode())['mix']
+        except (ValueError, KeyError):
+            return HttpResponseBadRequest('Expected {"mix": name}')
+        mix = get_object_or_404(Mix, name=name)
+        order = place_order(mix)
+        return JsonResponse(
+            {
+                'order_id': order.pk,
+                'accepted': order.accepted,
+            }
+        )
+
+
+class CatalogExportView(View):
+    """Bundle of the catalog changes since the watermark ?since=, see recipes/sync.py"""
+
+    def get(self, request, *args, **kwargs):
+        if not fleet.authorized(request.headers):
+            return HttpResponseForbidden('Bad fleet token')
+        try:
+            since = sync.parse_watermark(request.GET.get('since'))
+        except sync.BundleError as e:
+            return HttpResponseBadRequest(str(e))
+        response = StreamingHttpResponse(sync.export(since), content_type='application/gzip')
+        response['Content-Disposition'] = 'attachment; filename="catalog.jsonl.gz"'
+        return response
+
+
+class CheckOrderView(TimedViewMixin, View):
     def get(self, request, order_id, *args, **kwargs):
         order = get_object_or_404(Order, id=order_id)
         done = order.status in [3, 4] or not order.accepted
@@ -77,7 +77,8 @@ function set_mixme_and_stop_button(div_id, mix_id, csrf_token, error_div_id) {
         },
         error: function(error) {
           console.log(error);
-          $(error_div_id).html(error.responseText);
+          /* the hardware did not get the stop, the pumps may still run */
+          $(error_div_id).html(error.responseJSON ? error.responseJSON['error'] : error.responseText);
         }
       });
     } else {
@@ -88,7 +89,11 @@ function set_mixme_and_stop_button(div_id, mix_id, csrf_token, error_div_id) {
           csrfmiddlewaretoken: csrf_token,
         },
         success: function(response){
-          if (response['accepted']) {
+          if (response['accepted'] && response['node']) {
+            /* another bar of the fleet makes it */
+            set_info_bubble_html(response['status_verbose']);
+            change_info_bubble_color("btn-secondary", "btn-success");
+          } else if (response['accepted']) {
             switch_to_stop_button(div_id);
             start_animation();
             continuous_check_order(response['order_id'], 500);